@@ -0,0 +1,443 @@
+import json
+import time
+import asyncio
+
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+from loguru import logger
+
+import dbpool
+import settings
+
+
+# Hot path queries of the asyncio data access layer. Each connection of
+# the pool caches these as server side prepared statements.
+
+SELECT_ACTIVE_USER = """
+SELECT "id", "username", "password", "phone_number", "email", "role",
+    "status", "created_at", "updated_at"
+FROM "user"
+WHERE "username" = $1 AND "status" = 'active'
+"""
+
+# Sessions of bearer tokens, see tokens.py
+INSERT_SESSION = """
+INSERT INTO "session" ("id", "expires_at", "metadata", "created_at", "updated_at", "user")
+VALUES ($1, $2, '{}', $3, $3, $4)
+"""
+
+# The user of a session still signed in, to refresh its access token
+SELECT_SESSION_USER = """
+SELECT "user"."id", "user"."username", "user"."role", "user"."status"
+FROM "session"
+JOIN "user" ON "user"."id" = "session"."user"
+WHERE "session"."id" = $1 AND "session"."user" = $2
+    AND "session"."revoked_at" IS NULL AND "session"."expires_at" > $3
+    AND "user"."status" = 'active'
+"""
+
+REVOKE_SESSION = """
+UPDATE "session" SET "revoked_at" = $2, "updated_at" = $2
+WHERE "id" = $1 AND "revoked_at" IS NULL
+"""
+
+SELECT_REVOKED_SESSIONS = """
+SELECT "id", "revoked_at" FROM "session" WHERE "revoked_at" > $1
+"""
+
+SELECT_REVOKED_USERS = """
+SELECT "username", "token_valid_after" FROM "user" WHERE "token_valid_after" > $1
+"""
+
+# The question being answered with its exam's totals and whether the
+# learner takes part in the exam, in one round trip
+SELECT_QUESTION_FOR_SUBMISSION = """
+SELECT q."id", q."multi_choice", q."marks", q."answer", q."exam",
+    e."total_marks", e."total_number_of_questions",
+    p."id" AS "participant", p."deadline"
+FROM "question" q
+JOIN "exam" e ON e."id" = q."exam"
+LEFT JOIN "participant" p ON p."exam" = q."exam" AND p."user" = $2
+WHERE q."id" = $1
+"""
+
+INSERT_SUBMISSION = """
+INSERT INTO "submission" ("id", "answer", "mark", "marks_obtained",
+    "comment", "metadata", "created_at", "updated_at", "question", "user")
+VALUES ($1, $2, $3, $4, '', '{}', $5, $5, $6, $7)
+RETURNING *
+"""
+
+SELECT_GRADE_BANDS = """
+SELECT "id", "starting_percentage", "ending_percentage" FROM "grade"
+"""
+
+# $3..$6 is the (ticks, crosses, unmarked, marks_obtained) delta,
+# $7 and $8 the exam's totals and $9 the grade ids by percentage
+UPDATE_PERFORMANCE_DELTA = """
+UPDATE "performance" p SET
+    "ticks" = p."ticks" + $3,
+    "crosses" = p."crosses" + $4,
+    "unmarked" = p."unmarked" + $5,
+    "marks_obtained" = p."marks_obtained" + $6,
+    "total_marks" = $7,
+    "total_number_of_questions" = $8,
+    "percentage" = (p."marks_obtained" + $6) * 100 / $7,
+    "grade" = ($9::uuid[])[GREATEST(0, LEAST(100, (p."marks_obtained" + $6) * 100 / $7)) + 1]
+WHERE p."user" = $1 AND p."exam" = $2
+RETURNING p.*
+"""
+
+SELECT_LEARNER_TALLY = """
+SELECT
+    COUNT(*) FILTER (WHERE s."mark" IN ('tick', 'auto_tick')) AS "ticks",
+    COUNT(*) FILTER (WHERE s."mark" IN ('cross', 'auto_cross')) AS "crosses",
+    COUNT(*) FILTER (WHERE s."mark" = 'unmarked') AS "unmarked",
+    COALESCE(SUM(s."marks_obtained") FILTER (
+        WHERE s."mark" IN ('tick', 'auto_tick')
+    ), 0) AS "marks_obtained"
+FROM "submission" s
+JOIN "question" q ON q."id" = s."question"
+WHERE q."exam" = $1 AND s."user" = $2
+"""
+
+SELECT_EXAM_TOTALS = """
+SELECT COALESCE(SUM("marks"), 0) AS "total_marks",
+    COUNT(*) AS "total_number_of_questions"
+FROM "question"
+WHERE "exam" = $1
+"""
+
+UPDATE_EXAM_TOTALS = """
+UPDATE "exam" SET "total_marks" = $2, "total_number_of_questions" = $3
+WHERE "id" = $1
+"""
+
+# Inserts a recomputed performance, or with $12 set overwrites an
+# existing one. Returns nothing when the row exists and $12 isn't set.
+UPSERT_PERFORMANCE = """
+INSERT INTO "performance" ("id", "ticks", "crosses", "unmarked",
+    "marks_obtained", "total_marks", "total_number_of_questions",
+    "percentage", "metadata", "created_at", "updated_at", "grade", "exam",
+    "user")
+VALUES ($1, $2, $3, $4, $5, $6, $7, $8, '{}', $9, $9, $10, $11, $13)
+ON CONFLICT ("user", "exam") DO UPDATE SET
+    "ticks" = EXCLUDED."ticks",
+    "crosses" = EXCLUDED."crosses",
+    "unmarked" = EXCLUDED."unmarked",
+    "marks_obtained" = EXCLUDED."marks_obtained",
+    "total_marks" = EXCLUDED."total_marks",
+    "total_number_of_questions" = EXCLUDED."total_number_of_questions",
+    "percentage" = EXCLUDED."percentage",
+    "grade" = EXCLUDED."grade"
+WHERE $12
+RETURNING *
+"""
+
+SELECT_EXAM_EXISTS = """
+SELECT EXISTS (SELECT 1 FROM "exam" WHERE "id" = $1)
+"""
+
+# The columns of core.PERFORMANCE_COLUMNS
+SELECT_EXAM_PERFORMANCE = """
+SELECT "id", "ticks", "crosses", "unmarked", "marks_obtained", "total_marks",
+    "total_number_of_questions", "percentage", "metadata", "created_at",
+    "updated_at", "grade", "exam", "user"
+FROM "performance" WHERE "exam" = $1
+"""
+
+# The exam's version and whether the user takes part in it
+SELECT_EXAM_VERSION = """
+SELECT e."version", e."user" = $2 AS "owner", p."id" AS "participant"
+FROM "exam" e
+LEFT JOIN "participant" p ON p."exam" = e."id" AND p."user" = $2
+WHERE e."id" = $1
+"""
+
+# An exam paper as learners get it, the answers left out, serialized by
+# the database. The version is read in the same snapshot as the questions
+SELECT_EXAM_PAPER = """
+SELECT e."version", json_build_object(
+    'exam', e."id",
+    'name', e."name",
+    'version', e."version",
+    'time_duration', e."time_duration",
+    'total_marks', e."total_marks",
+    'total_number_of_questions', e."total_number_of_questions",
+    'questions', COALESCE((
+        SELECT json_agg(json_build_object(
+            'id', q."id",
+            'number', q."number",
+            'text', q."text",
+            'multi_choice', q."multi_choice",
+            'marks', q."marks"
+        ) ORDER BY q."number")
+        FROM "question" q
+        WHERE q."exam" = e."id"
+    ), '[]')
+)::text AS "paper"
+FROM "exam" e
+WHERE e."id" = $1
+"""
+
+# Unmarked submissions to the tutor's exams oldest first, read through
+# idx_submission__unmarked. $2 is an exam to limit the queue to or NULL
+MARKING_QUEUE = """
+SELECT s."id", s."answer", s."created_at", s."user", u."username",
+    s."question", q."number", q."text", q."marks", q."answer" AS "expected_answer",
+    q."exam", e."name" AS "exam_name"
+FROM "submission" s
+JOIN "question" q ON q."id" = s."question"
+JOIN "exam" e ON e."id" = q."exam"
+JOIN "user" u ON u."id" = s."user"
+WHERE s."mark" = 'unmarked' AND e."user" = $1
+    AND ($2::uuid IS NULL OR q."exam" = $2) {}
+ORDER BY s."created_at", s."id"
+"""
+
+SELECT_MARKING_QUEUE = MARKING_QUEUE.format("") + "LIMIT $3"
+
+# $3 and $4 the (created_at, id) of the last submission of the page before
+SELECT_MARKING_QUEUE_AFTER = MARKING_QUEUE.format(
+    'AND (s."created_at", s."id") > ($3, $4)'
+) + "LIMIT $5"
+
+# Statistics of an exam in one round trip, no row when the exam doesn't
+# exist. Questions are only counted as answered right or wrong once marked.
+SELECT_EXAM_STATS = """
+WITH "scores" AS (
+    SELECT "percentage", "grade" FROM "performance" WHERE "exam" = $1
+), "answers" AS (
+    SELECT q."id", q."number", q."marks",
+        COUNT(s."id") AS "submissions",
+        COUNT(s."id") FILTER (WHERE s."mark" IN ('tick', 'auto_tick')) AS "correct",
+        COUNT(s."id") FILTER (WHERE s."mark" IN ('cross', 'auto_cross')) AS "incorrect",
+        COUNT(s."id") FILTER (WHERE s."mark" = 'unmarked') AS "unmarked"
+    FROM "question" q
+    LEFT JOIN "submission" s ON s."question" = q."id"
+    WHERE q."exam" = $1
+    GROUP BY q."id"
+)
+SELECT e."id" AS "exam", e."total_marks", e."total_number_of_questions",
+    (SELECT COUNT(*) FROM "participant" WHERE "exam" = $1) AS "participants",
+    (SELECT COUNT(*) FROM "scores") AS "graded",
+    (SELECT ROUND(AVG("percentage"), 2)::float8 FROM "scores") AS "mean",
+    (SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY "percentage") FROM "scores") AS "median",
+    (SELECT ROUND(stddev_pop("percentage"), 2)::float8 FROM "scores") AS "standard_deviation",
+    (SELECT MIN("percentage") FROM "scores") AS "lowest",
+    (SELECT MAX("percentage") FROM "scores") AS "highest",
+    (SELECT COALESCE(SUM("unmarked"), 0)::int FROM "answers") AS "unmarked",
+    (
+        SELECT jsonb_agg(jsonb_build_object(
+            'grade', g."letter_grade",
+            'starting_percentage', g."starting_percentage",
+            'ending_percentage', g."ending_percentage",
+            'learners', (SELECT COUNT(*) FROM "scores" sc WHERE sc."grade" = g."id")
+        ) ORDER BY g."starting_percentage" DESC)
+        FROM "grade" g
+    ) AS "grades",
+    (
+        SELECT COALESCE(jsonb_agg(jsonb_build_object(
+            'question', a."id",
+            'number', a."number",
+            'marks', a."marks",
+            'submissions', a."submissions",
+            'correct', a."correct",
+            'incorrect', a."incorrect",
+            'unmarked', a."unmarked",
+            'percentage_correct', ROUND(
+                a."correct" * 100.0 / NULLIF(a."correct" + a."incorrect", 0), 2
+            )
+        ) ORDER BY a."number"), '[]')
+        FROM "answers" a
+    ) AS "questions"
+FROM "exam" e
+WHERE e."id" = $1
+"""
+
+# Performances of an exam best first, served by idx_performance__ranking.
+# The id breaks ties so a page can start after any row.
+RANKING = """
+SELECT p."id", p."user", u."username", p."percentage", p."marks_obtained",
+    p."total_marks", p."ticks", p."crosses", p."unmarked",
+    p."total_number_of_questions", g."letter_grade" AS "grade"
+FROM "performance" p
+JOIN "user" u ON u."id" = p."user"
+JOIN "grade" g ON g."id" = p."grade"
+WHERE p."exam" = $1 {}
+ORDER BY p."percentage" DESC, p."marks_obtained" DESC, p."id" DESC
+"""
+
+SELECT_RANKING = RANKING.format("")
+
+SELECT_LEADERBOARD = RANKING.format("") + "LIMIT $2"
+
+# $2..$4 the (percentage, marks_obtained, id) of the last row of the page before
+SELECT_LEADERBOARD_AFTER = RANKING.format(
+    'AND (p."percentage", p."marks_obtained", p."id") < ($2, $3, $4)'
+) + "LIMIT $5"
+
+
+class Connection(asyncpg.Connection):
+    """
+    Remembers its age and when it was last checked for the pool policy,
+    and reports how long each of its queries took, see dbpool.query_finished.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.opened_at = self.checked_at = time.monotonic()
+
+    async def execute(self, query: str, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            return await super().execute(query, *args, **kwargs)
+        finally:
+            dbpool.query_finished(query, started)
+
+    async def executemany(self, command: str, args, **kwargs):
+        started = time.monotonic()
+        try:
+            return await super().executemany(command, args, **kwargs)
+        finally:
+            dbpool.query_finished(command, started)
+
+    async def fetch(self, query: str, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            return await super().fetch(query, *args, **kwargs)
+        finally:
+            dbpool.query_finished(query, started)
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            return await super().fetchrow(query, *args, **kwargs)
+        finally:
+            dbpool.query_finished(query, started)
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            return await super().fetchval(query, *args, **kwargs)
+        finally:
+            dbpool.query_finished(query, started)
+
+    def expired(self):
+        return time.monotonic() - self.opened_at > settings.DB_POOL_MAX_LIFETIME
+
+    async def healthy(self):
+        if time.monotonic() - self.checked_at <= settings.DB_POOL_HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            await self.execute(settings.DB_POOL_HEALTH_CHECK_QUERY)
+        except (asyncpg.PostgresError, OSError) as error:
+            logger.warning("Database connection failed health check : {}".format(error))
+            return False
+        self.checked_at = time.monotonic()
+        return True
+
+
+pool = None
+stats = dbpool.PoolStats("asyncio")
+
+
+async def init_connection(connection):
+    stats.opened += 1
+    await connection.set_type_codec(
+        "jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
+    )
+
+
+def connection_settings():
+    return dict(
+        host=settings.DB_HOST,
+        port=int(settings.DB_PORT),
+        user=settings.DB_USER,
+        password=str(settings.DB_PASS),
+        database=settings.DB_NAME
+    )
+
+
+async def connect():
+    global pool
+    pool = await asyncpg.create_pool(
+        **connection_settings(),
+        min_size=settings.DB_POOL_MIN_SIZE,
+        max_size=settings.DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=settings.DB_POOL_IDLE_TIMEOUT,
+        statement_cache_size=settings.DB_STATEMENT_CACHE_SIZE,
+        connection_class=Connection,
+        init=init_connection
+    )
+
+
+async def disconnect():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+
+async def checkout():
+    started = time.monotonic()
+    stats.waiting += 1
+    try:
+        while True:
+            remaining = settings.DB_POOL_TIMEOUT - (time.monotonic() - started)
+            try:
+                connection = await pool.acquire(timeout=max(remaining, 0))
+            except asyncio.TimeoutError:
+                stats.timeouts += 1
+                raise dbpool.PoolTimeout(
+                    "No database connection free within {}s, all {} in use".format(
+                        settings.DB_POOL_TIMEOUT, settings.DB_POOL_MAX_SIZE
+                    )
+                )
+            if await connection.healthy():
+                break
+            # A closed connection is reopened by the pool on its next use
+            stats.failed_health_checks += 1
+            connection.terminate()
+            await pool.release(connection)
+    finally:
+        stats.waiting -= 1
+
+    stats.waited(time.monotonic() - started)
+    stats.in_use += 1
+    return connection
+
+
+async def checkin(connection):
+    stats.in_use -= 1
+    if connection.expired():
+        stats.closed += 1
+        await connection.close()
+    await pool.release(connection)
+
+
+@asynccontextmanager
+async def acquire():
+    connection = await checkout()
+    try:
+        yield connection
+    finally:
+        await checkin(connection)
+
+
+@asynccontextmanager
+async def transaction():
+    async with acquire() as connection:
+        async with connection.transaction():
+            yield connection
+
+
+def as_dict():
+    if pool is None:
+        return None
+    return stats.as_dict(
+        pool.get_size(), pool.get_idle_size(),
+        settings.DB_POOL_MIN_SIZE, settings.DB_POOL_MAX_SIZE
+    )
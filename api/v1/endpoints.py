@@ -12,32 +12,122 @@ from fastapi import UploadFile
 from fastapi import Depends
 from fastapi import status
 from fastapi import HTTPException
+from fastapi import Header
+from fastapi import Request
 
-from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from typing import List
 
 import schemas
 import core
+import metrics
 import models
+import serialization
+import settings
 import util
 
 security = HTTPBasic()
 
-router = APIRouter(redirect_slashes=False)
+
+class Route(serialization.JSONRoute, metrics.InstrumentedRoute):
+    """Measured, and writing Projected content without FastAPI's encoding."""
+
+
+router = APIRouter(
+    redirect_slashes=False,
+    route_class=Route,
+    default_response_class=serialization.JSONResponse
+)
 
 # Create video storage directory
 videos_dir = '{}/videos/'.format(os.getcwd())
 util.mkdir_p(videos_dir)
 
+# Unfinished resumable uploads live next to the videos so finishing one
+# is a rename on the same file system
+uploads_dir = '{}.uploads/'.format(videos_dir)
+util.mkdir_p(uploads_dir)
+
+
+@router.post("/auth/token", response_model=schemas.Token, tags=["auth"], status_code=200)
+@util.global_exception_handler
+async def sign_in(sign_in : schemas.SignIn):
+    """
+    Description:
+
+        This endpoint signs a user in and returns a bearer access token and a refresh token.
+
+    Please note the following:
+
+        - Send the access token as "Authorization: Bearer <access_token>" instead of http basic auth, the password is checked once here rather than on every request.
+        - The access token expires after expires_in seconds (TOKEN_TTL), get a new one from POST /auth/refresh.
+        - The refresh token expires after refresh_expires_in seconds (REFRESH_TOKEN_TTL), sign in again then.
+        - Inactive accounts can't sign in.
+
+    Params:
+
+        username
+            - String
+            - Mandatory
+            - E.g tutor
+
+        password
+            - String
+            - Mandatory
+            - E.g tutor123
+    """
+    return await core.sign_in(sign_in)
+
+
+@router.post("/auth/refresh", response_model=schemas.Token, tags=["auth"], status_code=200)
+@util.global_exception_handler
+async def refresh_token(refresh : schemas.RefreshToken):
+    """
+    Description:
+
+        This endpoint returns a new access token for a refresh token.
+
+    Please note the following:
+
+        - The refresh token returned is the one sent, it's valid until its session expires or is signed out.
+        - Sessions that were signed out, or whose account is no longer active, get a 401.
+
+    Params:
+
+        refresh_token
+            - String
+            - Mandatory
+            - This is the refresh_token returned by POST /auth/token.
+    """
+    return await core.refresh_token(refresh)
+
+
+@router.post("/auth/logout", response_model=schemas.SignOut, tags=["auth"], status_code=200)
+@util.global_exception_handler
+async def sign_out(user : models.User = Depends(core.authenticate_user)):
+    """
+    Description:
+
+        This endpoint signs out the session of the bearer access token sent.
+
+    Please note the following:
+
+        - The session's access and refresh tokens are refused from then on, by every worker.
+        - Requests using http basic auth have no session to sign out and get a 400.
+    """
+    return await core.sign_out(user)
+
 
 @router.get("/user", response_model=schemas.User, tags=["user"])
 @util.global_exception_handler
-def get_user(user : models.User = Depends(core.authenticate_user)):
+async def get_user(user : models.User = Depends(core.authenticate_user)):
     """
     Description:
 
         This endpoint just return the users account details.
     """
-    return user
+    return await core.get_profile(user)
 
 
 @router.post("/video", response_model=schemas.UploadedFile, tags=["video"], status_code=201)
@@ -53,9 +143,8 @@ def upload_video(
 
     Please note the following:
 
-        - Video tutorials should be uploaded to a file storage service e.g amazon s3.
-        - Below is just for demo purpose.
-        - The file name is the video tutorial name.
+        - Videos are stored by their SHA-256 on the configured storage (STORAGE_DRIVER local or s3), identical videos are stored once.
+        - The file name is the video tutorial name, uploading the same name again points it at the new video.
         - Only tutors can upload videos
     
     Demo:
@@ -63,13 +152,122 @@ def upload_video(
         If you upload a video with file name as test.mp4 you will be able to see it stream in this swagger spec stream video section. 
     """
 
-    return core.upload_video(user.role, uploaded_file, videos_dir)
+    return core.upload_video(user.id, user.role, uploaded_file, uploads_dir)
+
+
+@router.post("/video/uploads", response_model=schemas.VideoUploadOut, tags=["video"], status_code=201)
+@util.global_exception_handler
+def init_video_upload(
+    video: schemas.VideoUpload,
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint starts a resumable, chunked video upload.
+
+    Please note the following:
+
+        - Only tutors can upload videos.
+        - Send the video in chunks with PUT /video/uploads/{upload_id}?offset=<offset>, each at most max_chunk_size bytes.
+        - After a failure GET /video/uploads/{upload_id} tells the offset to resume from.
+        - Finish with POST /video/uploads/{upload_id}/finalize.
+        - Unfinished uploads are discarded after a day.
+
+    Params:
+
+        file_name
+            - String
+            - Mandatory
+            - E.g kcse_prep.mp4
+            - The file name is the video tutorial name.
+
+        size
+            - Integer
+            - Mandatory
+            - E.g 1073741824
+            - The size of the whole video in bytes.
+
+        sha256
+            - String
+            - Optional
+            - The hex SHA-256 of the whole video, checked when the upload is finalized.
+    """
+    return core.init_video_upload(user.id, user.role, video, uploads_dir)
+
+
+@router.get("/video/uploads/{upload_id}", response_model=schemas.VideoUploadOut, tags=["video"], status_code=200)
+@util.global_exception_handler
+def get_video_upload(
+    upload_id: str,
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint returns the state of a resumable upload, offset is where the next chunk starts.
+    """
+    return core.get_video_upload(user.id, user.role, upload_id, uploads_dir)
+
+
+@router.put("/video/uploads/{upload_id}", response_model=schemas.VideoUploadOut, tags=["video"], status_code=200)
+@util.global_exception_handler
+async def upload_video_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    content_sha256: str = Header(None),
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint writes one chunk of a resumable upload, the raw bytes are the request body.
+
+    Please note the following:
+
+        - offset must be the upload's current offset, otherwise 409 is returned with the offset to resume from.
+        - The Content-SHA256 header must hold the hex SHA-256 of the chunk, mismatching chunks are refused.
+
+    Params:
+
+        upload_id
+            - String
+            - Mandatory
+            - Its returned when the upload is started
+
+        offset
+            - Integer
+            - Mandatory
+            - E.g 16777216
+            - The position of this chunk in the video.
+    """
+    chunk = await util.read_body(request, settings.VIDEO_UPLOAD_MAX_CHUNK_SIZE)
+    return await run_in_threadpool(
+        core.upload_video_chunk, user.id, user.role, upload_id, offset,
+        chunk, content_sha256, uploads_dir
+    )
+
+
+@router.post("/video/uploads/{upload_id}/finalize", response_model=schemas.UploadedFile, tags=["video"], status_code=201)
+@util.global_exception_handler
+def finalize_video_upload(
+    upload_id: str,
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint completes a resumable upload once all its bytes are received and makes the video streamable.
+    """
+    return core.finalize_video_upload(user.id, user.role, upload_id, uploads_dir)
 
 
 @router.get("/video/{file_name}", tags=["video"], status_code=200)
 @util.global_exception_handler
 def stream_video(
     file_name: str,
+    request: Request,
     user : schemas.User = Depends(core.authenticate_user)
 ):
     """
@@ -80,9 +278,12 @@ def stream_video(
 
     Please Note the following:
 
-        - Video files should stored in a file storage service like amazon s3 buckets.
+        - Video names are resolved to stored videos through the video index.
         - A source url can point direct to this files without passing the server but that means anyone will be able to view this videos.
         - For better and scalable streaming a third party service like mux.com can be used.
+        - Range and If-Range requests are supported so players can seek, single ranges get a 206 and multiple ranges a multipart/byteranges 206.
+        - ETag and Last-Modified are sent, If-None-Match and If-Modified-Since get a 304 when the video hasn't changed.
+        - The content type is detected from the file name, falling back to the file's signature.
     
     Params:
 
@@ -112,8 +313,7 @@ def stream_video(
             </body>
         </html>
     """
-    file_content = open(videos_dir + file_name, mode='rb')
-    return StreamingResponse(file_content, media_type="video/mp4")
+    return core.stream_video(file_name, request.headers, videos_dir)
 
 
 @router.post("/exam", response_model=schemas.ExamOut, tags=["exam"], status_code=201)
@@ -144,8 +344,9 @@ def create_exam(
             - Optional
             - E.g kcse_prep.mp4
             - Its the video tutorial file name and can be left out if the exam doesn't have a video tutorial.
+            - The video has to have been uploaded, an unknown name gets a 404.
     """
-    return core.create_exam(user.id, user.role, exam)
+    return core.create_exam(user.id, user.role, exam, videos_dir)
 
 
 @router.post("/exam/participant", tags=["exam"], status_code=201)
@@ -180,8 +381,7 @@ def add_participant(
     return core.add_participant(user.id, user.role, participant)
 
 
-# response_model=schemas.QuestionOut throws DatabaseSessionOver exception
-@router.post("/exam/question", tags=["exam"], status_code=201)
+@router.post("/exam/question", response_model=schemas.QuestionOut, tags=["exam"], status_code=201)
 @util.global_exception_handler
 def create_question(
     question: schemas.Question,
@@ -231,10 +431,119 @@ def create_question(
     return core.create_question(user.id, user.role, question)
 
 
-# response_model=schemas.SubmissionOut throws DatabaseSessionOver exception
-@router.post("/exam/submission", tags=["exam"], status_code=201)
+@router.post("/exam/{exam_id}/questions:bulk", tags=["exam"], status_code=201)
+@util.global_exception_handler
+async def create_questions_bulk(
+    exam_id: str,
+    request: Request,
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint enables tutors to import many questions to an exam in one request.
+
+    Please note the following:
+
+        - Only tutors allowed to create questions.
+        - The body is either a JSON array or NDJSON (Content-Type: application/x-ndjson, one question per line).
+        - Each question takes the same params as /exam/question without exam_id.
+        - Question numbers are allocated in one block after the exam's existing questions, in the order given.
+        - Valid questions are inserted in one transaction, invalid ones are reported per row and skipped.
+
+    Params:
+
+        exam_id
+            - String
+            - Mandatory
+            - E.g e3ff1d3c-f018-475f-a3cb-c1c3f4bc0258
+            - Its returned when one creates an exam
+
+    Response:
+
+        created, failed and results, a list with the status (created or error) of every row by its index.
+    """
+    rows = util.parse_json_rows(
+        await request.body(), request.headers.get("content-type")
+    )
+    return await run_in_threadpool(
+        core.create_questions_bulk, user.id, user.role, exam_id, rows
+    )
+
+
+@router.post("/exam/start", tags=["exam"], status_code=200)
 @util.global_exception_handler
-def create_submission(
+def start_exam(
+    start : schemas.StartExam,
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint starts the exam's timer for a learner, answers submitted after the deadline are rejected.
+
+    Please note the following:
+
+        - Only learners taking part in the exam can start it.
+        - Starting an exam that is already running returns the running session, its deadline isn't extended.
+        - Answers are accepted until EXAM_DEADLINE_GRACE seconds after the deadline.
+        - A reminder SMS with the minutes left is sent after each number of minutes in alert_after.
+
+    Params:
+
+        exam_id
+            - String
+            - Mandatory
+            - E.g e3ff1d3c-f018-475f-a3cb-c1c3f4bc0258
+            - This is obtained when an exam is created
+
+        duration
+            - Integer
+            - Optional
+            - E.g 60
+            - Minutes the learner has, at most and by default the exam's time_duration
+
+        alert_after
+            - List
+            - Optional
+            - E.g [30, 50]
+            - Minutes after the start at which to remind the learner of the time left
+    """
+    return core.start_exam(user.id, user.role, start)
+
+
+@router.get("/exam/{exam_id}/questions", tags=["exam"], status_code=200)
+@util.global_exception_handler
+async def get_exam_paper(
+    exam_id : str,
+    request: Request,
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint returns the questions of an exam, without their answers, for a learner to sit it.
+
+    Please note the following:
+
+        - Only learners taking part in the exam and the tutor who created it can get its questions.
+        - Questions are ordered by number, free text questions have no multi_choice.
+        - The response carries an ETag that changes whenever questions are added, sending it back in If-None-Match gets a 304 while the questions are unchanged.
+
+    Params:
+
+        exam_id
+            - String
+            - Mandatory
+            - E.g e3ff1d3c-f018-475f-a3cb-c1c3f4bc0258
+            - This is obtained when an exam is created
+    """
+    return await core.get_exam_paper(user.id, user.role, exam_id, request.headers)
+
+
+@router.post("/exam/submission", response_model=schemas.SubmissionOut, tags=["exam"], status_code=201)
+@util.global_exception_handler
+async def create_submission(
     submission: schemas.Submission,
     user : models.User = Depends(core.authenticate_user)
 ):
@@ -262,11 +571,50 @@ def create_submission(
             - This is the answer a learner submits to a particular question
 
     """
-    return core.create_submission(user.id, user.role, submission)
+    return await core.create_submission(user.id, user.role, submission)
 
 
-# response_model=schemas.SubmissionOut throws DatabaseSessionOver exception
-@router.post("/exam/submission/mark", tags=["exam"], status_code=201)
+@router.post("/exam/{exam_id}/submissions", tags=["exam"], status_code=201)
+@util.global_exception_handler
+def create_submissions_bulk(
+    exam_id: str,
+    sheet: schemas.AnswerSheet,
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint enables a learner to submit a whole answer sheet for an exam in one request.
+
+    Please note the following:
+
+        - Only learners allowed to create submissions.
+        - Multi choice answers are auto marked, free text answers are left for the tutor to mark.
+        - Answers to unknown or already answered questions are reported per row and skipped.
+        - The learner's performance is updated once for the whole sheet.
+
+    Params:
+
+        exam_id
+            - String
+            - Mandatory
+            - E.g e3ff1d3c-f018-475f-a3cb-c1c3f4bc0258
+            - Its returned when one creates an exam
+
+        answers
+            - List
+            - Mandatory
+            - E.g [{"question_id": "e3ff1d3c-f018-475f-a3cb-c1c3f4bc0258", "answer": "B"}]
+            - Each answer takes the same params as /exam/submission
+
+    Response:
+
+        created, failed, results, a list with the status (created or error) of every answer by its index and the updated performance.
+    """
+    return core.create_submissions_bulk(user.id, user.role, exam_id, sheet)
+
+
+@router.post("/exam/submission/mark", response_model=schemas.SubmissionOut, tags=["exam"], status_code=201)
 @util.global_exception_handler
 def mark_submission(
     submission: schemas.MarkSubmission,
@@ -305,9 +653,80 @@ def mark_submission(
     """
     return core.mark_submission(user.id, user.role, submission)
 
-@router.get("/exam/{exam_id}/performance", tags=["exam"], status_code=200)
+
+@router.get("/marking-queue", tags=["exam"], status_code=200)
+@util.global_exception_handler
+async def get_marking_queue(
+    limit : int = settings.MARKING_QUEUE_PAGE_SIZE,
+    cursor : str = None,
+    exam_id : str = None,
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint returns one page of the free text answers waiting to be marked in the tutor's exams, oldest first.
+
+    Please note the following:
+
+        - Only tutors allowed to get their marking queue.
+        - Only submissions to exams the tutor created are returned.
+        - next_cursor is passed as cursor to get the next page, it is null on the last page.
+
+    Params:
+
+        limit
+            - Integer
+            - Optional
+            - E.g 50
+            - The number of submissions per page, at most MARKING_QUEUE_MAX_PAGE_SIZE
+
+        cursor
+            - String
+            - Optional
+            - The next_cursor of the previous page
+
+        exam_id
+            - String
+            - Optional
+            - E.g e3ff1d3c-f018-475f-a3cb-c1c3f4bc0258
+            - Only returns submissions to this exam
+    """
+    return await core.get_marking_queue(user.id, user.role, limit, cursor, exam_id)
+
+
+@router.post("/marking-queue/mark", tags=["exam"], status_code=200)
 @util.global_exception_handler
-def get_exam_performance(
+def mark_submissions(
+    batch: schemas.MarkingBatch,
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint enables a tutor to mark many submissions at once, e.g a page of the marking queue.
+
+    Please note the following:
+
+        - Only tutors allowed to mark submissions, and only submissions to exams they created.
+        - All marks are saved together, each learner's performance is updated once.
+        - Submissions that can't be marked are reported per index in results and don't stop the others from being marked.
+        - At most MARKING_BATCH_MAX_ROWS submissions can be marked at once.
+
+    Params:
+
+        submissions
+            - List
+            - Mandatory
+            - E.g [{"submission_id": "e3ff1d3c-f018-475f-a3cb-c1c3f4bc0258", "mark": "tick", "marks": 4}]
+            - submission_id, mark (tick or cross) and the optional marks of each submission as when marking one submission
+    """
+    return core.mark_submissions(user.id, user.role, batch)
+
+
+@router.get("/exam/{exam_id}/performance", response_model=List[schemas.Performance], tags=["exam"], status_code=200)
+@util.global_exception_handler
+async def get_exam_performance(
     exam_id : str,
     user : models.User = Depends(core.authenticate_user)
 ):
@@ -328,13 +747,147 @@ def get_exam_performance(
             - E.g e3ff1d3c-f018-475f-a3cb-c1c3f4bc0258
             - This is obtained when an exam is created
     """
-    return core.get_exam_performance(user.role, exam_id)
+    return await core.get_exam_performance(user.role, exam_id)
 
 
-@router.post("/notification", tags=["notification"], status_code=201)
+@router.get("/exam/{exam_id}/stats", tags=["exam"], status_code=200)
+@util.global_exception_handler
+async def get_exam_stats(
+    exam_id : str,
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint returns the statistics of a particular exam, the mean, median and standard deviation of the learners' percentages, the number of learners per grade and the percentage of learners who answered each question correctly.
+
+    Please note the following:
+
+        - Only tutors allowed to get exam statistics.
+        - Statistics are computed by the database and cached until the exam gets a new question, submission or mark, computed_at tells when they were computed.
+        - percentage_correct only counts marked submissions, unmarked tells how many submissions are waiting to be marked.
+
+    Params:
+
+        exam_id
+            - String
+            - Mandatory
+            - E.g e3ff1d3c-f018-475f-a3cb-c1c3f4bc0258
+            - This is obtained when an exam is created
+    """
+    return await core.get_exam_stats(user.role, exam_id)
+
+
+@router.get("/live/performance", tags=["exam"], status_code=200)
+@util.global_exception_handler
+async def subscribe_performance(
+    exam_id : str = None,
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint streams performance changes as server sent events (text/event-stream) so clients don't have to poll for them.
+
+    Please note the following:
+
+        - Tutors get the performances of every learner of one of their exams, learners get their own performances.
+        - Each change is a performance event whose data is the performance as JSON.
+        - Changes to the same performance in quick succession are sent as one event with the latest values.
+        - A client that can't keep up is sent an overflow event and disconnected, it should read the current performances and subscribe again.
+
+    Params:
+
+        exam_id
+            - String
+            - Mandatory for tutors, not used for learners
+            - E.g e3ff1d3c-f018-475f-a3cb-c1c3f4bc0258
+            - This is obtained when an exam is created
+    """
+    return await core.subscribe_performance(user.id, user.role, exam_id)
+
+
+@router.get("/exam/{exam_id}/leaderboard", tags=["exam"], status_code=200)
+@util.global_exception_handler
+async def get_exam_leaderboard(
+    exam_id : str,
+    limit : int = settings.LEADERBOARD_PAGE_SIZE,
+    cursor : str = None,
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint returns one page of the ranked perfomances of a particular exam, best first.
+
+    Please note the following:
+
+        - Only tutors allowed to get the exam leaderboard.
+        - Performances are ordered by percentage, then marks obtained.
+        - Learners with the same percentage and marks share a rank, e.g 1, 2, 2, 4.
+        - next_cursor is passed as cursor to get the next page, it is null on the last page.
+
+    Params:
+
+        exam_id
+            - String
+            - Mandatory
+            - E.g e3ff1d3c-f018-475f-a3cb-c1c3f4bc0258
+            - This is obtained when an exam is created
+
+        limit
+            - Integer
+            - Optional
+            - E.g 50
+            - The number of performances per page, at most LEADERBOARD_MAX_PAGE_SIZE
+
+        cursor
+            - String
+            - Optional
+            - The next_cursor of the previous page
+    """
+    return await core.get_exam_leaderboard(user.role, exam_id, limit, cursor)
+
+
+@router.get("/exam/{exam_id}/performance/export", tags=["exam"], status_code=200)
+@util.global_exception_handler
+async def export_exam_performance(
+    exam_id : str,
+    format : str = "ndjson",
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint downloads the ranked perfomances of a particular exam as NDJSON or CSV.
+
+    Please note the following:
+
+        - Only tutors allowed to export exam perfomance.
+        - The rows are streamed as they are read so exams of any size can be exported.
+        - Rows are ordered and ranked as in the leaderboard.
+
+    Params:
+
+        exam_id
+            - String
+            - Mandatory
+            - E.g e3ff1d3c-f018-475f-a3cb-c1c3f4bc0258
+            - This is obtained when an exam is created
+
+        format
+            - String
+            - Optional
+            - ndjson (default) or csv
+    """
+    return await core.export_exam_performance(user.role, exam_id, format)
+
+
+@router.post("/notification", tags=["notification"], status_code=202)
 @util.global_exception_handler
 def notify_user(
     notification : schemas.Notification,
+    idempotency_key : str = Header(None),
     user : models.User = Depends(core.authenticate_user)
 ):
     """
@@ -345,6 +898,9 @@ def notify_user(
     Please note the following:
 
         - Only tutors, staff and admins can send notifications
+        - The sms is queued and sent in the background, the returned notification's status moves from queued (0) to sent (2), or to failed (3) once SMS_MAX_ATTEMPTS attempts have failed.
+        - Failed attempts are retried with exponential backoff.
+        - Send an Idempotency-Key header to safely retry a request, a request with a key you already used for the same user returns the notification it created instead of sending the sms again.
     
     Params:
 
@@ -361,12 +917,76 @@ def notify_user(
             - The message can be any thing the sender wants to communicate to the receiver.
     """
     return core.notify_user(
-        user.role, notification.user_id, notification.message
+        user.id, user.role, notification.user_id, notification.message, idempotency_key
+    )
+
+
+@router.post("/exam/{exam_id}/notify", tags=["notification"], status_code=202)
+@util.global_exception_handler
+def notify_participants(
+    exam_id : str,
+    notification : schemas.ExamNotification,
+    idempotency_key : str = Header(None),
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint sends an sms to every participant of an exam e.g to announce that it starts.
+
+    Please note the following:
+
+        - Only tutors, staff and admins can notify participants, tutors only of their own exams.
+        - The sms are queued and sent in the background, the response is the job's progress. Poll GET /notification/job/{job} for more.
+        - Suspended and inactive participants are left out.
+        - Send an Idempotency-Key header to safely retry a request, a request with a key you already used for this exam returns the job it created.
+
+    Params:
+
+        exam_id
+            - String
+            - Mandatory
+            - E.g e3ff1d3c-f018-475f-a3cb-c1c3f4bc0258
+            - This is obtained when an exam is created
+
+        message
+            - String
+            - Mandatory
+            - E.g The exam starts at 9am, good luck!
+    """
+    return core.notify_participants(
+        user.id, user.role, exam_id, notification.message, idempotency_key
     )
 
 
-# response_model=schemas.MentorshipOut throws DatabaseSessionOver exception
-@router.post("/mentorship", tags=["mentorship"], status_code=201)
+@router.get("/notification/job/{job_id}", tags=["notification"], status_code=200)
+@util.global_exception_handler
+def get_notification_job(
+    job_id : str,
+    user : models.User = Depends(core.authenticate_user)
+):
+    """
+    Description:
+
+        This endpoint returns the progress of an exam notification job, the number of its sms queued, sending, sent and failed.
+
+    Please note the following:
+
+        - Only tutors, staff and admins can get notification jobs, tutors only those of their own exams.
+        - done is true once no sms is left to send.
+
+    Params:
+
+        job_id
+            - String
+            - Mandatory
+            - E.g e3ff1d3c-f018-475f-a3cb-c1c3f4bc0258
+            - This is returned when participants are notified
+    """
+    return core.get_notification_job(user.id, user.role, job_id)
+
+
+@router.post("/mentorship", response_model=schemas.MentorshipOut, tags=["mentorship"], status_code=201)
 @util.global_exception_handler
 def request_for_mentorship(
     mentorship : schemas.Mentorship,
@@ -395,4 +1015,20 @@ def request_for_mentorship(
             - E.g I need help in understanding the mole concept
             - This is just a short description of why you need mentorship.
     """
-    return core.request_for_mentorship(user.id, user.role, mentorship)
\ No newline at end of file
+    return core.request_for_mentorship(user.id, user.role, mentorship)
+
+
+@router.get("/stats", tags=["stats"], status_code=200)
+@util.global_exception_handler
+def get_stats(user : models.User = Depends(core.authenticate_user)):
+    """
+    Description:
+
+        This endpoint returns runtime statistics of this worker process e.g the credentials cache hits and misses and the database connection pools (in use, waiting, wait times, timeouts).
+
+    Please note the following:
+
+        - Only staff and admins can get stats.
+        - Each worker process keeps its own stats.
+    """
+    return core.get_stats(user.role)
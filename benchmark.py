@@ -0,0 +1,897 @@
+"""
+Load and micro benchmarks of the API under many concurrent learners.
+
+Seed learners, a tutor and an exam they all take part in, then replay an
+exam sitting against a running server:
+
+    python benchmark.py seed --learners 500 --questions 20
+    python benchmark.py load --url http://127.0.0.1:8000 --concurrency 500
+
+Every learner signs in (GET /user), then answers each question of the
+exam (POST /exam/submission) while the exam's performance is read in
+between (GET /exam/{exam_id}/performance) and the tutor marks the free
+text answers from the marking queue (GET /marking-queue, POST
+/marking-queue/mark). Throughput and latency percentiles are reported
+per endpoint, for the sign in and the exam sitting separately.
+
+The exam day runs faster on an empty database than it would in
+production, volume fills it first with past exams taken by the same
+learners and their marked submissions:
+
+    python benchmark.py volume --tutors 10 --exams 10 --questions 100 --learners 10000 --submissions 1000000
+
+Performance reviews, authentication and response serialization are
+timed in process against the seeded exam:
+
+    python benchmark.py micro --output micro.json
+
+The cost of the API's logging per request, as configured for
+development (DEBUG) and for production, is measured in process:
+
+    python benchmark.py logging --requests 20000
+
+Results written with --output are compared to those of an earlier run,
+the exit status is 1 once a percentile or throughput got worse by more
+than the tolerance, or any request failed:
+
+    python benchmark.py compare baseline.json results.json --tolerance 0.1
+
+Each seed creates a new exam, a learner can only answer a question once,
+so seed again before every load run. To compare two revisions of the API
+run the same seed and load against each, e.g the sync Pony path against
+the async one.
+
+The client is a small HTTP/1.1 keep-alive client on asyncio streams so
+the benchmark needs nothing beyond the API's own requirements.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import statistics
+import sys
+import time
+
+from functools import partial
+from urllib.parse import urlsplit
+
+
+API = "/api/v1"
+PASSWORD = "benchmark123"
+STATE_FILE = "benchmark.json"
+
+# Compared by compare, whether higher is better
+COMPARED_METRICS = dict(
+    throughput=True,
+    ops_per_second=True,
+    p50_ms=False,
+    p95_ms=False,
+    p99_ms=False,
+    p50_us=False,
+    p95_us=False,
+    p99_us=False
+)
+
+
+class HTTPConnection:
+    """One keep-alive connection, requests on it are sequential."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method: str, path: str, headers: dict = None, body: bytes = b""):
+        lines = [
+            "{} {} HTTP/1.1".format(method, path),
+            "Host: {}:{}".format(self.host, self.port),
+            "Content-Length: {}".format(len(body))
+        ]
+        lines.extend("{}: {}".format(name, value) for name, value in (headers or {}).items())
+        message = ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+
+        # An idle connection may have been closed by the server's keep
+        # alive timeout, that one is retried once on a new connection
+        reused = self.writer is not None
+        while True:
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                self.writer.write(message)
+                status, response_headers = await self._read_head()
+                break
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self.close()
+                if not reused:
+                    raise
+                reused = False
+
+        try:
+            response = await self._read_body(response_headers)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.close()
+            raise
+
+        if response_headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, response
+
+    async def _read_head(self):
+        status_line = await self.reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                return status, headers
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    async def _read_body(self, headers: dict):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    return bytes(body)
+                body.extend(chunk[:-2])
+        return await self.reader.readexactly(int(headers.get("content-length", 0)))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Recorder:
+    """Collects the latency and status of every request per endpoint."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+
+    def record(self, name: str, started: float, status: int):
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+        statuses = self.statuses.setdefault(name, {})
+        statuses[status] = statuses.get(status, 0) + 1
+
+    def errors(self, name: str):
+        return sum(
+            count for status, count in self.statuses[name].items() if status >= 400
+        )
+
+    def report(self, elapsed: float):
+        endpoints = {}
+        for name, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            endpoints[name] = dict(
+                requests=len(latencies),
+                errors=self.errors(name),
+                statuses=self.statuses[name],
+                throughput=round(len(latencies) / elapsed, 1),
+                mean_ms=round(statistics.mean(latencies) * 1000, 1),
+                p50_ms=round(percentile(latencies, 50) * 1000, 1),
+                p95_ms=round(percentile(latencies, 95) * 1000, 1),
+                p99_ms=round(percentile(latencies, 99) * 1000, 1),
+                max_ms=round(latencies[-1] * 1000, 1)
+            )
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return dict(
+            elapsed=round(elapsed, 2),
+            requests=total,
+            errors=sum(self.errors(name) for name in self.latencies),
+            throughput=round(total / elapsed, 1),
+            endpoints=endpoints
+        )
+
+
+def percentile(ordered: list, p: float):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples: list):
+    """Rate and latency percentiles (µs) of samples in seconds."""
+    samples.sort()
+    return dict(
+        iterations=len(samples),
+        ops_per_second=round(len(samples) / sum(samples), 1),
+        mean_us=round(statistics.mean(samples) * 1e6, 1),
+        p50_us=round(percentile(samples, 50) * 1e6, 1),
+        p95_us=round(percentile(samples, 95) * 1e6, 1),
+        p99_us=round(percentile(samples, 99) * 1e6, 1)
+    )
+
+
+def measure(func, iterations: int):
+    func()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+async def measure_async(func, iterations: int):
+    await func()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def write_result(result: dict, output: str = None):
+    print(json.dumps(result, indent=2))
+    if output:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+def basic_auth(username: str, password: str):
+    token = base64.b64encode("{}:{}".format(username, password).encode()).decode()
+    return {"Authorization": "Basic {}".format(token)}
+
+
+async def timed(recorder: Recorder, connection: HTTPConnection, name: str, method: str, path: str, headers: dict, payload=None):
+    body = b""
+    headers = dict(headers)
+    if payload is not None:
+        body = json.dumps(payload).encode()
+        headers["Content-Type"] = "application/json"
+
+    started = time.perf_counter()
+    try:
+        status, response = await connection.request(method, path, headers, body)
+    except (asyncio.IncompleteReadError, ConnectionError, OSError):
+        status, response = 599, b""
+    recorder.record(name, started, status)
+    return status, response
+
+
+async def sign_in(recorder: Recorder, connection: HTTPConnection, username: str):
+    await timed(recorder, connection, "GET /user", "GET", API + "/user", basic_auth(username, PASSWORD))
+
+
+async def sit_exam(recorder: Recorder, connection: HTTPConnection, state: dict, username: str, deadline: float, read_every: int):
+    headers = basic_auth(username, PASSWORD)
+    exam_id = state["exam_id"]
+    questions = list(state["questions"].items())
+    random.shuffle(questions)
+
+    for number, (question_id, answer) in enumerate(questions, start=1):
+        if time.perf_counter() > deadline:
+            break
+        await timed(
+            recorder, connection, "POST /exam/submission", "POST",
+            API + "/exam/submission", headers,
+            dict(question_id=question_id, answer=random.choice([answer, "X"]))
+        )
+        if number % read_every == 0:
+            await timed(
+                recorder, connection, "GET /exam/{exam_id}/performance", "GET",
+                API + "/exam/{}/performance".format(exam_id),
+                basic_auth(state["tutor"], PASSWORD)
+            )
+
+
+async def mark_queue(recorder: Recorder, connection: HTTPConnection, state: dict, finished: asyncio.Event, batch: int):
+    """Marks the exam's free text answers until the learners are done and none are left."""
+    headers = basic_auth(state["tutor"], PASSWORD)
+    while True:
+        status, response = await timed(
+            recorder, connection, "GET /marking-queue", "GET",
+            API + "/marking-queue?exam_id={}&limit={}".format(state["exam_id"], batch),
+            headers
+        )
+        submissions = json.loads(response)["submissions"] if status == 200 else []
+        if submissions:
+            await timed(
+                recorder, connection, "POST /marking-queue/mark", "POST",
+                API + "/marking-queue/mark", headers,
+                dict(submissions=[
+                    dict(submission_id=submission["id"], mark=random.choice(["tick", "cross"]))
+                    for submission in submissions
+                ])
+            )
+        elif finished.is_set():
+            return
+        else:
+            await asyncio.sleep(0.2)
+
+
+async def run_phase(coroutines):
+    recorder = Recorder()
+    started = time.perf_counter()
+    await asyncio.gather(*(coroutine(recorder) for coroutine in coroutines))
+    return recorder.report(time.perf_counter() - started)
+
+
+async def load(args):
+    with open(args.state) as f:
+        state = json.load(f)
+
+    url = urlsplit(args.url)
+    learners = state["learners"][:args.concurrency]
+    if len(learners) < args.concurrency:
+        sys.exit("Only {} learners seeded, seed at least --learners {}".format(
+            len(learners), args.concurrency
+        ))
+
+    connections = {
+        username: HTTPConnection(url.hostname, url.port or 80)
+        for username in learners + [state["tutor"]]
+    }
+    try:
+        # Signing in is dominated by bcrypt, so it's measured on its own
+        # and the exam sitting then runs with every learner signed in
+        sign_in_result = await run_phase(
+            partial(sign_in, connection=connection, username=username)
+            for username, connection in connections.items()
+        )
+        deadline = time.perf_counter() + args.duration
+        finished = asyncio.Event()
+
+        async def sitting(recorder):
+            await asyncio.gather(*(
+                sit_exam(
+                    recorder, connections[username], state, username,
+                    deadline, args.read_every
+                )
+                for username in learners
+            ))
+            finished.set()
+
+        phase = [sitting]
+        if state.get("open_questions"):
+            phase.append(partial(
+                mark_queue, connection=connections[state["tutor"]], state=state,
+                finished=finished, batch=args.mark_batch
+            ))
+        exam_result = await run_phase(phase)
+    finally:
+        for connection in connections.values():
+            connection.close()
+
+    write_result(dict(
+        label=args.label,
+        concurrency=args.concurrency,
+        sign_in=sign_in_result,
+        exam=exam_result
+    ), args.output)
+
+    # Failed requests are fast, a run with any isn't one to compare to
+    failed = sign_in_result["errors"] + exam_result["errors"]
+    if failed:
+        sys.exit("{} requests failed, see the statuses by endpoint".format(failed))
+
+
+def learner_names(count: int):
+    return ["benchmark-learner-{}".format(i) for i in range(count)]
+
+
+def insert_learners(learners: list, password: str, now):
+    """Adds the learners not there yet, in bulk as bcrypt would take hours."""
+    from uuid import uuid4
+
+    from pony.orm import select
+    from psycopg2.extras import Json
+
+    import models
+    import util
+
+    existing = set(select(
+        u.username for u in models.User if u.username in learners
+    ))
+    util.bulk_insert(
+        models.db,
+        "user",
+        (
+            "id", "username", "password", "phone_number", "phone_number_verified",
+            "email", "email_verified", "role", "status", "level", "metadata",
+            "created_at", "updated_at"
+        ),
+        [
+            (
+                uuid4(), username, password, "+2557{:08d}".format(i), False,
+                "{}@example.com".format(username), False, "learner", "active",
+                1, Json({}), now, now
+            )
+            for i, username in enumerate(learners) if username not in existing
+        ]
+    )
+    return list(select(u.id for u in models.User if u.username in learners))
+
+
+def seed(args):
+    # The seed talks to the database directly, the load doesn't need it
+    from datetime import datetime as dt
+    from uuid import uuid4
+
+    from pony.orm import db_session
+    from pony.orm import flush
+    from psycopg2.extras import Json
+
+    import models
+    import util
+
+    password = util.get_password_hash(PASSWORD)
+    now = dt.utcnow()
+
+    with db_session:
+        tutor = models.User.get(username="benchmark-tutor")
+        if not tutor:
+            tutor = models.User(
+                username="benchmark-tutor", password=password,
+                phone_number="+255600000000", email="benchmark-tutor@example.com",
+                role=models.Role.tutor
+            )
+
+        learners = learner_names(args.learners)
+        learner_ids = insert_learners(learners, password, now)
+
+        exam = models.Exam(name="benchmark-{}".format(now.isoformat()), user=tutor)
+        questions = {}
+        # The last ones are free text, left for the tutor to mark
+        open_from = args.questions - args.open_questions + 1
+        for number in range(1, args.questions + 1):
+            if number >= open_from:
+                answer = "Answer {}".format(number)
+                multi_choice = []
+            else:
+                answer = random.choice(["A", "B", "C", "D"])
+                multi_choice = ["A", "B", "C", "D"]
+            question = models.Question(
+                exam=exam, number=number, text="Question {}".format(number),
+                multi_choice=multi_choice, answer=answer, marks=random.randint(1, 5)
+            )
+            questions[question] = answer
+        exam.total_marks = sum(question.marks for question in questions)
+        exam.total_number_of_questions = len(questions)
+        flush()
+
+        util.bulk_insert(
+            models.db,
+            "participant",
+            ("id", "metadata", "created_at", "updated_at", "exam", "user"),
+            [(uuid4(), Json({}), now, now, exam.id, user_id) for user_id in learner_ids]
+        )
+
+        state = dict(
+            exam_id=str(exam.id),
+            tutor=tutor.username,
+            learners=learners,
+            questions={str(question.id): answer for question, answer in questions.items()},
+            open_questions=args.open_questions
+        )
+
+    with open(args.state, "w") as f:
+        json.dump(state, f)
+    print("Seeded exam {} with {} questions for {} learners into {}".format(
+        state["exam_id"], args.questions, args.learners, args.state
+    ))
+
+
+def volume(args):
+    """Fills the database with past exams of benchmark tutors, sat by the learners."""
+    from datetime import datetime as dt
+    from datetime import timedelta
+    from uuid import uuid4
+
+    from pony.orm import commit
+    from pony.orm import db_session
+    from psycopg2.extras import Json
+
+    import core
+    import models
+    import seed as factories
+    import util
+
+    exams = args.tutors * args.exams
+    sittings = args.submissions // args.questions
+    per_exam = -(-sittings // exams)
+    if per_exam > args.learners:
+        sys.exit("{} sittings per exam, seed at least --learners {}".format(per_exam, per_exam))
+
+    password = util.get_password_hash(PASSWORD)
+    now = dt.utcnow()
+    started = time.perf_counter()
+
+    with db_session:
+        learner_ids = insert_learners(learner_names(args.learners), password, now)
+        tutor_ids = []
+        for i in range(args.tutors):
+            username = "benchmark-tutor-{}".format(i)
+            tutor = models.User.get(username=username) or factories.create_user(
+                username, PASSWORD, "+2554{:08d}".format(i),
+                "{}@example.com".format(username), models.Role.tutor
+            )
+            tutor_ids.append(tutor.id)
+        core.load_grades()
+        commit()
+
+    added = submissions = 0
+    for number in range(exams):
+        taken = min(per_exam, sittings - number * per_exam)
+        if taken <= 0:
+            break
+        # Past exams, so the marking queue and today's rows stay as they are
+        created_at = now - timedelta(days=exams - number)
+
+        with db_session:
+            exam = models.Exam(
+                name="benchmark-past-{}-{}".format(number, now.isoformat()),
+                user=models.User[tutor_ids[number % args.tutors]],
+                created_at=created_at, updated_at=created_at
+            )
+            questions = []
+            for question_number in range(1, args.questions + 1):
+                free_text = question_number > args.questions - args.open_questions
+                questions.append(dict(
+                    id=uuid4(),
+                    multi_choice=[] if free_text else ["A", "B", "C", "D"],
+                    answer="Answer" if free_text else random.choice(["A", "B", "C", "D"]),
+                    marks=random.randint(1, 5)
+                ))
+            exam.total_marks = sum(question["marks"] for question in questions)
+            exam.total_number_of_questions = len(questions)
+            util.bulk_insert(
+                models.db,
+                "question",
+                core.QUESTION_COLUMNS,
+                [
+                    (
+                        question["id"], question_number, "Question {}".format(question_number),
+                        question["multi_choice"], question["marks"], question["answer"],
+                        Json({}), created_at, created_at, exam.id
+                    )
+                    for question_number, question in enumerate(questions, start=1)
+                ]
+            )
+
+            participants = []
+            rows = []
+            performances = []
+            for user_id in random.sample(learner_ids, taken):
+                participants.append((uuid4(), Json({}), created_at, created_at, exam.id, user_id))
+                totals = (0, 0, 0, 0)
+                for question in questions:
+                    answer = question["answer"] if random.random() < 0.7 else "X"
+                    if question["multi_choice"]:
+                        mark, marks_obtained = core.auto_mark(
+                            question["multi_choice"], question["answer"], question["marks"], answer
+                        )
+                    elif answer == question["answer"]:
+                        mark, marks_obtained = util.Mark.tick, question["marks"]
+                    else:
+                        mark, marks_obtained = util.Mark.cross, 0
+                    rows.append((
+                        uuid4(), answer, mark.name, marks_obtained, "", Json({}),
+                        created_at, created_at, question["id"], user_id
+                    ))
+                    totals = tuple(
+                        total + count
+                        for total, count in zip(totals, core.tally(mark, marks_obtained))
+                    )
+                ticks, crosses, unmarked, marks_obtained = totals
+                percentage = marks_obtained * 100 // exam.total_marks
+                performances.append((
+                    uuid4(), ticks, crosses, unmarked, marks_obtained, exam.total_marks,
+                    len(questions), percentage, Json({}), created_at, created_at,
+                    core.current_grades().resolve(percentage), exam.id, user_id
+                ))
+
+            util.bulk_insert(
+                models.db,
+                "participant",
+                ("id", "metadata", "created_at", "updated_at", "exam", "user"),
+                participants
+            )
+            util.bulk_insert(models.db, "submission", core.SUBMISSION_COLUMNS, rows)
+            util.bulk_insert(
+                models.db,
+                "performance",
+                (
+                    "id", "ticks", "crosses", "unmarked", "marks_obtained", "total_marks",
+                    "total_number_of_questions", "percentage", "metadata", "created_at",
+                    "updated_at", "grade", "exam", "user"
+                ),
+                performances
+            )
+        added += 1
+        submissions += len(rows)
+        print("Exam {}/{} : {} submissions".format(added, exams, submissions), file=sys.stderr)
+
+    print("Added {} past exams, {} learners and {} submissions in {:.0f} s".format(
+        added, len(learner_ids), submissions, time.perf_counter() - started
+    ))
+
+
+def micro(args):
+    """Times performance reviews, authentication and serialization in process."""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.security import HTTPAuthorizationCredentials
+    from fastapi.security import HTTPBasicCredentials
+    from pony.orm import db_session
+    from pony.orm import flush
+    from pony.orm import rollback
+    from pony.orm import select
+    from starlette.responses import JSONResponse
+
+    import aiodb
+    import core
+    import models
+    import serialization
+    import settings
+    import tokens
+    import util
+    from uuid import uuid4
+
+    with open(args.state) as f:
+        state = json.load(f)
+    username = state["learners"][0]
+
+    with db_session:
+        core.load_grades()
+        user_id = models.User.get(username=username).id
+        exam_id = state["exam_id"]
+
+    def review():
+        # A session per review as in a request, the change is rolled back
+        with db_session:
+            user = models.User[user_id]
+            exam = models.Exam[exam_id]
+            started = time.perf_counter()
+            core.review_performance(user, exam, (0, 0, 0, 0))
+            flush()
+            elapsed = time.perf_counter() - started
+            rollback()
+        return elapsed
+
+    benchmarks = {}
+    mode = settings.PERFORMANCE_REVIEW_MODE
+    for review_mode in ("incremental", "full"):
+        settings.PERFORMANCE_REVIEW_MODE = review_mode
+        review()
+        benchmarks["performance_review_{}".format(review_mode)] = summarize(
+            [review() for _ in range(args.iterations)]
+        )
+    settings.PERFORMANCE_REVIEW_MODE = mode
+
+    with db_session:
+        password = models.User[user_id].password
+    benchmarks["auth_bcrypt"] = measure(
+        lambda: util.verify_password(PASSWORD, password), args.bcrypt_iterations
+    )
+
+    async def authenticate():
+        await aiodb.connect()
+        try:
+            credentials = HTTPBasicCredentials(username=username, password=PASSWORD)
+            cached = await measure_async(
+                lambda: core.authenticate_user(None, credentials), args.iterations
+            )
+            lookup = await measure_async(lambda: core.get_user(username), args.iterations)
+            access_token, _ = tokens.issue(await core.get_user(username), uuid4())
+            token = HTTPAuthorizationCredentials(scheme="Bearer", credentials=access_token)
+            bearer = await measure_async(
+                lambda: core.authenticate_user(token, None), args.iterations
+            )
+        finally:
+            await aiodb.disconnect()
+        return cached, lookup, bearer
+
+    (
+        benchmarks["auth_cached"],
+        benchmarks["auth_user_lookup"],
+        benchmarks["auth_token"]
+    ) = asyncio.run(authenticate())
+
+    # A page of submissions as the marking endpoints return them
+    with db_session:
+        submissions = select(s for s in models.Submission)[:args.page_size]
+        benchmarks["serialize_to_dict"] = measure(
+            lambda: [submission.to_dict() for submission in submissions], args.iterations
+        )
+        page = dict(submissions=[submission.to_dict() for submission in submissions])
+        # The way of the endpoints returning serialization.Projected content
+        benchmarks["serialize_projected"] = measure(
+            lambda: serialization.JSONResponse(dict(submissions=[
+                serialization.columns(submission, core.SUBMISSION_COLUMNS)
+                for submission in submissions
+            ])).body,
+            args.iterations
+        )
+    benchmarks["serialize_json_response"] = measure(
+        lambda: JSONResponse(jsonable_encoder(page)).body, args.iterations
+    )
+
+    write_result(dict(
+        label=args.label,
+        page_size=len(page["submissions"]),
+        benchmarks=benchmarks
+    ), args.output)
+
+
+def compared_metrics(result: dict, path: str = ""):
+    """(path, value, higher_is_better) of the compared metrics of a result."""
+    for key, value in result.items():
+        if isinstance(value, dict):
+            yield from compared_metrics(value, "{}{}.".format(path, key))
+        elif key in COMPARED_METRICS and isinstance(value, (int, float)):
+            yield path + key, value, COMPARED_METRICS[key]
+
+
+def failed_requests(result: dict, path: str = ""):
+    """(path, count) of the failed requests of every endpoint of a load result."""
+    for key, value in result.items():
+        if isinstance(value, dict):
+            yield from failed_requests(value, "{}{}.".format(path, key))
+        # The totals of a phase repeat those of its endpoints
+        elif key == "errors" and ".endpoints." in path:
+            yield path + key, value
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline_result = json.load(f)
+    with open(args.result) as f:
+        result = json.load(f)
+
+    failed_in_baseline = sum(count for _, count in failed_requests(baseline_result))
+    if failed_in_baseline:
+        sys.exit("{} requests of the baseline failed, record it again from a run without errors".format(
+            failed_in_baseline
+        ))
+    baseline = {path: value for path, value, _ in compared_metrics(baseline_result)}
+
+    regressions = 0
+    for path, count in failed_requests(result):
+        if count:
+            regressions += 1
+            print("{:<64} {:>12} {:>12} {:>8}  FAILED REQUESTS".format(path, 0, count, ""))
+    print("{:<64} {:>12} {:>12} {:>8}".format("metric", "baseline", "result", "change"))
+    for path, value, higher_is_better in compared_metrics(result):
+        before = baseline.get(path)
+        if not before:
+            continue
+        change = (value - before) / before
+        worse = -change if higher_is_better else change
+        regressed = worse > args.tolerance
+        regressions += regressed
+        print("{:<64} {:>12} {:>12} {:>+7.1%}{}".format(
+            path, before, value, change, "  REGRESSION" if regressed else ""
+        ))
+
+    if regressions:
+        sys.exit("{} metrics got worse by more than {:.0%}".format(regressions, args.tolerance))
+
+
+def logging_overhead(args):
+    """Replays the log calls of a submission request under each log setup."""
+    import tempfile
+
+    from datetime import datetime as dt
+    from uuid import uuid4
+
+    from loguru import logger
+
+    import logs
+    import settings
+    import util
+
+    submission = dict(
+        id=uuid4(), answer="A", mark="auto_tick", marks_obtained=3, comment="",
+        metadata={}, created_at=dt.utcnow(), updated_at=dt.utcnow(),
+        question=uuid4(), user=uuid4()
+    )
+    performance = dict(
+        id=uuid4(), ticks=12, crosses=3, unmarked=1, marks_obtained=40,
+        total_marks=64, total_number_of_questions=20, percentage=62,
+        grade=uuid4(), user=uuid4(), exam=uuid4()
+    )
+
+    @util.global_exception_handler
+    def create_submission():
+        logger.debug("Action : {}, Role : {}", "create_submission", "Role.learner")
+        logger.opt(lazy=True).debug("Performance : {}", lambda: dict(performance))
+        return submission
+
+    setups = (
+        ("development", "DEBUG", "text", 1.0),
+        ("production", "INFO", "json", 0.1)
+    )
+    results = {}
+    for name, level, log_format, sample_rate in setups:
+        settings.LOG_REQUEST_SAMPLE_RATE = sample_rate
+        with tempfile.TemporaryDirectory() as logs_dir:
+            logs.setup(level, log_format, logs_dir, stderr=False)
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                token = logs.request_id.set(uuid4().hex)
+                create_submission()
+                logs.log_request("create_submission", "POST", "/api/v1/exam/submission", 201, 0.004)
+                logs.request_id.reset(token)
+            logged = time.perf_counter() - started
+            # The records are written by a background thread, wait for it
+            logger.complete()
+            written = time.perf_counter() - started
+            logger.remove()
+        results[name] = dict(
+            level=level,
+            format=log_format,
+            sample_rate=sample_rate,
+            request_us=round(logged / args.requests * 1e6, 1),
+            written_us=round(written / args.requests * 1e6, 1)
+        )
+
+    print(json.dumps(dict(requests=args.requests, setups=results), indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--state", default=STATE_FILE, help="file the seed writes and the load reads")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    seed_parser = commands.add_parser("seed", help="create learners and an exam for them")
+    seed_parser.add_argument("--learners", type=int, default=500)
+    seed_parser.add_argument("--questions", type=int, default=20)
+    seed_parser.add_argument("--open-questions", type=int, default=2, help="free text questions marked by the tutor")
+
+    volume_parser = commands.add_parser("volume", help="add past exams and their submissions")
+    volume_parser.add_argument("--tutors", type=int, default=10)
+    volume_parser.add_argument("--exams", type=int, default=10, help="per tutor")
+    volume_parser.add_argument("--questions", type=int, default=100, help="per exam")
+    volume_parser.add_argument("--open-questions", type=int, default=10, help="per exam")
+    volume_parser.add_argument("--learners", type=int, default=10000)
+    volume_parser.add_argument("--submissions", type=int, default=1000000)
+
+    load_parser = commands.add_parser("load", help="run the load against a server")
+    load_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    load_parser.add_argument("--concurrency", type=int, default=500, help="concurrent learners")
+    load_parser.add_argument("--duration", type=float, default=60, help="seconds at most")
+    load_parser.add_argument("--read-every", type=int, default=5, help="submissions between performance reads")
+    load_parser.add_argument("--mark-batch", type=int, default=50, help="submissions marked per request")
+    load_parser.add_argument("--label", default="", help="e.g the revision under test")
+    load_parser.add_argument("--output", help="also write the results as JSON here")
+
+    micro_parser = commands.add_parser("micro", help="time hot functions in process")
+    micro_parser.add_argument("--iterations", type=int, default=1000)
+    micro_parser.add_argument("--bcrypt-iterations", type=int, default=20)
+    micro_parser.add_argument("--page-size", type=int, default=50, help="submissions serialized at once")
+    micro_parser.add_argument("--label", default="", help="e.g the revision under test")
+    micro_parser.add_argument("--output", help="also write the results as JSON here")
+
+    logging_parser = commands.add_parser("logging", help="measure the logging cost per request")
+    logging_parser.add_argument("--requests", type=int, default=20000)
+
+    compare_parser = commands.add_parser("compare", help="compare results to a baseline")
+    compare_parser.add_argument("baseline", help="results of the reference run")
+    compare_parser.add_argument("result", help="results of the run under test")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1, help="e.g 0.1 for 10%% worse")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        seed(args)
+    elif args.command == "volume":
+        volume(args)
+    elif args.command == "micro":
+        micro(args)
+    elif args.command == "logging":
+        logging_overhead(args)
+    elif args.command == "compare":
+        compare(args)
+    else:
+        asyncio.run(load(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Domain events shared by the API workers through Postgres LISTEN/NOTIFY.
+
+Every worker keeps caches and live subscribers of its own, core publishes
+what changed once the change is committed and the other workers drop or
+push what they hold of it:
+
+    exam_created          exam, user
+    question_added        exam, version
+    submission_created    exam, user
+    submission_marked     exam, user
+    user_status_changed   username, sent by a trigger on "user"
+    session_revoked       session, until
+    grades_changed        sent by a trigger on "grade"
+    live                  topics, key and event of live.broker
+
+Events published by a worker are collected for BUS_FLUSH_INTERVAL seconds
+and sent with as few notifications as fit them, each worker listens on
+one connection of its own and handles the notifications it reads at once
+as one batch. A worker doesn't handle its own events, it has already
+acted on them.
+
+Notifications are not stored, ones sent while a listener is reconnecting
+are lost. Its worker is sent a local resync event once it's back so it
+can drop everything it caches, the cache TTLs bound how long a missed
+event goes unnoticed otherwise.
+"""
+import json
+import uuid
+import asyncio
+
+import asyncpg
+
+from loguru import logger
+
+import aiodb
+import settings
+
+
+# Also used by the triggers of db/migrations/20261018111500_event_bus.sql
+CHANNEL = "events"
+
+# Postgres refuses notification payloads of 8000 bytes or more
+MAX_PAYLOAD = 7900
+
+SEND_EVENTS = 'SELECT pg_notify($1, "payload") FROM unnest($2::text[]) AS "payload"'
+
+
+class EventBus:
+    def __init__(self):
+        # Tells this worker's events apart from the others'
+        self.origin = uuid.uuid4().hex
+        self.loop = None
+        self.handlers = {}
+        self.published = 0
+        self.sent = 0
+        self.received = 0
+        self.handled = 0
+        self.errors = 0
+        self.reconnects = 0
+        self._outbox = []
+        self._inbox = []
+        self._wake = None
+        self._tasks = []
+        self._connection = None
+
+    def subscribe(self, name: str, handler):
+        """handler(data) is called on the event loop for events of other workers."""
+        self.handlers.setdefault(name, []).append(handler)
+
+    async def start(self):
+        self.loop = asyncio.get_event_loop()
+        self._wake = asyncio.Event()
+        await self.listen()
+        self._tasks = [
+            self.loop.create_task(self.send()),
+            self.loop.create_task(self.watch())
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self.loop is not None:
+            await self.flush()
+        self.loop = None
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+    def publish(self, name: str, data: dict):
+        """Can be called from any thread, does nothing before start."""
+        loop = self.loop
+        if loop is None:
+            return
+        self.published += 1
+        loop.call_soon_threadsafe(self._enqueue, json.dumps([name, data], default=str))
+
+    def _enqueue(self, event: str):
+        self._outbox.append(event)
+        self._wake.set()
+
+    async def send(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            # Events published meanwhile go out in the same notifications
+            await asyncio.sleep(settings.BUS_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        events, self._outbox = self._outbox, []
+        if not events:
+            return
+        payloads = self.payloads(events)
+        try:
+            async with aiodb.acquire() as connection:
+                await connection.execute(SEND_EVENTS, CHANNEL, payloads)
+        except Exception as error:
+            self.errors += 1
+            logger.warning("Event bus failed to send {} events : {}".format(len(events), error))
+            return
+        self.sent += len(payloads)
+
+    def payloads(self, events: list):
+        """The events' notification payloads, each under MAX_PAYLOAD bytes."""
+        # json.dumps escapes non ASCII characters so lengths are in bytes
+        head = '{{"origin": "{}", "events": ['.format(self.origin)
+        payloads = []
+        batch = []
+        size = len(head) + 2
+        for event in events:
+            if len(head) + len(event) + 2 > MAX_PAYLOAD:
+                self.errors += 1
+                logger.warning("Event bus dropped an event of {} bytes".format(len(event)))
+                continue
+            if batch and size + len(event) + 1 > MAX_PAYLOAD:
+                payloads.append(head + ",".join(batch) + "]}")
+                batch = []
+                size = len(head) + 2
+            batch.append(event)
+            size += len(event) + 1
+        if batch:
+            payloads.append(head + ",".join(batch) + "]}")
+        return payloads
+
+    async def listen(self):
+        connection = await asyncpg.connect(
+            **aiodb.connection_settings(),
+            # Tells the listeners apart in pg_stat_activity
+            server_settings=dict(application_name="event bus")
+        )
+        await connection.add_listener(CHANNEL, self._notified)
+        self._connection = connection
+
+    async def watch(self):
+        """Checks the listener's connection and replaces it once it's lost."""
+        while True:
+            await asyncio.sleep(settings.BUS_RECONNECT_INTERVAL)
+            if self._connection is not None:
+                try:
+                    await self._connection.execute(
+                        settings.DB_POOL_HEALTH_CHECK_QUERY,
+                        timeout=settings.BUS_RECONNECT_INTERVAL
+                    )
+                    continue
+                except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError) as error:
+                    logger.warning("Event bus listener lost : {}".format(error))
+                    self._connection.terminate()
+                    self._connection = None
+
+            try:
+                await self.listen()
+            except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as error:
+                logger.warning("Event bus listener failed to reconnect : {}".format(error))
+                continue
+            self.reconnects += 1
+            logger.info("Event bus listener reconnected")
+            self.handle([["resync", {}]])
+
+    def _notified(self, connection, pid, channel, payload):
+        # asyncpg schedules a call per notification, all of the ones read
+        # together are queued before the dispatch scheduled by the first
+        if not self._inbox:
+            self.loop.call_soon(self.dispatch)
+        self._inbox.append(payload)
+
+    def dispatch(self):
+        payloads, self._inbox = self._inbox, []
+        events = []
+        for payload in payloads:
+            self.received += 1
+            try:
+                message = json.loads(payload)
+            except ValueError:
+                self.errors += 1
+                logger.warning("Event bus received a malformed notification : {}".format(payload))
+                continue
+            if message.get("origin") != self.origin:
+                events.extend(message["events"])
+        self.handle(events)
+
+    def handle(self, events: list):
+        for name, data in events:
+            for handler in self.handlers.get(name, ()):
+                try:
+                    handler(data)
+                except Exception as error:
+                    self.errors += 1
+                    logger.exception("Event bus handler of {} failed : {}".format(name, error))
+            self.handled += 1
+
+    def stats(self):
+        return dict(
+            connected=self._connection is not None and not self._connection.is_closed(),
+            published=self.published,
+            sent=self.sent,
+            received=self.received,
+            handled=self.handled,
+            errors=self.errors,
+            reconnects=self.reconnects
+        )
+
+
+event_bus = EventBus()
+
+
+def subscribe(name: str, handler):
+    event_bus.subscribe(name, handler)
+
+
+def publish(name: str, data: dict):
+    event_bus.publish(name, data)
+
+
+def stats():
+    return event_bus.stats()
+
+
+async def start():
+    if not settings.BUS_ENABLED:
+        return
+    await event_bus.start()
+    logger.info("Event bus listening on {}".format(CHANNEL))
+
+
+async def stop():
+    await event_bus.stop()
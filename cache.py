@@ -0,0 +1,319 @@
+import hmac
+import hashlib
+import threading
+import time
+
+from collections import OrderedDict
+
+from loguru import logger
+
+import settings
+
+
+class TTLCache:
+    """
+    Bounded, thread safe LRU cache whose entries expire ttl seconds
+    after they are set. Hits and misses are counted so the cache can
+    be sized from its stats.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                    self._evicted(key, entry[1])
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._evicted(key, entry[1])
+            return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                size=len(self._entries),
+                maxsize=self.maxsize,
+                ttl=self.ttl,
+                hits=self.hits,
+                misses=self.misses
+            )
+
+    def _store(self, key, value):
+        # Called with the lock held
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            evicted_key, entry = self._entries.popitem(last=False)
+            self._evicted(evicted_key, entry[1])
+
+    def _evicted(self, key, value):
+        # Called with the lock held whenever an entry leaves the cache
+        pass
+
+
+class CredentialCache(TTLCache):
+    """
+    Remembers users whose credentials have already been verified so
+    bcrypt runs once per session instead of once per request.
+
+    Entries are keyed by an HMAC of the username and password so plain
+    passwords are never held in memory.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize, ttl)
+        self._keys_by_username = {}
+
+    @staticmethod
+    def key(username: str, password: str):
+        return hmac.new(
+            str(settings.SECRET_KEY).encode(),
+            "{}\0{}".format(username, password).encode(),
+            hashlib.sha256
+        ).digest()
+
+    def set(self, key, user):
+        with self._lock:
+            self._keys_by_username.setdefault(user.username, set()).add(key)
+        super().set(key, user)
+
+    def invalidate_user(self, username: str):
+        with self._lock:
+            keys = list(self._keys_by_username.get(username, ()))
+        for key in keys:
+            self.pop(key)
+
+    def _evicted(self, key, user):
+        keys = self._keys_by_username.get(user.username)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_username[user.username]
+
+    def clear(self):
+        super().clear()
+        with self._lock:
+            self._keys_by_username.clear()
+
+
+class ResultCache(TTLCache):
+    """
+    TTLCache of results computed from the database and invalidated by the
+    writes they depend on. A result is only stored if its key wasn't
+    invalidated while it was being computed, so a read that started
+    before a write committed can't cache what the write changed.
+
+        generation = results.generation(key)
+        result = compute()
+        results.set(key, result, generation)
+
+    Invalidations are numbered by one counter and the last one of each
+    key is kept in an LRU of maxsize keys. A key dropped from it counts
+    as invalidated when the last dropped one was, which can only refuse
+    a result, never let a stale one in.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize, ttl)
+        self.invalidations = 0
+        # key: number of its last invalidation, least recent first
+        self._generations = OrderedDict()
+        self._dropped = 0
+
+    def generation(self, key):
+        with self._lock:
+            return self.invalidations
+
+    def set(self, key, value, generation: int = None):
+        with self._lock:
+            if generation is None or self._generations.get(key, self._dropped) <= generation:
+                self._store(key, value)
+
+    def invalidate(self, key):
+        """Called once the write has been committed."""
+        with self._lock:
+            self.invalidations += 1
+            self._generations[key] = self.invalidations
+            self._generations.move_to_end(key)
+            while len(self._generations) > self.maxsize:
+                _, self._dropped = self._generations.popitem(last=False)
+        self.pop(key)
+
+    def clear(self):
+        super().clear()
+        with self._lock:
+            # Invalidates every key at once
+            self.invalidations += 1
+            self._generations.clear()
+            self._dropped = self.invalidations
+
+    def stats(self):
+        stats = super().stats()
+        stats["invalidations"] = self.invalidations
+        stats["generations"] = len(self._generations)
+        return stats
+
+
+class GradeBandError(ValueError):
+    """The grade bands leave a percentage without a grade or give it two."""
+
+
+class GradeResolver:
+    """
+    Percentage to grade lookup from a 101 entry table built from the
+    grade bands, so grading a performance doesn't search the bands in SQL.
+
+    The table is rebuilt by load, which is given the (id,
+    starting_percentage, ending_percentage) of every grade. It goes
+    stale ttl seconds after it was loaded or when invalidate is called,
+    e.g by the Grade entity hooks, and the caller loads it again.
+    Bands with gaps or overlaps are rejected when they are loaded.
+    """
+
+    SIZE = 101
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.version = 0
+        self.loads = 0
+        self._table = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, bands):
+        table = [None] * cls.SIZE
+        overlaps = set()
+        for grade_id, starting_percentage, ending_percentage in bands:
+            if not 0 <= starting_percentage <= ending_percentage < cls.SIZE:
+                raise GradeBandError("Grade {} has an invalid band {}-{}".format(
+                    grade_id, starting_percentage, ending_percentage
+                ))
+            for percentage in range(starting_percentage, ending_percentage + 1):
+                if table[percentage] is not None:
+                    overlaps.add(percentage)
+                table[percentage] = grade_id
+
+        gaps = [percentage for percentage, grade_id in enumerate(table) if grade_id is None]
+        if overlaps or gaps:
+            raise GradeBandError("Grade bands overlap at {} and leave out {}".format(
+                sorted(overlaps) or "no percentage", gaps or "no percentage"
+            ))
+        return table
+
+    def load(self, bands):
+        bands = list(bands)
+        # No grades yet, e.g before the seed, fails when grading instead
+        table = self.build(bands) if bands else None
+        with self._lock:
+            self._table = table
+            self._expires_at = time.monotonic() + self.ttl
+            self.version += 1
+            self.loads += 1
+
+    def reload(self, bands):
+        """load that keeps serving the current table if the new bands are invalid."""
+        try:
+            self.load(bands)
+        except GradeBandError as error:
+            with self._lock:
+                if self._table is None:
+                    raise
+                self._expires_at = time.monotonic() + self.ttl
+            logger.error("Keeping the previous grade bands : {}".format(error))
+
+    def stale(self):
+        return time.monotonic() >= self._expires_at
+
+    def invalidate(self):
+        with self._lock:
+            self._expires_at = 0.0
+
+    def table(self):
+        table = self._table
+        if table is None:
+            raise GradeBandError("No grades have been set up")
+        return table
+
+    def resolve(self, percentage: int):
+        """Returns the id of the grade the percentage falls in."""
+        return self.table()[min(max(percentage, 0), self.SIZE - 1)]
+
+    def stats(self):
+        return dict(
+            version=self.version,
+            loads=self.loads,
+            ttl=self.ttl,
+            loaded=self._table is not None
+        )
+
+
+class RedisCache:
+    """
+    Byte strings shared by every worker through redis, entries expire
+    ttl seconds after they are set. The cache is an optimisation, when
+    redis can't be reached it misses instead of failing the request.
+    """
+
+    def __init__(self, url: str, prefix: str, ttl: float):
+        # redis is only needed when a shared cache is configured
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self.prefix = prefix
+        self.ttl = ttl
+        self.errors = 0
+        self._error = redis.RedisError
+
+    def get(self, key):
+        try:
+            return self.client.get(self.prefix + key)
+        except self._error as error:
+            self.errors += 1
+            logger.warning("Shared cache get failed : {}".format(error))
+            return None
+
+    def set(self, key, value: bytes):
+        try:
+            self.client.set(self.prefix + key, value, ex=int(self.ttl))
+        except self._error as error:
+            self.errors += 1
+            logger.warning("Shared cache set failed : {}".format(error))
+
+    def stats(self):
+        return dict(ttl=self.ttl, errors=self.errors)
+
+
+credentials = CredentialCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+grades = GradeResolver(settings.GRADE_CACHE_TTL)
+exam_stats = ResultCache(settings.EXAM_STATS_CACHE_SIZE, settings.EXAM_STATS_CACHE_TTL)
+papers = TTLCache(settings.PAPER_CACHE_SIZE, settings.PAPER_CACHE_TTL)
+shared_papers = None
+if settings.PAPER_CACHE_REDIS_URL:
+    shared_papers = RedisCache(settings.PAPER_CACHE_REDIS_URL, "paper:", settings.PAPER_CACHE_TTL)
@@ -0,0 +1,122 @@
+"""
+Fixtures of the tests. Most run against the database of the environment
+(see sample_dot_env), migrated and with the grades of seed.py:
+
+    python -m pytest
+
+Every test module gets users and an exam of its own, named after a
+random suffix, so runs don't collide with each other or the seed data.
+The SMS outbox worker doesn't run, tests drain it with FakeProvider.
+
+The app and the seed are only imported by the fixtures using them, as
+importing the models connects to the database. Tests without one, e.g
+tests/test_cache.py, run anywhere.
+"""
+import os
+import uuid
+
+# Before settings are read, tests drain the outbox themselves
+os.environ["SMS_WORKER_ENABLED"] = "False"
+
+import pytest
+
+from util import Role
+
+import profiler
+
+
+API = "/api/v1"
+PASSWORD = "test-password"
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def query_budget():
+    """
+    Fails the test once the block runs more than max_queries queries, or
+    one query more than max_repeats times:
+
+        with query_budget(5, max_repeats=1):
+            client.post(API + "/exam/submission", ...)
+    """
+    return profiler.query_budget
+
+
+def sign_in(client, username: str):
+    """Bearer headers of the user, so requests don't look the user up."""
+    response = client.post(API + "/auth/token", json=dict(username=username, password=PASSWORD))
+    assert response.status_code == 200, response.text
+    return {"Authorization": "Bearer {}".format(response.json()["access_token"])}
+
+
+@pytest.fixture(scope="module")
+def exam(client):
+    """
+    An exam of a new tutor with multiple choice and free text questions,
+    taken by three new learners.
+    """
+    from pony.orm import db_session
+
+    import seed
+
+    suffix = uuid.uuid4().hex[:8]
+    phone = int(suffix, 16) % 10 ** 7
+    with db_session:
+        tutor = seed.create_user(
+            "tutor-" + suffix, PASSWORD, "+2553{:07d}0".format(phone),
+            "tutor-{}@example.com".format(suffix), Role.tutor
+        )
+        learners = [
+            seed.create_user(
+                "learner-{}-{}".format(suffix, i), PASSWORD, "+2553{:07d}{}".format(phone, i + 1),
+                "learner-{}-{}@example.com".format(suffix, i), Role.learner
+            )
+            for i in range(3)
+        ]
+        tutor = tutor.username
+        learners = [(str(learner.id), learner.username) for learner in learners]
+    tutor_headers = sign_in(client, tutor)
+
+    response = client.post(
+        API + "/exam", json=dict(name="exam-" + suffix), headers=tutor_headers
+    )
+    assert response.status_code == 201, response.text
+    exam_id = response.json()["id"]
+
+    questions = []
+    for number in range(4):
+        question = dict(exam_id=exam_id, text="Question {}".format(number), marks=5)
+        if number % 2:
+            question.update(answer="Free text")
+        else:
+            question.update(multi_choice=["A", "B", "C"], answer="A")
+        response = client.post(API + "/exam/question", json=question, headers=tutor_headers)
+        assert response.status_code == 201, response.text
+        questions.append(response.json())
+
+    for learner_id, _ in learners:
+        response = client.post(
+            API + "/exam/participant",
+            json=dict(exam_id=exam_id, user_id=learner_id),
+            headers=tutor_headers
+        )
+        assert response.status_code == 201, response.text
+
+    return dict(
+        id=exam_id,
+        questions=questions,
+        tutor=tutor_headers,
+        learners=[
+            dict(id=learner_id, headers=sign_in(client, username))
+            for learner_id, username in learners
+        ]
+    )
@@ -1,5 +1,9 @@
-import requests
-import shutil
+import io
+import os
+import csv
+import json
+import time
+import asyncio
 
 from fastapi import Depends
 from fastapi import status
@@ -8,14 +12,25 @@ from fastapi import UploadFile
 
 from fastapi.security import HTTPBasic
 from fastapi.security import HTTPBasicCredentials
+from fastapi.security import HTTPBearer
+from fastapi.security import HTTPAuthorizationCredentials
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
 
 from loguru import logger
 from typing import List
-from pathlib import Path
 
 from pony.orm import *
 
 from uuid import UUID
+from uuid import uuid4
+from datetime import datetime as dt
+from datetime import timedelta
+from types import SimpleNamespace
+
+from psycopg2.extras import Json
+from pydantic import ValidationError
 
 from models import User
 from models import Exam
@@ -25,22 +40,66 @@ from models import Submission
 from models import Grade
 from models import Performance
 from models import Notification
+from models import NotificationJob
 from models import Mentorship
+from models import Video
 from models import Status
 from models import Role
 from models import Mark
-
+from models import NotificationStatus
+
+import aiodb
+import bus
+import cache
+import live
+import media
+import metrics
 import models
+import notifier
 import schemas
+import serialization
 import settings
+import storage
+import tokens
 import util
 
 
-security = HTTPBasic()
+# Either scheme may be used, authenticate_user says which one is missing
+security = HTTPBasic(auto_error=False)
+bearer = HTTPBearer(auto_error=False)
+
+# Credential verifications in flight by credentials cache key
+verifications = {}
+
+# Exam papers being built by (exam id, version)
+paper_builds = {}
+
+video_storage = storage.get_storage()
+
+QUESTION_COLUMNS = (
+    "id", "number", "text", "multi_choice", "marks", "answer",
+    "metadata", "created_at", "updated_at", "exam"
+)
+
+SUBMISSION_COLUMNS = (
+    "id", "answer", "mark", "marks_obtained", "comment",
+    "metadata", "created_at", "updated_at", "question", "user"
+)
+
+PERFORMANCE_COLUMNS = (
+    "id", "ticks", "crosses", "unmarked", "marks_obtained", "total_marks",
+    "total_number_of_questions", "percentage", "metadata", "created_at",
+    "updated_at", "grade", "exam", "user"
+)
+
+MENTORSHIP_COLUMNS = (
+    "id", "tutor", "challenge_being_faced", "is_active", "metadata",
+    "created_at", "updated_at", "user"
+)
 
 
 def is_authorized(user_role: Role, action: str):
-    logger.debug("Action : {}, Role : {}".format(action, user_role))
+    logger.debug("Action : {}, Role : {}", action, user_role)
     if user_role not in settings.roles[action]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -49,12 +108,31 @@ def is_authorized(user_role: Role, action: str):
     return True
 
 
-@db_session
-def authenticate_user(credentials: HTTPBasicCredentials = Depends(security)):
-    user = get_user(credentials.username)
-    if user and \
-        user.status == Status.active and \
-            util.verify_password(credentials.password, user.password):
+@metrics.timed("authenticate_user")
+async def authenticate_user(
+    token: HTTPAuthorizationCredentials = Depends(bearer),
+    credentials: HTTPBasicCredentials = Depends(security)
+):
+    # Bearer tokens are checked in memory, see tokens.py
+    if token is not None:
+        user = tokens.verify(token.credentials)
+        if user:
+            return user
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid, expired or revoked token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    if credentials is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+
+    user = await check_credentials(credentials.username, credentials.password)
+    if user:
         return user
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -63,31 +141,259 @@ def authenticate_user(credentials: HTTPBasicCredentials = Depends(security)):
     )
 
 
-@db_session
-def get_user(username: str):
-    return User.get(username=username, status=Status.active)
+async def check_credentials(username: str, password: str):
+    key = cache.credentials.key(username, password)
+    user = cache.credentials.get(key)
+    if user:
+        return user
+
+    # Concurrent requests with the same uncached credentials, e.g a page
+    # firing several calls right after sign in, share one verification
+    verification = verifications.get(key)
+    if verification is None:
+        verification = asyncio.ensure_future(verify_credentials(key, username, password))
+        verifications[key] = verification
+        verification.add_done_callback(lambda _: verifications.pop(key, None))
+
+    return await asyncio.shield(verification)
+
+
+async def verify_credentials(key: bytes, username: str, password: str):
+    user = await get_user(username)
+    if not user:
+        return None
+    # bcrypt is CPU bound, keep it off the event loop
+    with metrics.span("verify_password"):
+        verified = await run_in_threadpool(util.verify_password, password, user.password)
+    if verified:
+        cache.credentials.set(key, user)
+        return user
+    return None
+
+
+async def get_user(username: str):
+    async with aiodb.acquire() as connection:
+        record = await connection.fetchrow(aiodb.SELECT_ACTIVE_USER, username)
+    if not record:
+        return None
+
+    # A plain object rather than an entity so it can be cached and read
+    # outside of any database session
+    user = SimpleNamespace(**record)
+    user.role = Role[user.role]
+    user.status = Status[user.status]
+    return user
 
 
-def upload_video(user_role: Role, uploaded_file: UploadFile, videos_dir: str):
+async def get_profile(user):
+    """The account of the user, read for users of bearer tokens which only carry its id."""
+    if getattr(user, "session", None) is None:
+        return user
+    profile = await get_user(user.username)
+    if not profile:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Inactive account",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return profile
+
+
+def issue_tokens(user, session: UUID, expires_at: dt, refresh_token: str = None):
+    access_token, _ = tokens.issue(user, session)
+    expires_at = tokens.timestamp(expires_at)
+    return dict(
+        access_token=access_token,
+        token_type="bearer",
+        expires_in=settings.TOKEN_TTL,
+        refresh_token=refresh_token or tokens.issue_refresh(user.id, session, expires_at),
+        refresh_expires_in=int(expires_at - tokens.timestamp(dt.utcnow()))
+    )
+
+
+async def sign_in(sign_in: schemas.SignIn):
+    user = await check_credentials(sign_in.username, sign_in.password)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password or inactive account"
+        )
+
+    session = uuid4()
+    now = dt.utcnow()
+    expires_at = now + timedelta(seconds=settings.REFRESH_TOKEN_TTL)
+    async with aiodb.acquire() as connection:
+        await connection.execute(aiodb.INSERT_SESSION, session, expires_at, now, user.id)
+    return issue_tokens(user, session, expires_at)
+
+
+async def refresh_token(refresh: schemas.RefreshToken):
+    claims = tokens.decode(refresh.refresh_token, tokens.REFRESH)
+    record = None
+    if claims is not None:
+        # The session may have been signed out, or its user deactivated,
+        # on any worker since
+        async with aiodb.acquire() as connection:
+            record = await connection.fetchrow(
+                aiodb.SELECT_SESSION_USER, UUID(claims["sid"]), UUID(claims["sub"]), dt.utcnow()
+            )
+    if not record:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid, expired or revoked refresh token"
+        )
+
+    user = SimpleNamespace(**record)
+    user.role = Role[user.role]
+    user.status = Status[user.status]
+    expires_at = dt.utcfromtimestamp(claims["exp"])
+    return issue_tokens(user, UUID(claims["sid"]), expires_at, refresh.refresh_token)
+
+
+async def sign_out(user):
+    if getattr(user, "session", None) is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only sessions of bearer tokens can be signed out"
+        )
+
+    async with aiodb.acquire() as connection:
+        await connection.execute(aiodb.REVOKE_SESSION, user.session, dt.utcnow())
+    tokens.revoke_session(user.session)
+    return dict(session=user.session, signed_out=True)
+
+
+def upload_video(user_id: UUID, user_role: Role, uploaded_file: UploadFile, uploads_dir: str):
     is_authorized(user_role, "upload_file")
 
-    def save_upload_file(upload_file: UploadFile, destination: Path) -> None:
-        try:
-            with open(destination, "wb") as buffer:
-                shutil.copyfileobj(upload_file.file, buffer)
-        finally:
-            upload_file.file.close()
-    
-    save_upload_file(uploaded_file, videos_dir + uploaded_file.filename)
+    try:
+        with metrics.span("video_copy"):
+            upload = media.receive_file(
+                uploaded_file.file, uploads_dir, uploaded_file.filename
+            )
+    finally:
+        uploaded_file.file.close()
+
+    return store_video(user_id, upload)
+
+
+def init_video_upload(user_id: UUID, user_role: Role, video: schemas.VideoUpload, uploads_dir: str):
+    is_authorized(user_role, "upload_file")
+
+    return media.create_upload(
+        uploads_dir, user_id, video.file_name, video.size, video.sha256
+    )
+
+
+def get_video_upload(user_id: UUID, user_role: Role, upload_id: str, uploads_dir: str):
+    is_authorized(user_role, "upload_file")
+
+    return media.get_upload(uploads_dir, user_id, upload_id)
+
+
+def upload_video_chunk(
+    user_id: UUID, user_role: Role, upload_id: str, offset: int,
+    chunk: bytes, sha256: str, uploads_dir: str
+):
+    is_authorized(user_role, "upload_file")
+
+    return media.write_chunk(uploads_dir, user_id, upload_id, offset, chunk, sha256)
+
+
+def finalize_video_upload(user_id: UUID, user_role: Role, upload_id: str, uploads_dir: str):
+    is_authorized(user_role, "upload_file")
+
+    upload = media.finish_upload(uploads_dir, user_id, upload_id)
+
+    return store_video(user_id, upload)
+
+
+@db_session
+def store_video(user_id: UUID, upload: dict):
+    """
+    Moves a received video into storage under its SHA-256, a video
+    identical to one already stored isn't stored twice, and points the
+    video's name at it in the index.
+    """
+    with metrics.span("video_store"):
+        video_storage.put_file(upload["path"], upload["sha256"], upload["content_type"])
+
+    video_data = dict(
+        sha256=upload["sha256"],
+        size=upload["size"],
+        content_type=upload["content_type"],
+        user=User[user_id]
+    )
+    video = Video.get(name=upload["file_name"])
+    if video:
+        video.set(updated_at=dt.utcnow(), **video_data)
+    else:
+        video = Video(name=upload["file_name"], **video_data)
 
     return {
-        "file_name": uploaded_file.filename,
-        "content_type": uploaded_file.content_type
+        "file_name": video.name,
+        "content_type": video.content_type
     }
 
 
 @db_session
-def create_exam(user_id: UUID, user_role: Role, exam: schemas.Exam):
+def get_video(file_name: str):
+    return Video.get(name=file_name)
+
+
+def legacy_video_path(file_name: str, videos_dir: str):
+    """
+    Videos uploaded before the index existed are still read by name.
+    Only plain file names, never paths out of the videos directory.
+    """
+    path = os.path.join(videos_dir, os.path.basename(file_name))
+    if os.path.basename(file_name) and os.path.isfile(path):
+        return path
+    return None
+
+
+def stream_video(file_name: str, request_headers, videos_dir: str):
+    video = get_video(file_name)
+    if video:
+        try:
+            size, last_modified = video_storage.stat(video.sha256)
+        except FileNotFoundError:
+            logger.error("Video not stored : file_name: {}, sha256: {}".format(file_name, video.sha256))
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Video not found : file_name: {}".format(file_name)
+            )
+        return media.media_response(
+            request_headers,
+            size,
+            last_modified,
+            video.content_type,
+            video_storage.reader(video.sha256),
+            etag='"{}"'.format(video.sha256)
+        )
+
+    path = legacy_video_path(file_name, videos_dir)
+    if not path:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Video not found : file_name: {}".format(file_name)
+        )
+
+    stat = os.stat(path)
+    with open(path, "rb") as f:
+        head = f.read(16)
+
+    return media.media_response(
+        request_headers,
+        stat.st_size,
+        stat.st_mtime,
+        media.guess_content_type(file_name, head),
+        media.file_reader(path)
+    )
+
+
+@db_session
+def create_exam(user_id: UUID, user_role: Role, exam: schemas.Exam, videos_dir: str):
     is_authorized(user_role, "create_exam")
 
     exam_data = dict(
@@ -95,9 +401,20 @@ def create_exam(user_id: UUID, user_role: Role, exam: schemas.Exam):
         user=User[user_id]
     )
     if exam.video_tutorial_name:
-        exam_data["video_tutorial_name"] = exam.video_tutorial_name
+        # Resolved like stream_video does, through the index first
+        name = exam.video_tutorial_name
+        if not Video.exists(name=name) and not legacy_video_path(name, videos_dir):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Video not found : file_name: {}".format(name)
+            )
+        exam_data["video_tutorial_name"] = name
+
+    exam = Exam(**exam_data)
+    commit()
+    bus.publish("exam_created", dict(exam=exam.id, user=user_id))
 
-    return Exam(**exam_data)
+    return exam
 
 
 @db_session
@@ -133,7 +450,8 @@ def add_participant(user_id: UUID, user_role: Role, participant: schemas.Partici
 def create_question(user_id: UUID, user_role: Role, question_in: schemas.Question):
     is_authorized(user_role, "create_question")
 
-    exam = Exam.get(id=question_in.exam_id)
+    # Locking the exam serialises question numbering per exam
+    exam = Exam.get_for_update(id=question_in.exam_id)
     if not exam:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -157,60 +475,468 @@ def create_question(user_id: UUID, user_role: Role, question_in: schemas.Questio
         counter = 0
     question["number"] = counter + 1
 
-    return Question(**question).to_dict()
+    exam.total_marks += question_in.marks
+    exam.total_number_of_questions += 1
+    exam.version += 1
+
+    question = Question(**question)
+    commit()
+    cache.exam_stats.invalidate(exam.id)
+    cache.papers.pop(exam.id)
+    bus.publish("question_added", dict(exam=exam.id, version=exam.version))
+
+    return serialization.Projected(serialization.columns(question, QUESTION_COLUMNS))
 
 
 @db_session
-def create_submission(user_id: UUID, user_role: Role, submission: schemas.Submission):
-    is_authorized(user_role, "create_submission")
-    
-    question = Question.get(id=submission.question_id)
-    if not question:
+def create_questions_bulk(user_id: UUID, user_role: Role, exam_id: str, rows: List):
+    is_authorized(user_role, "create_question")
+
+    if len(rows) > settings.QUESTION_BULK_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="At most {} questions can be imported at once".format(
+                settings.QUESTION_BULK_MAX_ROWS
+            )
+        )
+
+    exam = Exam.get_for_update(id=exam_id)
+    if not exam:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=(
-                "Question not found : question_id: {}".format(
-                    submission.question_id
-                )
+            detail="Exam not found : id: {}".format(exam_id)
+        )
+
+    results = []
+    questions = []
+    for index, row in enumerate(rows):
+        try:
+            questions.append((index, schemas.BulkQuestion.parse_obj(row)))
+        except ValidationError as error:
+            results.append(dict(index=index, status="error", detail=error.errors()))
+
+    # One block of numbers for the whole import, the exam lock above
+    # keeps concurrent imports from allocating the same numbers
+    counter = select(max(q.number) for q in Question if q.exam == exam)[:][0]
+    if not counter:
+        counter = 0
+
+    now = dt.utcnow()
+    records = []
+    for number, (index, question_in) in enumerate(questions, start=counter + 1):
+        record = dict(
+            id=uuid4(),
+            number=number,
+            text=question_in.text,
+            multi_choice=question_in.multi_choice or [],
+            marks=question_in.marks,
+            answer=question_in.answer or "",
+            metadata={},
+            created_at=now,
+            updated_at=now,
+            exam=exam.id
+        )
+        records.append(record)
+        results.append(dict(index=index, status="created", question=record))
+
+    util.bulk_insert(
+        models.db,
+        "question",
+        QUESTION_COLUMNS,
+        [
+            tuple(
+                Json(record[column]) if column == "metadata" else record[column]
+                for column in QUESTION_COLUMNS
             )
+            for record in records
+        ]
+    )
+
+    exam.total_marks += sum(record["marks"] for record in records)
+    exam.total_number_of_questions += len(records)
+    if records:
+        exam.version += 1
+    commit()
+    cache.exam_stats.invalidate(exam.id)
+    cache.papers.pop(exam.id)
+    if records:
+        bus.publish("question_added", dict(exam=exam.id, version=exam.version))
+
+    results.sort(key=lambda result: result["index"])
+
+    return dict(
+        created=len(records),
+        failed=len(results) - len(records),
+        results=results
+    )
+
+
+@db_session
+def start_exam(user_id: UUID, user_role: Role, start: schemas.StartExam):
+    """
+    Starts the learner's exam session, from now on answers are only
+    accepted until the deadline. The alert_after reminders are queued in
+    the notification outbox due at their time, the notifier sends them
+    along with every other SMS. Starting an exam again returns the
+    session already running.
+    """
+    is_authorized(user_role, "start_exam")
+
+    exam = Exam.get(id=start.exam_id)
+    if not exam:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Exam not found : id: {}".format(start.exam_id)
         )
-    
-    participant = Participant.get(exam=question.exam, user=User[user_id])
+
+    user = User[user_id]
+    # Locked so concurrent starts can't both queue reminders
+    participant = Participant.get_for_update(exam=exam, user=user)
     if not participant:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=(
-                "Participant not found : exam_id: {}".format(
-                    question.exam.id
+            detail="Participant not found : exam_id: {}".format(start.exam_id)
+        )
+
+    if participant.deadline is None:
+        if not exam.is_active:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Exam is not active : id: {}".format(exam.id)
+            )
+
+        duration = exam.time_duration
+        if start.duration:
+            duration = min(start.duration, exam.time_duration)
+
+        alert_after = sorted(set(start.alert_after or []))
+        if any(minutes <= 0 or minutes >= duration for minutes in alert_after):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="alert_after must be minutes between 0 and {}".format(duration)
+            )
+
+        now = dt.utcnow()
+        participant.started_at = now
+        participant.deadline = now + timedelta(minutes=duration)
+        participant.metadata = dict(participant.metadata, alert_after=alert_after)
+
+        for minutes in alert_after:
+            Notification(
+                user=user,
+                recipient=user.phone_number,
+                message="{} : {} minutes left".format(exam.name, duration - minutes),
+                next_attempt_at=now + timedelta(minutes=minutes),
+                idempotency_key="exam-reminder:{}:{}".format(participant.id, minutes)
+            )
+
+    return exam_session(participant)
+
+
+def exam_session(participant: models.Participant):
+    remaining = (participant.deadline - dt.utcnow()).total_seconds()
+    return dict(
+        exam=participant.exam.id,
+        user=participant.user.id,
+        started_at=participant.started_at,
+        deadline=participant.deadline,
+        remaining_seconds=max(int(remaining), 0),
+        alert_after=participant.metadata.get("alert_after", [])
+    )
+
+
+def check_deadline(deadline: dt, exam_id: UUID):
+    """Rejects answers to an exam the learner hasn't started or whose time is up."""
+    if deadline is None:
+        if settings.EXAM_START_REQUIRED:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Exam not started : exam_id: {}".format(exam_id)
+            )
+        return
+
+    if dt.utcnow() > deadline + timedelta(seconds=settings.EXAM_DEADLINE_GRACE):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Exam time is up : exam_id: {}".format(exam_id)
+        )
+
+
+async def get_exam_paper(user_id: UUID, user_role: Role, exam_id: str, request_headers):
+    """
+    The exam's questions without their answers, for the learners taking
+    it and the tutor who set it. The paper is built once per exam version
+    and served from the cache to everyone else, a request carrying the
+    ETag of the current version gets a 304.
+    """
+    is_authorized(user_role, "get_exam_paper")
+
+    exam_id = UUID(exam_id)
+    async with aiodb.acquire() as connection:
+        exam = await connection.fetchrow(aiodb.SELECT_EXAM_VERSION, exam_id, user_id)
+
+    if not exam or (user_role == Role.tutor and not exam["owner"]):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Exam not found : id: {}".format(exam_id)
+        )
+
+    if user_role == Role.learner and not exam["participant"]:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Participant not found : exam_id: {}".format(exam_id)
+        )
+
+    etag = '"{}-{}"'.format(exam_id, exam["version"])
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None and media.etag_matches(if_none_match, etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={"ETag": etag, "Cache-Control": "private, no-cache"}
+        )
+
+    version, paper = await exam_paper(exam_id, exam["version"])
+
+    return Response(
+        paper,
+        media_type="application/json",
+        headers={
+            "ETag": '"{}-{}"'.format(exam_id, version),
+            "Cache-Control": "private, no-cache"
+        }
+    )
+
+
+async def exam_paper(exam_id: UUID, version: int):
+    """Returns the (version, serialized paper) of the exam, at least version."""
+    paper = cache.papers.get(exam_id)
+    if paper is not None and paper[0] >= version:
+        return paper
+
+    # Learners opening the exam at the same time share one build
+    key = (exam_id, version)
+    build = paper_builds.get(key)
+    if build is None:
+        build = asyncio.ensure_future(build_exam_paper(exam_id, version))
+        paper_builds[key] = build
+        build.add_done_callback(lambda _: paper_builds.pop(key, None))
+
+    return await asyncio.shield(build)
+
+
+async def build_exam_paper(exam_id: UUID, version: int):
+    shared_key = "{}:{}".format(exam_id, version)
+    paper = None
+    if cache.shared_papers is not None:
+        paper = await run_in_threadpool(cache.shared_papers.get, shared_key)
+
+    if paper is not None:
+        paper = (version, paper)
+    else:
+        async with aiodb.acquire() as connection:
+            record = await connection.fetchrow(aiodb.SELECT_EXAM_PAPER, exam_id)
+        paper = (record["version"], record["paper"].encode())
+        if cache.shared_papers is not None:
+            await run_in_threadpool(
+                cache.shared_papers.set, "{}:{}".format(exam_id, paper[0]), paper[1]
+            )
+
+    cache.papers.set(exam_id, paper)
+    return paper
+
+
+async def create_submission(user_id: UUID, user_role: Role, submission: schemas.Submission):
+    is_authorized(user_role, "create_submission")
+
+    question_id = UUID(submission.question_id)
+
+    async with aiodb.transaction() as connection:
+        question = await connection.fetchrow(
+            aiodb.SELECT_QUESTION_FOR_SUBMISSION, question_id, user_id
+        )
+        if not question:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=(
+                    "Question not found : question_id: {}".format(
+                        submission.question_id
+                    )
                 )
             )
+
+        if not question["participant"]:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=(
+                    "Participant not found : exam_id: {}".format(
+                        question["exam"]
+                    )
+                )
+            )
+
+        # The deadline comes with the question, no query of its own
+        check_deadline(question["deadline"], question["exam"])
+
+        mark, marks_obtained = auto_mark(
+            question["multi_choice"], question["answer"], question["marks"],
+            submission.answer
         )
 
-    if len(question.multi_choice) > 0:
-        if submission.answer == question.answer:
-            marks_obtained = question.marks
-            mark = Mark.auto_tick
-        else:
-            marks_obtained = 0
-            mark = Mark.auto_cross
+        record = await connection.fetchrow(
+            aiodb.INSERT_SUBMISSION,
+            uuid4(), submission.answer, mark.name, marks_obtained, dt.utcnow(),
+            question_id, user_id
+        )
+
+        performance = await review_performance_async(
+            connection, user_id, question["exam"],
+            question["total_marks"], question["total_number_of_questions"],
+            tally(mark, marks_obtained)
+        )
+
+    cache.exam_stats.invalidate(question["exam"])
+    bus.publish("submission_created", dict(exam=question["exam"], user=user_id))
+    publish_performance(dict(performance))
+
+    submission = dict(record)
+    submission["mark"] = mark
+
+    return serialization.Projected(submission)
+
+
+@db_session
+def create_submissions_bulk(user_id: UUID, user_role: Role, exam_id: str, sheet: schemas.AnswerSheet):
+    is_authorized(user_role, "create_submission")
 
-        submission = Submission(
-            answer=submission.answer,
-            question=question,
-            user=User[user_id],
+    exam = Exam.get(id=exam_id)
+    if not exam:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Exam not found : id: {}".format(exam_id)
+        )
+
+    user = User[user_id]
+    participant = Participant.get(exam=exam, user=user)
+    if not participant:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Participant not found : exam_id: {}".format(exam_id)
+        )
+
+    check_deadline(participant.deadline, exam.id)
+
+    results = []
+    answers = []
+    for index, answer in enumerate(sheet.answers):
+        try:
+            answers.append((index, UUID(answer.question_id), answer.answer))
+        except ValueError:
+            results.append(dict(
+                index=index, status="error",
+                detail="Invalid question_id : {}".format(answer.question_id)
+            ))
+
+    question_ids = [question_id for _, question_id, _ in answers]
+    questions = {
+        q.id: q
+        for q in select(
+            q for q in Question
+            if q.exam == exam and q.id in question_ids
+        )
+    }
+    answered = set(select(
+        s.question.id
+        for s in Submission
+        if s.user == user and s.question.exam == exam
+    ))
+
+    now = dt.utcnow()
+    records = []
+    delta = (0, 0, 0, 0)
+    for index, question_id, answer in answers:
+        question = questions.get(question_id)
+        if not question:
+            results.append(dict(
+                index=index, status="error",
+                detail="Question not found : question_id: {}".format(question_id)
+            ))
+            continue
+        if question_id in answered:
+            results.append(dict(
+                index=index, status="error",
+                detail="This record cannot be submitted more than once"
+            ))
+            continue
+        answered.add(question_id)
+
+        mark, marks_obtained = auto_mark(
+            question.multi_choice, question.answer, question.marks, answer
+        )
+        record = dict(
+            id=uuid4(),
+            answer=answer,
+            mark=mark,
             marks_obtained=marks_obtained,
-            mark=mark
+            comment="",
+            metadata={},
+            created_at=now,
+            updated_at=now,
+            question=question_id,
+            user=user.id
         )
+        records.append(record)
+        results.append(dict(index=index, status="created", submission=record))
+
+        counts = tally(mark, marks_obtained)
+        delta = tuple(total + count for total, count in zip(delta, counts))
+
+    util.bulk_insert(
+        models.db,
+        "submission",
+        SUBMISSION_COLUMNS,
+        [
+            (
+                record["id"], record["answer"], record["mark"].name,
+                record["marks_obtained"], record["comment"],
+                Json(record["metadata"]), record["created_at"],
+                record["updated_at"], record["question"], record["user"]
+            )
+            for record in records
+        ]
+    )
+
+    if records:
+        performance = review_performance(user, exam, delta)
+        commit()
+        cache.exam_stats.invalidate(exam.id)
+        bus.publish("submission_created", dict(exam=exam.id, user=user.id))
+        publish_performance(performance.to_dict())
     else:
-        submission = Submission(
-            answer=submission.answer,
-            question=question,
-            user=User[user_id]
+        performance = Performance.get(user=user, exam=exam)
+
+    results.sort(key=lambda result: result["index"])
+
+    return serialization.Projected(dict(
+        created=len(records),
+        failed=len(results) - len(records),
+        results=results,
+        performance=(
+            serialization.columns(performance, PERFORMANCE_COLUMNS)
+            if performance else None
         )
+    ))
 
-    performance_review(submission)
 
-    return submission.to_dict()
+def auto_mark(multi_choice: List[str], correct_answer: str, marks: int, answer: str):
+    """
+    Returns the (mark, marks_obtained) of an answer. Multi choice answers
+    are marked on the spot, free text ones are left for the tutor.
+    """
+    if multi_choice and len(multi_choice) > 0:
+        if answer == correct_answer:
+            return Mark.auto_tick, marks
+        return Mark.auto_cross, 0
+    return Mark.unmarked, 0
 
 
 @db_session
@@ -234,6 +960,9 @@ def mark_submission(user_id: UUID, user_role: Role, submission: schemas.Submissi
         )
     
     if submission.mark == Mark.unmarked:
+        previous_mark = submission.mark
+        previous_marks_obtained = submission.marks_obtained
+
         submission.mark = mark
         if marks_to_award:
             submission.marks_obtained = marks_to_award
@@ -243,9 +972,20 @@ def mark_submission(user_id: UUID, user_role: Role, submission: schemas.Submissi
                 if mark == Mark.tick else 0
             )
 
-        performance_review(submission)
+        performance = performance_review(
+            submission, previous_mark, previous_marks_obtained
+        )
+
+        commit()
+        cache.exam_stats.invalidate(submission.question.exam.id)
+        bus.publish("submission_marked", dict(
+            exam=submission.question.exam.id, user=submission.user.id
+        ))
+        publish_performance(performance.to_dict())
 
-        return submission.to_dict()
+        return serialization.Projected(
+            serialization.columns(submission, SUBMISSION_COLUMNS)
+        )
     
     raise HTTPException(
         status_code=status.HTTP_403_FORBIDDEN,
@@ -257,51 +997,387 @@ def mark_submission(user_id: UUID, user_role: Role, submission: schemas.Submissi
         )
 
 
-def performance_review(submission : models.Submission):
-    exam = submission.question.exam
+async def get_marking_queue(
+    user_id: UUID, user_role: Role, limit: int,
+    cursor: str = None, exam_id: str = None
+):
+    """
+    One page of the unmarked submissions to the tutor's exams, oldest
+    first. The page after it starts from next_cursor, which is None on
+    the last page.
+    """
+    is_authorized(user_role, "get_marking_queue")
+
+    exam_id = UUID(exam_id) if exam_id else None
+    limit = min(max(limit, 1), settings.MARKING_QUEUE_MAX_PAGE_SIZE)
+
+    async with aiodb.acquire() as connection:
+        # One row more than the page tells whether there is a next page
+        if cursor is None:
+            rows = await connection.fetch(
+                aiodb.SELECT_MARKING_QUEUE, user_id, exam_id, limit + 1
+            )
+        else:
+            created_at, last_id = util.decode_cursor(cursor)
+            rows = await connection.fetch(
+                aiodb.SELECT_MARKING_QUEUE_AFTER, user_id, exam_id,
+                dt.fromisoformat(created_at), UUID(last_id), limit + 1
+            )
 
-    exam_questions = select(
-        q
-        for q in Question
-        if q.exam == exam
-    )[:]
+    page = [dict(row) for row in rows[:limit]]
+
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = util.encode_cursor([
+            page[-1]["created_at"].isoformat(), page[-1]["id"]
+        ])
+
+    return dict(submissions=page, next_cursor=next_cursor)
+
+
+@db_session
+def mark_submissions(user_id: UUID, user_role: Role, batch: schemas.MarkingBatch):
+    """
+    Marks many submissions to the tutor's exams in one transaction. Each
+    learner's Performance is brought up to date once for all of their
+    submissions in the batch.
+    """
+    is_authorized(user_role, "mark_submission")
+
+    if len(batch.submissions) > settings.MARKING_BATCH_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="At most {} submissions can be marked at once".format(
+                settings.MARKING_BATCH_MAX_ROWS
+            )
+        )
+
+    results = []
+    decisions = []
+    for index, decision in enumerate(batch.submissions):
+        if decision.mark not in ("tick", "cross"):
+            results.append(dict(
+                index=index, status="error",
+                detail="Mark must be tick or cross : {}".format(decision.mark)
+            ))
+            continue
+        try:
+            decisions.append((index, UUID(decision.submission_id), decision))
+        except ValueError:
+            results.append(dict(
+                index=index, status="error",
+                detail="Invalid submission_id : {}".format(decision.submission_id)
+            ))
+
+    # Locked so a concurrent mark of the same submission waits and then
+    # finds it marked instead of counting it twice. Only the submissions
+    # are locked, not the exams and questions they are joined to
+    submission_ids = [str(submission_id) for _, submission_id, _ in decisions]
+    tutor_id = str(user_id)
+    submissions = {
+        s.id: s
+        for s in Submission.select_by_sql(
+            """SELECT s.* FROM "submission" s
+            JOIN "question" q ON q."id" = s."question"
+            JOIN "exam" e ON e."id" = q."exam"
+            WHERE s."id" = ANY($submission_ids::uuid[]) AND e."user" = $tutor_id::uuid
+            FOR UPDATE OF s
+            """
+        )
+    }
+
+    marked = set()
+    deltas = {}
+    for index, submission_id, decision in decisions:
+        submission = submissions.get(submission_id)
+        if not submission:
+            results.append(dict(
+                index=index, status="error",
+                detail="Submission not found : submission_id: {}".format(submission_id)
+            ))
+            continue
+        if submission.mark != Mark.unmarked or submission_id in marked:
+            results.append(dict(
+                index=index, status="error",
+                detail="Submission already marked : submission_id: {}".format(submission_id)
+            ))
+            continue
+        marked.add(submission_id)
+
+        mark = Mark.tick if decision.mark == "tick" else Mark.cross
+        submission.mark = mark
+        if decision.marks:
+            submission.marks_obtained = decision.marks
+        else:
+            submission.marks_obtained = (
+                submission.question.marks if mark == Mark.tick else 0
+            )
+
+        key = (submission.user, submission.question.exam)
+        delta = tuple(
+            now - before for now, before in zip(
+                tally(mark, submission.marks_obtained), tally(Mark.unmarked, 0)
+            )
+        )
+        deltas[key] = tuple(
+            total + change for total, change in zip(deltas.get(key, (0, 0, 0, 0)), delta)
+        )
+        results.append(dict(
+            index=index, status="marked",
+            submission=serialization.columns(submission, SUBMISSION_COLUMNS)
+        ))
+
+    # In the same order for every batch so two of them lock the
+    # performances they share without deadlocking
+    performances = [
+        review_performance(user, exam, delta)
+        for (user, exam), delta in sorted(
+            deltas.items(), key=lambda item: (item[0][0].id, item[0][1].id)
+        )
+    ]
+
+    commit()
+    for exam in {exam for _, exam in deltas}:
+        cache.exam_stats.invalidate(exam.id)
+    for user, exam in deltas:
+        bus.publish("submission_marked", dict(exam=exam.id, user=user.id))
+    for performance in performances:
+        publish_performance(performance.to_dict())
+
+    results.sort(key=lambda result: result["index"])
+
+    return serialization.Projected(dict(
+        marked=len(marked),
+        failed=len(results) - len(marked),
+        results=results
+    ))
+
+
+def tally(mark: Mark, marks_obtained: int):
+    """
+    Returns the (ticks, crosses, unmarked, marks_obtained) contribution
+    of a single submission to its learner's performance.
+    """
+    if mark == Mark.tick or mark == Mark.auto_tick:
+        return (1, 0, 0, marks_obtained)
+    elif mark == Mark.cross or mark == Mark.auto_cross:
+        return (0, 1, 0, 0)
+    elif mark == Mark.unmarked:
+        return (0, 0, 1, 0)
+    return (0, 0, 0, 0)
+
+
+@db_session
+def load_grades():
+    """Reads the grade bands into the process wide cache.grades."""
+    cache.grades.reload(select(
+        (g.id, g.starting_percentage, g.ending_percentage)
+        for g in Grade
+    )[:])
+
+
+def current_grades():
+    """cache.grades, with the bands read again if they have gone stale."""
+    if cache.grades.stale():
+        load_grades()
+    return cache.grades
+
+
+async def current_grades_async(connection):
+    if cache.grades.stale():
+        cache.grades.reload(await connection.fetch(aiodb.SELECT_GRADE_BANDS))
+    return cache.grades
+
+
+def exam_questions_changed(data: dict):
+    """Drops what this worker has cached of an exam another one changed."""
+    exam_id = UUID(data["exam"])
+    cache.exam_stats.invalidate(exam_id)
+    cache.papers.pop(exam_id)
+
+
+def exam_submissions_changed(data: dict):
+    cache.exam_stats.invalidate(UUID(data["exam"]))
+
+
+def user_status_changed(data: dict):
+    cache.credentials.invalidate_user(data["username"])
+    # Tokens carry the status, ones issued before the change are refused
+    tokens.revocations.revoke_user(data["username"], time.time())
+
+
+def grades_changed(data: dict):
+    cache.grades.invalidate()
+
+
+def resync(data: dict):
+    """The event bus may have missed events, nothing cached can be trusted."""
+    cache.credentials.clear()
+    cache.exam_stats.clear()
+    cache.papers.clear()
+    cache.grades.invalidate()
+    asyncio.ensure_future(tokens.load_revocations())
 
-    total_marks, total_number_of_questions = 0, 0
-    for exam_question in exam_questions:
-        total_marks += exam_question.marks
-        total_number_of_questions += 1
 
+bus.subscribe("question_added", exam_questions_changed)
+bus.subscribe("submission_created", exam_submissions_changed)
+bus.subscribe("submission_marked", exam_submissions_changed)
+bus.subscribe("user_status_changed", user_status_changed)
+bus.subscribe("grades_changed", grades_changed)
+bus.subscribe("resync", resync)
+
+
+def grade_percentage(marks_obtained: int, total_marks: int):
+    percentage = marks_obtained * 100 // total_marks
+    grade = Grade[current_grades().resolve(percentage)]
+    return percentage, grade
+
+
+PERFORMANCE_EVENT_FIELDS = (
+    "id", "user", "exam", "ticks", "crosses", "unmarked", "marks_obtained",
+    "total_marks", "total_number_of_questions", "percentage", "grade"
+)
+
+
+def publish_performance(performance: dict):
+    """
+    Pushes a committed Performance change to the live subscribers of its
+    exam and of its learner.
+    """
+    data = {field: performance[field] for field in PERFORMANCE_EVENT_FIELDS}
+    live.broker.publish(
+        ["exam:{}".format(data["exam"]), "learner:{}".format(data["user"])],
+        # A string so it's the same key once it went through the event bus
+        "{}:{}".format(data["user"], data["exam"]),
+        "performance",
+        data
+    )
+
+
+async def subscribe_performance(user_id: UUID, user_role: Role, exam_id: str = None):
+    """
+    Server sent events of Performance changes, of every learner of the
+    exam for its tutor, and of their own for a learner.
+    """
+    is_authorized(user_role, "subscribe_performance")
+
+    if user_role == Role.tutor:
+        if not exam_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="exam_id is required"
+            )
+        exam_id = UUID(exam_id)
+        async with aiodb.acquire() as connection:
+            exam = await connection.fetchrow(aiodb.SELECT_EXAM_VERSION, exam_id, user_id)
+        if not exam or not exam["owner"]:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Exam not found : id: {}".format(exam_id)
+            )
+        topics = ["exam:{}".format(exam_id)]
+    else:
+        topics = ["learner:{}".format(user_id)]
+
+    if live.broker.full():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many live subscribers, please retry",
+            headers={"Retry-After": "5"}
+        )
+
+    return media.MediaResponse(
+        live.stream(topics),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def performance_review(
+    submission: models.Submission,
+    previous_mark: Mark = None,
+    previous_marks_obtained: int = 0
+):
+    """
+    Brings the learner's Performance up to date with a new or re-marked
+    submission.
+    """
+    delta = tally(submission.mark, submission.marks_obtained)
+    if previous_mark is not None:
+        previous = tally(previous_mark, previous_marks_obtained)
+        delta = tuple(now - before for now, before in zip(delta, previous))
+
+    return review_performance(submission.user, submission.question.exam, delta)
+
+
+@metrics.timed("performance_review")
+def review_performance(user: models.User, exam: models.Exam, delta: tuple):
+    """
+    In incremental mode only delta, the change in the learner's
+    (ticks, crosses, unmarked, marks_obtained), is applied to the
+    Performance row, and the exam totals are read from the Exam row kept
+    current by create_question.
+    In full mode the exam and the learner's submissions are rescanned.
+    """
+    if settings.PERFORMANCE_REVIEW_MODE == "full":
+        reconcile_exam_totals(exam)
+        return recompute_performance(user, exam)
+
+    return apply_performance_delta(user, exam, delta)
+
+
+def apply_performance_delta(user: models.User, exam: models.Exam, delta: tuple):
+    # Locked, create_submission updates the same row from the asyncio
+    # path and Pony's optimistic check would fail the whole transaction
+    performance = Performance.get_for_update(user=user, exam=exam)
+
+    if not performance:
+        # First submission of this learner for this exam. The submission
+        # has already been flushed so a recompute includes it.
+        return recompute_performance(user, exam)
+
+    ticks, crosses, unmarked, marks_obtained = delta
+
+    performance.ticks += ticks
+    performance.crosses += crosses
+    performance.unmarked += unmarked
+    performance.marks_obtained += marks_obtained
+    performance.total_marks = exam.total_marks
+    performance.total_number_of_questions = exam.total_number_of_questions
+    performance.percentage, performance.grade = grade_percentage(
+        performance.marks_obtained, performance.total_marks
+    )
+
+    logger.opt(lazy=True).debug("Performance : {}", performance.to_dict)
+
+    return performance
+
+
+def recompute_performance(user: models.User, exam: models.Exam):
     learner_submissions = select(
         s
         for s in Submission
         if s.question.exam == exam
-        and s.user == submission.user
+        and s.user == user
     )[:]
 
     ticks = 0
     crosses = 0
     unmarked = 0
     marks_obtained = 0
-    
+
     for s in learner_submissions:
-        if s.mark == Mark.tick or s.mark == Mark.auto_tick:
-            ticks += 1
-            marks_obtained += s.marks_obtained
-        elif s.mark == Mark.cross or s.mark == Mark.auto_cross:
-            crosses += 1
-        elif s.mark == Mark.unmarked:
-            unmarked += 1
-        else:
-            pass
-    
-    percentage = int(marks_obtained / total_marks * 100)
-    grade = Grade.get(
-        lambda g:
-        percentage >= g.starting_percentage
-        and percentage <= g.ending_percentage
-    )
+        counts = tally(s.mark, s.marks_obtained)
+        ticks += counts[0]
+        crosses += counts[1]
+        unmarked += counts[2]
+        marks_obtained += counts[3]
+
+    total_marks = exam.total_marks
+    total_number_of_questions = exam.total_number_of_questions
+    percentage, grade = grade_percentage(marks_obtained, total_marks)
 
-    performance = Performance.get(user=submission.user, exam=exam)
+    performance = Performance.get_for_update(user=user, exam=exam)
 
     if not performance:
         performance_data = dict(
@@ -314,7 +1390,7 @@ def performance_review(submission : models.Submission):
             percentage=percentage,
             grade=grade,
             exam=exam,
-            user=submission.user
+            user=user
         )
         performance = Performance(**performance_data)
     else:
@@ -323,40 +1399,395 @@ def performance_review(submission : models.Submission):
         performance.unmarked = unmarked
         performance.marks_obtained = marks_obtained
         performance.total_marks = total_marks
+        performance.total_number_of_questions = total_number_of_questions
         performance.percentage = percentage
         performance.grade = grade
-    
-    logger.debug(performance.to_dict())
-    
+
+    logger.opt(lazy=True).debug("Performance : {}", performance.to_dict)
+
     return performance
 
 
+@metrics.timed("performance_review")
+async def review_performance_async(
+    connection, user_id: UUID, exam_id: UUID,
+    total_marks: int, total_number_of_questions: int, delta: tuple
+):
+    """
+    review_performance for the asyncio data path, run on the connection
+    and in the transaction the submission was written with.
+    """
+    if settings.PERFORMANCE_REVIEW_MODE == "full":
+        total_marks, total_number_of_questions = await connection.fetchrow(
+            aiodb.SELECT_EXAM_TOTALS, exam_id
+        )
+        await connection.execute(
+            aiodb.UPDATE_EXAM_TOTALS,
+            exam_id, total_marks, total_number_of_questions
+        )
+        return await recompute_performance_async(
+            connection, user_id, exam_id,
+            total_marks, total_number_of_questions, overwrite=True
+        )
+
+    grades = (await current_grades_async(connection)).table()
+    performance = await connection.fetchrow(
+        aiodb.UPDATE_PERFORMANCE_DELTA,
+        user_id, exam_id, *delta, total_marks, total_number_of_questions, grades
+    )
+    if performance:
+        return performance
+
+    performance = await recompute_performance_async(
+        connection, user_id, exam_id,
+        total_marks, total_number_of_questions, overwrite=False
+    )
+    if performance:
+        return performance
+
+    # A concurrent first submission of this learner created the row after
+    # the update above, it waited for that insert so the delta applies now
+    return await connection.fetchrow(
+        aiodb.UPDATE_PERFORMANCE_DELTA,
+        user_id, exam_id, *delta, total_marks, total_number_of_questions, grades
+    )
+
+
+async def recompute_performance_async(
+    connection, user_id: UUID, exam_id: UUID,
+    total_marks: int, total_number_of_questions: int, overwrite: bool
+):
+    ticks, crosses, unmarked, marks_obtained = await connection.fetchrow(
+        aiodb.SELECT_LEARNER_TALLY, exam_id, user_id
+    )
+    percentage = marks_obtained * 100 // total_marks
+    grade = (await current_grades_async(connection)).resolve(percentage)
+
+    return await connection.fetchrow(
+        aiodb.UPSERT_PERFORMANCE,
+        uuid4(), ticks, crosses, unmarked, marks_obtained, total_marks,
+        total_number_of_questions, percentage, dt.utcnow(), grade, exam_id,
+        overwrite, user_id
+    )
+
+
+def reconcile_exam_totals(exam: models.Exam):
+    total_marks, total_number_of_questions = select(
+        (sum(q.marks), count(q))
+        for q in Question
+        if q.exam == exam
+    ).first()
+
+    exam.total_marks = total_marks or 0
+    exam.total_number_of_questions = total_number_of_questions or 0
+
+    return exam
+
+
 @db_session
-def get_exam_performance(user_role: Role, exam_id: str):
+def reconcile_performance(fix: bool = False):
+    """
+    Recomputes every exam's totals and every learner's Performance from
+    the Question and Submission rows and reports where the incrementally
+    maintained values have drifted. Drift is only corrected when fix is set.
+    """
+    drift = []
+
+    question_totals = {
+        exam_id: (total_marks, total_number_of_questions)
+        for exam_id, total_marks, total_number_of_questions in select(
+            (q.exam.id, sum(q.marks), count(q))
+            for q in Question
+        )
+    }
+
+    for exam in Exam.select():
+        expected = question_totals.get(exam.id, (0, 0))
+        actual = (exam.total_marks, exam.total_number_of_questions)
+        if actual != expected:
+            drift.append(dict(
+                exam=exam.id, user=None,
+                expected=dict(
+                    total_marks=expected[0],
+                    total_number_of_questions=expected[1]
+                ),
+                actual=dict(
+                    total_marks=actual[0],
+                    total_number_of_questions=actual[1]
+                )
+            ))
+            if fix:
+                exam.total_marks, exam.total_number_of_questions = expected
+
+    learner_tallies = {}
+    # Pony can't translate Enum attributes inside queries, hence raw SQL
+    for user_id, exam_id, mark, number_of_submissions, marks_obtained in models.db.select(
+        """SELECT s."user", q."exam", s."mark", COUNT(*), SUM(s."marks_obtained")
+        FROM "submission" s
+        JOIN "question" q ON q."id" = s."question"
+        GROUP BY s."user", q."exam", s."mark"
+        """
+    ):
+        counts = tally(Mark[mark], marks_obtained)
+        totals = learner_tallies.get((user_id, exam_id), (0, 0, 0, 0))
+        learner_tallies[(user_id, exam_id)] = (
+            totals[0] + counts[0] * number_of_submissions,
+            totals[1] + counts[1] * number_of_submissions,
+            totals[2] + counts[2] * number_of_submissions,
+            totals[3] + counts[3]
+        )
+
+    performances = {
+        (p.user.id, p.exam.id): p
+        for p in Performance.select()
+    }
+
+    fields = (
+        "ticks", "crosses", "unmarked", "marks_obtained",
+        "total_marks", "total_number_of_questions"
+    )
+
+    for key in set(learner_tallies) | set(performances):
+        user_id, exam_id = key
+        # Recomputed totals, the exam's own may be the ones drifting
+        expected = learner_tallies.get(key, (0, 0, 0, 0)) + question_totals.get(exam_id, (0, 0))
+        performance = performances.get(key)
+        actual = (
+            tuple(getattr(performance, field) for field in fields)
+            if performance else None
+        )
+        if actual == expected:
+            continue
+
+        drift.append(dict(
+            exam=exam_id, user=user_id,
+            expected=dict(zip(fields, expected)),
+            actual=dict(zip(fields, actual)) if actual else None
+        ))
+        if fix and key in learner_tallies:
+            recompute_performance(User[user_id], Exam[exam_id])
+
+    for record in drift:
+        logger.warning("Performance drift : {}".format(record))
+
+    return drift
+
+
+async def get_exam_performance(user_role: Role, exam_id: str):
     is_authorized(user_role, "get_exam_performance")
 
-    exam = Exam.get(id=exam_id)
-    if not exam:
+    async with aiodb.acquire() as connection:
+        await raise_for_missing_exam(connection, UUID(exam_id))
+
+        results = await connection.fetch(aiodb.SELECT_EXAM_PERFORMANCE, UUID(exam_id))
+
+    # Written straight from the records, thousands of rows for a big exam
+    return serialization.Projected(results)
+
+
+async def get_exam_stats(user_role: Role, exam_id: str):
+    """
+    The exam's score statistics, grade distribution and how many learners
+    answered each question right, computed by the database and cached
+    until the exam gets a new submission or mark.
+    """
+    is_authorized(user_role, "get_exam_stats")
+
+    exam_id = UUID(exam_id)
+    stats = cache.exam_stats.get(exam_id)
+    if stats is not None:
+        return stats
+
+    generation = cache.exam_stats.generation(exam_id)
+    async with aiodb.acquire() as connection:
+        stats = await connection.fetchrow(aiodb.SELECT_EXAM_STATS, exam_id)
+
+    if not stats:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Exam not found : id: {}".format(exam_id)
         )
-    
-    results = select(p for p in Performance if p.exam == exam )[:]
 
-    performance = []
-    for result in results:
-        performance.append(result.to_dict())
-    
-    return performance
+    stats = dict(stats, computed_at=dt.utcnow())
+    cache.exam_stats.set(exam_id, stats, generation)
 
+    return stats
 
 
+RANKING_COLUMNS = (
+    "rank", "user", "username", "percentage", "marks_obtained", "total_marks",
+    "ticks", "crosses", "unmarked", "total_number_of_questions", "grade"
+)
 
-@db_session
-def notify_user(user_role: Role, user_id: str, message: str):
+EXPORT_MEDIA_TYPES = dict(
+    ndjson="application/x-ndjson",
+    csv="text/csv; charset=utf-8"
+)
+
+
+class Ranking:
+    """
+    Ranks performances read best first, learners with the same percentage
+    and marks share a rank and the next one skips the places they took
+    (1, 2, 2, 4). Starts again after a page from its last position and rank.
+    """
+
+    def __init__(self, position: int = 0, rank: int = 0, score: tuple = None):
+        self.position = position
+        self.rank = rank
+        self.score = score
+
+    def place(self, row):
+        self.position += 1
+        score = (row["percentage"], row["marks_obtained"])
+        if score != self.score:
+            self.rank, self.score = self.position, score
+        return self.rank
+
+
+async def raise_for_missing_exam(connection, exam_id: UUID):
+    if not await connection.fetchval(aiodb.SELECT_EXAM_EXISTS, exam_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Exam not found : id: {}".format(exam_id)
+        )
+
+
+async def get_exam_leaderboard(user_role: Role, exam_id: str, limit: int, cursor: str = None):
+    """
+    One page of the exam's performances ranked best first. The page after
+    it starts from next_cursor, which is None on the last page.
+    """
+    is_authorized(user_role, "get_exam_leaderboard")
+
+    exam_id = UUID(exam_id)
+    limit = min(max(limit, 1), settings.LEADERBOARD_MAX_PAGE_SIZE)
+
+    async with aiodb.acquire() as connection:
+        # One row more than the page tells whether there is a next page
+        if cursor is None:
+            ranking = Ranking()
+            rows = await connection.fetch(aiodb.SELECT_LEADERBOARD, exam_id, limit + 1)
+        else:
+            percentage, marks_obtained, last_id, position, rank = util.decode_cursor(cursor)
+            ranking = Ranking(position, rank, (percentage, marks_obtained))
+            rows = await connection.fetch(
+                aiodb.SELECT_LEADERBOARD_AFTER,
+                exam_id, percentage, marks_obtained, UUID(last_id), limit + 1
+            )
+
+        if not rows:
+            await raise_for_missing_exam(connection, exam_id)
+
+    page = [
+        dict(row, rank=ranking.place(row))
+        for row in rows[:limit]
+    ]
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1]
+        next_cursor = util.encode_cursor([
+            last["percentage"], last["marks_obtained"], last["id"],
+            ranking.position, ranking.rank
+        ])
+
+    return dict(exam=exam_id, performances=page, next_cursor=next_cursor)
+
+
+async def export_exam_performance(user_role: Role, exam_id: str, export_format: str):
+    """Streams the whole ranking of the exam as NDJSON or CSV."""
+    is_authorized(user_role, "export_exam_performance")
+
+    if export_format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Export format must be one of {}".format(list(EXPORT_MEDIA_TYPES))
+        )
+
+    exam_id = UUID(exam_id)
+    async with aiodb.acquire() as connection:
+        await raise_for_missing_exam(connection, exam_id)
+
+    return media.MediaResponse(
+        stream_ranking(exam_id, export_format),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": 'attachment; filename="performance-{}.{}"'.format(
+                exam_id, export_format
+            )
+        }
+    )
+
+
+def encode_ranking_rows(rows: list, export_format: str, header: bool = False):
+    if export_format == "ndjson":
+        return "".join(
+            json.dumps(dict(zip(RANKING_COLUMNS, row)), default=str) + "\n"
+            for row in rows
+        ).encode()
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(RANKING_COLUMNS)
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+async def stream_ranking(exam_id: UUID, export_format: str):
+    """
+    Reads the ranking through a server side cursor EXPORT_FETCH_SIZE rows
+    at a time, so neither the API nor the database hold the whole result.
+    The export is one consistent snapshot of the exam.
+    """
+    ranking = Ranking()
+    header = True
+    async with aiodb.acquire() as connection:
+        async with connection.transaction(isolation="repeatable_read", readonly=True):
+            batch = []
+            async for row in connection.cursor(
+                aiodb.SELECT_RANKING, exam_id, prefetch=settings.EXPORT_FETCH_SIZE
+            ):
+                batch.append([ranking.place(row)] + [
+                    row[column] for column in RANKING_COLUMNS[1:]
+                ])
+                if len(batch) >= settings.EXPORT_FETCH_SIZE:
+                    yield encode_ranking_rows(batch, export_format, header)
+                    header = False
+                    batch = []
+            if batch or header:
+                yield encode_ranking_rows(batch, export_format, header)
+
+
+def notify_user(
+    sender_id: UUID, user_role: Role, user_id: str, message: str, idempotency_key: str = None
+):
     is_authorized(user_role, "notify_user")
-    
+
+    notification = enqueue_notification(sender_id, user_id, message, idempotency_key)
+    notifier.wake()
+
+    return notification
+
+
+@db_session
+def enqueue_notification(
+    sender_id: UUID, user_id: str, message: str, idempotency_key: str = None
+):
+    """
+    Stores the SMS in the outbox for the notifier to send. A retried
+    request with the same idempotency key gets the notification it
+    already created.
+    """
+    if idempotency_key:
+        # Keys are the sender's own for one recipient, the same key of
+        # another sender never returns their notification
+        idempotency_key = "{}:{}:{}".format(sender_id, user_id, idempotency_key)
+        notification = Notification.get(idempotency_key=idempotency_key)
+        if notification:
+            return notification.to_dict()
+
     user = User.get(id=user_id)
     if not user:
         raise HTTPException(
@@ -367,47 +1798,130 @@ def notify_user(user_role: Role, user_id: str, message: str):
                 )
             )
         )
-    return send_sms(user, [user.phone_number], message)
 
+    notification_data = dict(
+        user=user,
+        recipient=user.phone_number,
+        message=message
+    )
+    if idempotency_key:
+        notification_data["idempotency_key"] = idempotency_key
 
-def send_sms(user: models.User, recipients: List[str], message: str):
+    return Notification(**notification_data).to_dict()
 
-    api_key = str(settings.AFRICASTALKING_API_KEY)
-    api_username = str(settings.AFRICASTALKING_API_USERNAME)
 
-    data = {
-        'username': api_username,
-        'to': ','.join(recipients),
-        'message': message,
-        # 'from': str(settings.AFRICASTALKING_API_SENDER_ID)
-    }
-    headers = {
-        'apiKey': api_key,
-        'Content-Type': 'application/x-www-form-urlencoded',
-        'Accept': 'application/json'
-    }
+NOTIFICATION_COLUMNS = (
+    "id", "message", "recipient", "status", "attempts", "next_attempt_at",
+    "error", "idempotency_key", "job", "metadata", "created_at", "updated_at",
+    "user"
+)
+
+
+def notify_participants(
+    user_id: UUID, user_role: Role, exam_id: str, message: str, idempotency_key: str = None
+):
+    is_authorized(user_role, "notify_participants")
+
+    job = broadcast_notification(user_id, user_role, exam_id, message, idempotency_key)
+    notifier.wake()
+
+    return job
+
+
+@db_session
+def broadcast_notification(
+    user_id: UUID, user_role: Role, exam_id: str, message: str, idempotency_key: str = None
+):
+    """
+    Queues the message for every active participant of the exam as one
+    NotificationJob, one Notification per participant. The job's key is
+    the exam's id, the caller's id and the request's key, so a retried
+    request gets the job it already created, even while that one is
+    still being written, and the same key used by someone else, or for
+    another exam, doesn't.
+    """
+    exam = Exam.get(id=exam_id)
+    # Tutors can only message their own exams
+    if not exam or (user_role == Role.tutor and exam.user.id != user_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Exam not found : id: {}".format(exam_id)
+        )
 
-    # logger.debug('SMS send request : {}'.format(data))
+    job = uuid4()
+    key = "{}:{}:{}".format(exam.id, user_id, idempotency_key or job.hex)
+    now = dt.utcnow()
+    # Waits for a concurrent request with the key to commit, then skips
+    created = models.db.execute(
+        """INSERT INTO "notification_job" ("id", "idempotency_key", "metadata", "created_at", "updated_at", "exam", "user")
+        VALUES ($job, $key, '{}', $now, $now, $exam_id, $user_id)
+        ON CONFLICT ("idempotency_key") DO NOTHING
+        RETURNING "id"
+        """,
+        dict(job=job, key=key, now=now, exam_id=exam.id, user_id=user_id)
+    ).fetchone()
+    if not created:
+        return notification_job_progress(NotificationJob.get(idempotency_key=key).id)
+
+    recipients = models.db.select(
+        """SELECT u."id", u."phone_number"
+        FROM "participant" p
+        JOIN "user" u ON u."id" = p."user"
+        WHERE p."exam" = $exam_id AND u."status" = 'active'
+        """,
+        dict(exam_id=exam.id)
+    )
 
-    response = requests.post(
-        settings.AFRICASTALKING_API_URL, data=data,
-        headers=headers
+    util.bulk_insert(
+        models.db,
+        "notification",
+        NOTIFICATION_COLUMNS,
+        [
+            (
+                uuid4(), message, phone_number, NotificationStatus.queued.name,
+                0, now, "", "{}:{}".format(key, learner_id), job, Json({}), now, now,
+                learner_id
+            )
+            for learner_id, phone_number in recipients
+        ]
     )
 
-    try:
-        response = response.json()
-    except Exception as error:
-        logger.debug(error)
+    return notification_job_progress(job)
+
+
+@db_session
+def get_notification_job(user_id: UUID, user_role: Role, job_id: str):
+    is_authorized(user_role, "notify_user")
+
+    job = NotificationJob.get(id=job_id)
+    # Tutors can only read jobs of their own exams, like they broadcast
+    if not job or (user_role == Role.tutor and job.exam.user.id != user_id):
         raise HTTPException(
-            status_code=response.status_code,
-            detail=response.text
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Notification job not found : id: {}".format(job_id)
         )
-    else:
-        sms_message_data = response['SMSMessageData']
-        notification = Notification(user=user, metadata=sms_message_data)
-        logger.debug(notification)
-    
-    return response
+
+    return notification_job_progress(job.id)
+
+
+def notification_job_progress(job: UUID):
+    counts = {
+        notification_status: count
+        for notification_status, count in models.db.select(
+            """SELECT "status", COUNT(*) FROM "notification"
+            WHERE "job" = $job
+            GROUP BY "status"
+            """,
+            dict(job=job)
+        )
+    }
+
+    progress = dict(job=job, total=sum(counts.values()))
+    for notification_status in NotificationStatus:
+        progress[notification_status.name] = counts.get(notification_status.name, 0)
+    progress["done"] = progress["queued"] + progress["sending"] == 0
+
+    return progress
 
 
 @db_session
@@ -423,4 +1937,22 @@ def request_for_mentorship(user_id: str, user_role: Role, mentorship: schemas.Me
         challenge_being_faced=challenge_being_faced
     )
 
-    return mentorship.to_dict()
\ No newline at end of file
+    return serialization.Projected(serialization.columns(mentorship, MENTORSHIP_COLUMNS))
+
+
+def get_stats(user_role: Role):
+    is_authorized(user_role, "get_stats")
+
+    return dict(
+        credentials_cache=cache.credentials.stats(),
+        grades=cache.grades.stats(),
+        exam_stats_cache=cache.exam_stats.stats(),
+        paper_cache=cache.papers.stats(),
+        bus=bus.stats(),
+        live=live.broker.stats(),
+        token_revocations=tokens.stats(),
+        database_pools=dict(
+            sync=models.db.provider.pool.as_dict(),
+            asyncio=aiodb.as_dict()
+        )
+    )
@@ -0,0 +1,21 @@
+-- migrate:up
+
+ALTER TABLE "exam" ADD COLUMN "total_marks" INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE "exam" ADD COLUMN "total_number_of_questions" INTEGER NOT NULL DEFAULT 0;
+
+UPDATE "exam" SET
+  "total_marks" = "totals"."total_marks",
+  "total_number_of_questions" = "totals"."total_number_of_questions"
+FROM (
+  SELECT "exam", SUM("marks") AS "total_marks", COUNT(*) AS "total_number_of_questions"
+  FROM "question"
+  GROUP BY "exam"
+) AS "totals"
+WHERE "totals"."exam" = "exam"."id";
+
+-- migrate:down
+
+ALTER TABLE "exam" DROP COLUMN "total_number_of_questions";
+
+ALTER TABLE "exam" DROP COLUMN "total_marks";
@@ -0,0 +1,25 @@
+-- migrate:up
+
+CREATE TABLE "video" (
+  "id" UUID PRIMARY KEY,
+  "name" TEXT UNIQUE NOT NULL,
+  "sha256" TEXT NOT NULL,
+  "size" BIGINT NOT NULL,
+  "content_type" TEXT NOT NULL,
+  "metadata" JSONB NOT NULL,
+  "created_at" TIMESTAMP NOT NULL,
+  "updated_at" TIMESTAMP NOT NULL,
+  "user" UUID NOT NULL
+);
+
+CREATE INDEX "idx_video__created_at" ON "video" ("created_at");
+
+CREATE INDEX "idx_video__sha256" ON "video" ("sha256");
+
+CREATE INDEX "idx_video__user" ON "video" ("user");
+
+ALTER TABLE "video" ADD CONSTRAINT "fk_video__user" FOREIGN KEY ("user") REFERENCES "user" ("id") ON DELETE CASCADE;
+
+-- migrate:down
+
+DROP TABLE "video";
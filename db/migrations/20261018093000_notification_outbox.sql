@@ -0,0 +1,61 @@
+-- migrate:up
+
+ALTER TABLE "notification" ADD COLUMN "message" TEXT NOT NULL DEFAULT '';
+
+ALTER TABLE "notification" ADD COLUMN "recipient" TEXT NOT NULL DEFAULT '';
+
+ALTER TABLE "notification" ADD COLUMN "status" VARCHAR(30) NOT NULL DEFAULT 'sent';
+
+ALTER TABLE "notification" ADD COLUMN "attempts" INTEGER NOT NULL DEFAULT 1;
+
+ALTER TABLE "notification" ADD COLUMN "next_attempt_at" TIMESTAMP;
+
+ALTER TABLE "notification" ADD COLUMN "locked_until" TIMESTAMP;
+
+ALTER TABLE "notification" ADD COLUMN "sent_at" TIMESTAMP;
+
+ALTER TABLE "notification" ADD COLUMN "error" TEXT NOT NULL DEFAULT '';
+
+ALTER TABLE "notification" ADD COLUMN "idempotency_key" TEXT;
+
+-- Notifications so far were sent while the request waited
+UPDATE "notification" SET
+  "recipient" = "user"."phone_number",
+  "next_attempt_at" = "notification"."created_at",
+  "sent_at" = "notification"."created_at",
+  "idempotency_key" = "notification"."id"::TEXT
+FROM "user"
+WHERE "user"."id" = "notification"."user";
+
+ALTER TABLE "notification" ALTER COLUMN "status" DROP DEFAULT;
+
+ALTER TABLE "notification" ALTER COLUMN "next_attempt_at" SET NOT NULL;
+
+ALTER TABLE "notification" ALTER COLUMN "idempotency_key" SET NOT NULL;
+
+ALTER TABLE "notification" ADD CONSTRAINT "notification_idempotency_key_key" UNIQUE ("idempotency_key");
+
+-- The outbox worker only ever looks for notifications still to be sent
+CREATE INDEX "idx_notification__outbox" ON "notification" ("next_attempt_at") WHERE "status" IN ('queued', 'sending');
+
+-- migrate:down
+
+DROP INDEX "idx_notification__outbox";
+
+ALTER TABLE "notification" DROP COLUMN "idempotency_key";
+
+ALTER TABLE "notification" DROP COLUMN "error";
+
+ALTER TABLE "notification" DROP COLUMN "sent_at";
+
+ALTER TABLE "notification" DROP COLUMN "locked_until";
+
+ALTER TABLE "notification" DROP COLUMN "next_attempt_at";
+
+ALTER TABLE "notification" DROP COLUMN "attempts";
+
+ALTER TABLE "notification" DROP COLUMN "status";
+
+ALTER TABLE "notification" DROP COLUMN "recipient";
+
+ALTER TABLE "notification" DROP COLUMN "message";
@@ -0,0 +1,9 @@
+-- migrate:up
+
+ALTER TABLE "notification" ADD COLUMN "job" UUID;
+
+CREATE INDEX "idx_notification__job" ON "notification" ("job");
+
+-- migrate:down
+
+ALTER TABLE "notification" DROP COLUMN "job";
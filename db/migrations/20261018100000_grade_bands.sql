@@ -0,0 +1,13 @@
+-- migrate:up
+
+-- The seeded E/F band ended at 65 where D starts, 65 had two grades
+UPDATE "grade" SET "ending_percentage" = 64, "updated_at" = now() AT TIME ZONE 'utc'
+WHERE "letter_grade" = 'E/F' AND "starting_percentage" = 0 AND "ending_percentage" = 65
+    AND EXISTS (
+        SELECT 1 FROM "grade" WHERE "letter_grade" = 'D' AND "starting_percentage" = 65
+    );
+
+-- migrate:down
+
+UPDATE "grade" SET "ending_percentage" = 65, "updated_at" = now() AT TIME ZONE 'utc'
+WHERE "letter_grade" = 'E/F' AND "starting_percentage" = 0 AND "ending_percentage" = 64;
@@ -0,0 +1,8 @@
+-- migrate:up
+
+-- Leaderboard pages and exports read an exam's performances best first
+CREATE INDEX "idx_performance__ranking" ON "performance" ("exam", "percentage" DESC, "marks_obtained" DESC, "id" DESC);
+
+-- migrate:down
+
+DROP INDEX "idx_performance__ranking";
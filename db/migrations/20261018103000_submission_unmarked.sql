@@ -0,0 +1,9 @@
+-- migrate:up
+
+-- The marking queue reads the unmarked submissions oldest first, they are
+-- a small share of all submissions once an exam has been marked
+CREATE INDEX "idx_submission__unmarked" ON "submission" ("created_at", "id") WHERE "mark" = 'unmarked';
+
+-- migrate:down
+
+DROP INDEX "idx_submission__unmarked";
@@ -0,0 +1,9 @@
+-- migrate:up
+
+-- Bumped whenever the exam's questions change, learners' cached exam
+-- papers are keyed by it
+ALTER TABLE "exam" ADD COLUMN "version" INTEGER NOT NULL DEFAULT 1;
+
+-- migrate:down
+
+ALTER TABLE "exam" DROP COLUMN "version";
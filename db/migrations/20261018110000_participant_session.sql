@@ -0,0 +1,13 @@
+-- migrate:up
+
+-- Set when the learner starts the exam, submissions after the deadline
+-- are rejected
+ALTER TABLE "participant" ADD COLUMN "started_at" TIMESTAMP;
+
+ALTER TABLE "participant" ADD COLUMN "deadline" TIMESTAMP;
+
+-- migrate:down
+
+ALTER TABLE "participant" DROP COLUMN "deadline";
+
+ALTER TABLE "participant" DROP COLUMN "started_at";
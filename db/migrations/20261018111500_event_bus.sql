@@ -0,0 +1,47 @@
+-- migrate:up
+
+-- Workers cache verified credentials, whatever changes a user's status
+-- or password has them dropped through the event bus (see bus.py)
+CREATE FUNCTION "notify_user_status_changed"() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' OR OLD."status" IS DISTINCT FROM NEW."status"
+            OR OLD."password" IS DISTINCT FROM NEW."password" THEN
+        PERFORM pg_notify('events', json_build_object(
+            'origin', NULL,
+            'events', json_build_array(json_build_array(
+                'user_status_changed', json_build_object('username', OLD."username")
+            ))
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "user_status_changed"
+    AFTER UPDATE OR DELETE ON "user"
+    FOR EACH ROW EXECUTE FUNCTION "notify_user_status_changed"();
+
+-- And have their grade bands read again
+CREATE FUNCTION "notify_grades_changed"() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('events', json_build_object(
+        'origin', NULL,
+        'events', json_build_array(json_build_array('grades_changed', json_build_object()))
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "grades_changed"
+    AFTER INSERT OR UPDATE OR DELETE ON "grade"
+    FOR EACH STATEMENT EXECUTE FUNCTION "notify_grades_changed"();
+
+-- migrate:down
+
+DROP TRIGGER "grades_changed" ON "grade";
+
+DROP FUNCTION "notify_grades_changed"();
+
+DROP TRIGGER "user_status_changed" ON "user";
+
+DROP FUNCTION "notify_user_status_changed"();
@@ -0,0 +1,24 @@
+-- migrate:up
+
+-- Sessions signed in for bearer tokens, see tokens.py
+CREATE TABLE "session" (
+  "id" UUID PRIMARY KEY,
+  "expires_at" TIMESTAMP NOT NULL,
+  "revoked_at" TIMESTAMP,
+  "metadata" JSONB NOT NULL,
+  "created_at" TIMESTAMP NOT NULL,
+  "updated_at" TIMESTAMP NOT NULL,
+  "user" UUID NOT NULL
+);
+
+CREATE INDEX "idx_session__created_at" ON "session" ("created_at");
+
+CREATE INDEX "idx_session__revoked_at" ON "session" ("revoked_at");
+
+CREATE INDEX "idx_session__user" ON "session" ("user");
+
+ALTER TABLE "session" ADD CONSTRAINT "fk_session__user" FOREIGN KEY ("user") REFERENCES "user" ("id") ON DELETE CASCADE;
+
+-- migrate:down
+
+DROP TABLE "session";
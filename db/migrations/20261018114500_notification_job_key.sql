@@ -0,0 +1,40 @@
+-- migrate:up
+
+-- One row per broadcast, retries find theirs by the unique key instead
+-- of a LIKE over every notification, see core.broadcast_notification
+CREATE TABLE "notification_job" (
+  "id" UUID PRIMARY KEY,
+  "idempotency_key" TEXT UNIQUE NOT NULL,
+  "metadata" JSONB NOT NULL,
+  "created_at" TIMESTAMP NOT NULL,
+  "updated_at" TIMESTAMP NOT NULL,
+  "exam" UUID NOT NULL,
+  "user" UUID NOT NULL
+);
+
+CREATE INDEX "idx_notification_job__created_at" ON "notification_job" ("created_at");
+
+CREATE INDEX "idx_notification_job__exam" ON "notification_job" ("exam");
+
+CREATE INDEX "idx_notification_job__user" ON "notification_job" ("user");
+
+ALTER TABLE "notification_job" ADD CONSTRAINT "fk_notification_job__exam" FOREIGN KEY ("exam") REFERENCES "exam" ("id") ON DELETE CASCADE;
+
+ALTER TABLE "notification_job" ADD CONSTRAINT "fk_notification_job__user" FOREIGN KEY ("user") REFERENCES "user" ("id") ON DELETE CASCADE;
+
+-- Jobs so far, their notifications' keys are "<exam>:<sender>:<key>:<learner>".
+-- Jobs of older keys don't name their exam and are left out
+INSERT INTO "notification_job" ("id", "idempotency_key", "metadata", "created_at", "updated_at", "exam", "user")
+SELECT DISTINCT ON (n."job")
+  n."job", regexp_replace(n."idempotency_key", ':[^:]*$', ''), '{}',
+  n."created_at", n."created_at", e."id", u."id"
+FROM "notification" n
+JOIN "exam" e ON e."id"::TEXT = split_part(n."idempotency_key", ':', 1)
+JOIN "user" u ON u."id"::TEXT = split_part(n."idempotency_key", ':', 2)
+WHERE n."job" IS NOT NULL
+ORDER BY n."job", n."created_at"
+ON CONFLICT ("idempotency_key") DO NOTHING;
+
+-- migrate:down
+
+DROP TABLE "notification_job";
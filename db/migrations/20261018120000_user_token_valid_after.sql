@@ -0,0 +1,32 @@
+-- migrate:up
+
+-- Access tokens of a user issued before their status or password last
+-- changed are refused, kept so a worker that starts or missed the
+-- user_status_changed event still knows of it, see tokens.py
+ALTER TABLE "user" ADD COLUMN "token_valid_after" TIMESTAMP;
+
+CREATE INDEX "idx_user__token_valid_after" ON "user" ("token_valid_after");
+
+CREATE FUNCTION "set_user_token_valid_after"() RETURNS TRIGGER AS $$
+BEGIN
+    IF OLD."status" IS DISTINCT FROM NEW."status"
+            OR OLD."password" IS DISTINCT FROM NEW."password" THEN
+        NEW."token_valid_after" = clock_timestamp() AT TIME ZONE 'UTC';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "user_token_valid_after"
+    BEFORE UPDATE ON "user"
+    FOR EACH ROW EXECUTE FUNCTION "set_user_token_valid_after"();
+
+-- migrate:down
+
+DROP TRIGGER "user_token_valid_after" ON "user";
+
+DROP FUNCTION "set_user_token_valid_after"();
+
+DROP INDEX "idx_user__token_valid_after";
+
+ALTER TABLE "user" DROP COLUMN "token_valid_after";
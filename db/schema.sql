@@ -9,6 +9,62 @@ SET xmloption = content;
 SET client_min_messages = warning;
 SET row_security = off;
 
+--
+-- Name: notify_grades_changed(); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE FUNCTION public.notify_grades_changed() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    PERFORM pg_notify('events', json_build_object(
+        'origin', NULL,
+        'events', json_build_array(json_build_array('grades_changed', json_build_object()))
+    )::text);
+    RETURN NULL;
+END;
+$$;
+
+
+--
+-- Name: notify_user_status_changed(); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE FUNCTION public.notify_user_status_changed() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP = 'DELETE' OR OLD."status" IS DISTINCT FROM NEW."status"
+            OR OLD."password" IS DISTINCT FROM NEW."password" THEN
+        PERFORM pg_notify('events', json_build_object(
+            'origin', NULL,
+            'events', json_build_array(json_build_array(
+                'user_status_changed', json_build_object('username', OLD."username")
+            ))
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+
+--
+-- Name: set_user_token_valid_after(); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE FUNCTION public.set_user_token_valid_after() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF OLD."status" IS DISTINCT FROM NEW."status"
+            OR OLD."password" IS DISTINCT FROM NEW."password" THEN
+        NEW."token_valid_after" = clock_timestamp() AT TIME ZONE 'UTC';
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+
 SET default_tablespace = '';
 
 SET default_with_oids = false;
@@ -26,7 +82,10 @@ CREATE TABLE public.exam (
     metadata jsonb NOT NULL,
     created_at timestamp without time zone NOT NULL,
     updated_at timestamp without time zone NOT NULL,
-    "user" uuid NOT NULL
+    "user" uuid NOT NULL,
+    total_marks integer DEFAULT 0 NOT NULL,
+    total_number_of_questions integer DEFAULT 0 NOT NULL,
+    version integer DEFAULT 1 NOT NULL
 );
 
 
@@ -71,6 +130,31 @@ CREATE TABLE public.notification (
     metadata jsonb NOT NULL,
     created_at timestamp without time zone NOT NULL,
     updated_at timestamp without time zone NOT NULL,
+    "user" uuid NOT NULL,
+    message text DEFAULT ''::text NOT NULL,
+    recipient text DEFAULT ''::text NOT NULL,
+    status character varying(30) NOT NULL,
+    attempts integer DEFAULT 1 NOT NULL,
+    next_attempt_at timestamp without time zone NOT NULL,
+    locked_until timestamp without time zone,
+    sent_at timestamp without time zone,
+    error text DEFAULT ''::text NOT NULL,
+    idempotency_key text NOT NULL,
+    job uuid
+);
+
+
+--
+-- Name: notification_job; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE public.notification_job (
+    id uuid NOT NULL,
+    idempotency_key text NOT NULL,
+    metadata jsonb NOT NULL,
+    created_at timestamp without time zone NOT NULL,
+    updated_at timestamp without time zone NOT NULL,
+    exam uuid NOT NULL,
     "user" uuid NOT NULL
 );
 
@@ -85,7 +169,9 @@ CREATE TABLE public.participant (
     created_at timestamp without time zone NOT NULL,
     updated_at timestamp without time zone NOT NULL,
     exam uuid NOT NULL,
-    "user" uuid NOT NULL
+    "user" uuid NOT NULL,
+    started_at timestamp without time zone,
+    deadline timestamp without time zone
 );
 
 
@@ -138,6 +224,21 @@ CREATE TABLE public.schema_migrations (
 );
 
 
+--
+-- Name: session; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE public.session (
+    id uuid NOT NULL,
+    expires_at timestamp without time zone NOT NULL,
+    revoked_at timestamp without time zone,
+    metadata jsonb NOT NULL,
+    created_at timestamp without time zone NOT NULL,
+    updated_at timestamp without time zone NOT NULL,
+    "user" uuid NOT NULL
+);
+
+
 --
 -- Name: submission; Type: TABLE; Schema: public; Owner: -
 --
@@ -173,7 +274,25 @@ CREATE TABLE public."user" (
     level integer NOT NULL,
     metadata jsonb NOT NULL,
     created_at timestamp without time zone NOT NULL,
-    updated_at timestamp without time zone NOT NULL
+    updated_at timestamp without time zone NOT NULL,
+    token_valid_after timestamp without time zone
+);
+
+
+--
+-- Name: video; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE public.video (
+    id uuid NOT NULL,
+    name text NOT NULL,
+    sha256 text NOT NULL,
+    size bigint NOT NULL,
+    content_type text NOT NULL,
+    metadata jsonb NOT NULL,
+    created_at timestamp without time zone NOT NULL,
+    updated_at timestamp without time zone NOT NULL,
+    "user" uuid NOT NULL
 );
 
 
@@ -233,6 +352,14 @@ ALTER TABLE ONLY public.mentorship
     ADD CONSTRAINT mentorship_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: notification notification_idempotency_key_key; Type: CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.notification
+    ADD CONSTRAINT notification_idempotency_key_key UNIQUE (idempotency_key);
+
+
 --
 -- Name: notification notification_pkey; Type: CONSTRAINT; Schema: public; Owner: -
 --
@@ -241,6 +368,22 @@ ALTER TABLE ONLY public.notification
     ADD CONSTRAINT notification_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: notification_job notification_job_idempotency_key_key; Type: CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.notification_job
+    ADD CONSTRAINT notification_job_idempotency_key_key UNIQUE (idempotency_key);
+
+
+--
+-- Name: notification_job notification_job_pkey; Type: CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.notification_job
+    ADD CONSTRAINT notification_job_pkey PRIMARY KEY (id);
+
+
 --
 -- Name: participant participant_pkey; Type: CONSTRAINT; Schema: public; Owner: -
 --
@@ -273,6 +416,14 @@ ALTER TABLE ONLY public.schema_migrations
     ADD CONSTRAINT schema_migrations_pkey PRIMARY KEY (version);
 
 
+--
+-- Name: session session_pkey; Type: CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.session
+    ADD CONSTRAINT session_pkey PRIMARY KEY (id);
+
+
 --
 -- Name: submission submission_pkey; Type: CONSTRAINT; Schema: public; Owner: -
 --
@@ -345,6 +496,22 @@ ALTER TABLE ONLY public."user"
     ADD CONSTRAINT user_username_key UNIQUE (username);
 
 
+--
+-- Name: video video_name_key; Type: CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.video
+    ADD CONSTRAINT video_name_key UNIQUE (name);
+
+
+--
+-- Name: video video_pkey; Type: CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.video
+    ADD CONSTRAINT video_pkey PRIMARY KEY (id);
+
+
 --
 -- Name: idx_exam__created_at; Type: INDEX; Schema: public; Owner: -
 --
@@ -401,6 +568,20 @@ CREATE INDEX idx_mentorship__user ON public.mentorship USING btree ("user");
 CREATE INDEX idx_notification__created_at ON public.notification USING btree (created_at);
 
 
+--
+-- Name: idx_notification__job; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX idx_notification__job ON public.notification USING btree (job);
+
+
+--
+-- Name: idx_notification__outbox; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX idx_notification__outbox ON public.notification USING btree (next_attempt_at) WHERE ((status)::text = ANY ((ARRAY['queued'::character varying, 'sending'::character varying])::text[]));
+
+
 --
 -- Name: idx_notification__user; Type: INDEX; Schema: public; Owner: -
 --
@@ -408,6 +589,27 @@ CREATE INDEX idx_notification__created_at ON public.notification USING btree (cr
 CREATE INDEX idx_notification__user ON public.notification USING btree ("user");
 
 
+--
+-- Name: idx_notification_job__created_at; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX idx_notification_job__created_at ON public.notification_job USING btree (created_at);
+
+
+--
+-- Name: idx_notification_job__exam; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX idx_notification_job__exam ON public.notification_job USING btree (exam);
+
+
+--
+-- Name: idx_notification_job__user; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX idx_notification_job__user ON public.notification_job USING btree ("user");
+
+
 --
 -- Name: idx_participant__created_at; Type: INDEX; Schema: public; Owner: -
 --
@@ -443,6 +645,13 @@ CREATE INDEX idx_performance__exam ON public.performance USING btree (exam);
 CREATE INDEX idx_performance__grade ON public.performance USING btree (grade);
 
 
+--
+-- Name: idx_performance__ranking; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX idx_performance__ranking ON public.performance USING btree (exam, percentage DESC, marks_obtained DESC, id DESC);
+
+
 --
 -- Name: idx_question__created_at; Type: INDEX; Schema: public; Owner: -
 --
@@ -457,6 +666,27 @@ CREATE INDEX idx_question__created_at ON public.question USING btree (created_at
 CREATE INDEX idx_question__number ON public.question USING btree (number);
 
 
+--
+-- Name: idx_session__created_at; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX idx_session__created_at ON public.session USING btree (created_at);
+
+
+--
+-- Name: idx_session__revoked_at; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX idx_session__revoked_at ON public.session USING btree (revoked_at);
+
+
+--
+-- Name: idx_session__user; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX idx_session__user ON public.session USING btree ("user");
+
+
 --
 -- Name: idx_submission__created_at; Type: INDEX; Schema: public; Owner: -
 --
@@ -471,6 +701,13 @@ CREATE INDEX idx_submission__created_at ON public.submission USING btree (create
 CREATE INDEX idx_submission__question ON public.submission USING btree (question);
 
 
+--
+-- Name: idx_submission__unmarked; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX idx_submission__unmarked ON public.submission USING btree (created_at, id) WHERE ((mark)::text = 'unmarked'::text);
+
+
 --
 -- Name: idx_user__created_at; Type: INDEX; Schema: public; Owner: -
 --
@@ -478,6 +715,55 @@ CREATE INDEX idx_submission__question ON public.submission USING btree (question
 CREATE INDEX idx_user__created_at ON public."user" USING btree (created_at);
 
 
+--
+-- Name: idx_user__token_valid_after; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX idx_user__token_valid_after ON public."user" USING btree (token_valid_after);
+
+
+--
+-- Name: idx_video__created_at; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX idx_video__created_at ON public.video USING btree (created_at);
+
+
+--
+-- Name: idx_video__sha256; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX idx_video__sha256 ON public.video USING btree (sha256);
+
+
+--
+-- Name: idx_video__user; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX idx_video__user ON public.video USING btree ("user");
+
+
+--
+-- Name: grade grades_changed; Type: TRIGGER; Schema: public; Owner: -
+--
+
+CREATE TRIGGER grades_changed AFTER INSERT OR DELETE OR UPDATE ON public.grade FOR EACH STATEMENT EXECUTE FUNCTION public.notify_grades_changed();
+
+
+--
+-- Name: user user_status_changed; Type: TRIGGER; Schema: public; Owner: -
+--
+
+CREATE TRIGGER user_status_changed AFTER DELETE OR UPDATE ON public."user" FOR EACH ROW EXECUTE FUNCTION public.notify_user_status_changed();
+
+
+--
+-- Name: user user_token_valid_after; Type: TRIGGER; Schema: public; Owner: -
+--
+
+CREATE TRIGGER user_token_valid_after BEFORE UPDATE ON public."user" FOR EACH ROW EXECUTE FUNCTION public.set_user_token_valid_after();
+
+
 --
 -- Name: exam fk_exam__user; Type: FK CONSTRAINT; Schema: public; Owner: -
 --
@@ -502,6 +788,22 @@ ALTER TABLE ONLY public.notification
     ADD CONSTRAINT fk_notification__user FOREIGN KEY ("user") REFERENCES public."user"(id) ON DELETE CASCADE;
 
 
+--
+-- Name: notification_job fk_notification_job__exam; Type: FK CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.notification_job
+    ADD CONSTRAINT fk_notification_job__exam FOREIGN KEY (exam) REFERENCES public.exam(id) ON DELETE CASCADE;
+
+
+--
+-- Name: notification_job fk_notification_job__user; Type: FK CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.notification_job
+    ADD CONSTRAINT fk_notification_job__user FOREIGN KEY ("user") REFERENCES public."user"(id) ON DELETE CASCADE;
+
+
 --
 -- Name: participant fk_participant__exam; Type: FK CONSTRAINT; Schema: public; Owner: -
 --
@@ -550,6 +852,14 @@ ALTER TABLE ONLY public.question
     ADD CONSTRAINT fk_question__exam FOREIGN KEY (exam) REFERENCES public.exam(id) ON DELETE CASCADE;
 
 
+--
+-- Name: session fk_session__user; Type: FK CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.session
+    ADD CONSTRAINT fk_session__user FOREIGN KEY ("user") REFERENCES public."user"(id) ON DELETE CASCADE;
+
+
 --
 -- Name: submission fk_submission__question; Type: FK CONSTRAINT; Schema: public; Owner: -
 --
@@ -566,6 +876,14 @@ ALTER TABLE ONLY public.submission
     ADD CONSTRAINT fk_submission__user FOREIGN KEY ("user") REFERENCES public."user"(id) ON DELETE CASCADE;
 
 
+--
+-- Name: video fk_video__user; Type: FK CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.video
+    ADD CONSTRAINT fk_video__user FOREIGN KEY ("user") REFERENCES public."user"(id) ON DELETE CASCADE;
+
+
 --
 -- PostgreSQL database dump complete
 --
@@ -576,4 +894,17 @@ ALTER TABLE ONLY public.submission
 --
 
 INSERT INTO public.schema_migrations (version) VALUES
-    ('20200609190732');
+    ('20200609190732'),
+    ('20261018090000'),
+    ('20261018091500'),
+    ('20261018093000'),
+    ('20261018094500'),
+    ('20261018100000'),
+    ('20261018101500'),
+    ('20261018103000'),
+    ('20261018104500'),
+    ('20261018110000'),
+    ('20261018111500'),
+    ('20261018113000'),
+    ('20261018114500'),
+    ('20261018120000');
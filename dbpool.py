@@ -0,0 +1,294 @@
+import os
+import threading
+import time
+
+from collections import deque
+
+from loguru import logger
+
+import metrics
+
+
+# Called with (query, seconds) after every query of either pool's
+# connections, logs.query_finished adds itself once imported
+query_observers = [metrics.query_finished]
+
+
+def query_finished(query, started: float):
+    seconds = time.monotonic() - started
+    for observer in query_observers:
+        observer(query, seconds)
+
+
+class PoolTimeout(Exception):
+    """No database connection became free in time."""
+
+
+class PoolStats:
+    """
+    Counters shared by the sync and the asyncio connection pools, the
+    connections in use and the requests waiting for one are also
+    exported as metrics.
+    """
+
+    def __init__(self, pool: str):
+        self._in_use_gauge = metrics.DB_POOL_IN_USE.labels(pool)
+        self._waiting_gauge = metrics.DB_POOL_WAITING.labels(pool)
+        self.opened = 0
+        self.closed = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.failed_health_checks = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @property
+    def in_use(self):
+        return self._in_use
+
+    @in_use.setter
+    def in_use(self, value: int):
+        self._in_use = value
+        self._in_use_gauge.set(value)
+
+    @property
+    def waiting(self):
+        return self._waiting
+
+    @waiting.setter
+    def waiting(self, value: int):
+        self._waiting = value
+        self._waiting_gauge.set(value)
+
+    def waited(self, seconds: float):
+        self.acquired += 1
+        self.wait_time += seconds
+        self.max_wait_time = max(self.max_wait_time, seconds)
+
+    def as_dict(self, size: int, idle: int, min_size: int, max_size: int):
+        return dict(
+            size=size,
+            idle=idle,
+            min_size=min_size,
+            max_size=max_size,
+            in_use=self.in_use,
+            waiting=self.waiting,
+            acquired=self.acquired,
+            timeouts=self.timeouts,
+            opened=self.opened,
+            closed=self.closed,
+            failed_health_checks=self.failed_health_checks,
+            mean_wait_ms=round(self.wait_time / self.acquired * 1000, 3) if self.acquired else 0.0,
+            max_wait_ms=round(self.max_wait_time * 1000, 3)
+        )
+
+
+class ConnectionPool:
+    """
+    Bounded pool of DB-API connections shared by every thread of a worker,
+    standing in for Pony's pool which opens one connection per thread and
+    never closes it.
+
+    At most max_size connections are open, a db_session finding none free
+    waits up to timeout seconds before PoolTimeout is raised. Connections
+    idle for idle_timeout seconds are closed down to min_size, connections
+    older than max_lifetime seconds are closed when released, and one
+    idle for more than health_check_interval seconds is checked with
+    health_check_query before it's handed out.
+
+    Implements connect, release, drop and disconnect, the interface Pony's
+    provider calls its pool with.
+    """
+
+    def __init__(
+        self, connect, min_size: int, max_size: int, timeout: float,
+        idle_timeout: float, max_lifetime: float,
+        health_check_query: str, health_check_interval: float
+    ):
+        self.open_connection = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_query = health_check_query
+        self.health_check_interval = health_check_interval
+        self.stats = PoolStats("sync")
+        self._condition = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._size = 0
+        # Most recently released last so the busiest connections are
+        # reused and the others can reach idle_timeout
+        self._idle = deque()
+        self._opened_at = {}
+        self._released_at = {}
+
+    def _check_fork(self):
+        # Connections inherited from the parent process belong to it,
+        # they are left alone rather than closed or shared
+        if self._pid != os.getpid():
+            self._reset()
+            self.stats = PoolStats("sync")
+
+    def fill(self):
+        """Opens connections up to min_size."""
+        with self._condition:
+            self._check_fork()
+            missing = self.min_size - self._size
+            self._size += max(missing, 0)
+        for _ in range(missing):
+            try:
+                connection = self._open()
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                raise
+            self._put(connection)
+
+    def connect(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        expired = []
+        with self._condition:
+            self._check_fork()
+            self.stats.waiting += 1
+            try:
+                while True:
+                    expired.extend(self._pop_expired())
+                    if self._idle:
+                        connection = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        connection = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats.timeouts += 1
+                        raise PoolTimeout(
+                            "No database connection free within {}s, all {} in use".format(
+                                self.timeout, self.max_size
+                            )
+                        )
+                    self._condition.wait(remaining)
+            finally:
+                self.stats.waiting -= 1
+            self.stats.waited(time.monotonic() - started)
+            self.stats.in_use += 1
+
+        for old in expired:
+            self._close(old)
+
+        if connection is not None and self._healthy(connection):
+            return connection, False
+
+        if connection is not None:
+            # Replaced below, so it keeps its place in the pool's size
+            self._close(connection)
+
+        try:
+            return self._open(), True
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self.stats.in_use -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, connection):
+        with self._condition:
+            self.stats.in_use -= 1
+        try:
+            connection.rollback()
+        except Exception:
+            self._discard(connection)
+            raise
+
+        if time.monotonic() - self._opened_at.get(connection, 0) > self.max_lifetime:
+            self._discard(connection)
+        else:
+            self._put(connection)
+
+    def drop(self, connection):
+        with self._condition:
+            self.stats.in_use -= 1
+        self._discard(connection)
+
+    def disconnect(self):
+        with self._condition:
+            self._check_fork()
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for connection in idle:
+            self._close(connection)
+
+    def as_dict(self):
+        with self._condition:
+            return self.stats.as_dict(
+                self._size, len(self._idle), self.min_size, self.max_size
+            )
+
+    def _open(self):
+        connection = self.open_connection()
+        with self._condition:
+            self.stats.opened += 1
+            self._opened_at[connection] = time.monotonic()
+        return connection
+
+    def _put(self, connection):
+        with self._condition:
+            self._released_at[connection] = time.monotonic()
+            self._idle.append(connection)
+            self._condition.notify()
+
+    def _discard(self, connection):
+        self._close(connection)
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def _close(self, connection):
+        with self._condition:
+            self.stats.closed += 1
+            self._opened_at.pop(connection, None)
+            self._released_at.pop(connection, None)
+        try:
+            connection.close()
+        except Exception as error:
+            logger.debug("Closing database connection failed : {}".format(error))
+
+    def _pop_expired(self):
+        # Called with the condition held. The least recently used
+        # connections are at the left end of the deque
+        now = time.monotonic()
+        expired = []
+        while self._idle and self._size > self.min_size:
+            connection = self._idle[0]
+            if now - self._released_at.get(connection, now) <= self.idle_timeout:
+                break
+            expired.append(self._idle.popleft())
+            self._size -= 1
+        return expired
+
+    def _healthy(self, connection):
+        idle = time.monotonic() - self._released_at.get(connection, 0)
+        if idle <= self.health_check_interval:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute(self.health_check_query)
+            cursor.close()
+            connection.rollback()
+            return True
+        except Exception as error:
+            logger.warning("Database connection failed health check : {}".format(error))
+            with self._condition:
+                self.stats.failed_health_checks += 1
+            return False
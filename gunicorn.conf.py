@@ -0,0 +1,7 @@
+"""gunicorn settings of run-container.sh, see metrics.py."""
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # Drops the in flight and pool gauges of a worker that exited
+    multiprocess.mark_process_dead(worker.pid)
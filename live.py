@@ -0,0 +1,200 @@
+"""
+Live updates pushed to API clients as server sent events.
+
+Writes publish events to topics, e.g every Performance change to its
+exam's topic and its learner's topic, and each subscribed client gets
+them over one long lived response instead of polling.
+
+Events carry a key and a subscriber only keeps the latest event of each
+key until its client has read them, so a burst of changes to the same
+performance reaches the client as one event. Clients that fall behind by
+more than LIVE_MAX_PENDING keys are sent an overflow event and
+disconnected, they reconnect and read the current state instead of the
+worker buffering for them without bound.
+
+The broker delivers to the subscribers of its own worker, the backend
+carries published events to the brokers of the workers that should see
+them, LIVE_BACKEND local to its own only and postgres to every worker's
+through the event bus.
+"""
+import json
+import asyncio
+
+from loguru import logger
+
+import bus
+import settings
+
+
+class Subscription:
+    def __init__(self, topics: list, max_pending: int):
+        self.topics = topics
+        self.max_pending = max_pending
+        self.overflowed = False
+        # Latest event by key, oldest key first
+        self._pending = {}
+        self._ready = asyncio.Event()
+
+    def put(self, key, event: bytes):
+        if self.overflowed:
+            return
+        self._pending.pop(key, None)
+        self._pending[key] = event
+        if len(self._pending) > self.max_pending:
+            self.overflowed = True
+            self._pending.clear()
+        self._ready.set()
+
+    async def get(self, timeout: float):
+        """Waits up to timeout seconds for events and takes all of them."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._ready.clear()
+        events = list(self._pending.values())
+        self._pending.clear()
+        return events
+
+
+class Broker:
+    """Subscriptions of this worker by topic, used on the event loop only."""
+
+    def __init__(self):
+        self.loop = None
+        self.backend = None
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+        self._subscriptions = {}
+        self._count = 0
+
+    def start(self, backend):
+        self.loop = asyncio.get_event_loop()
+        self.backend = backend
+
+    def stop(self):
+        self.backend = None
+
+    def full(self):
+        return self._count >= settings.LIVE_MAX_SUBSCRIBERS
+
+    def subscribe(self, topics: list):
+        subscription = Subscription(topics, settings.LIVE_MAX_PENDING)
+        for topic in topics:
+            self._subscriptions.setdefault(topic, set()).add(subscription)
+        self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription.overflowed:
+            self.overflows += 1
+        for topic in subscription.topics:
+            subscriptions = self._subscriptions.get(topic)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[topic]
+        self._count -= 1
+
+    def publish(self, topics: list, key, name: str, data: dict):
+        """Can be called from any thread, does nothing before start."""
+        if self.backend is None:
+            return
+        self.published += 1
+        self.backend.publish(topics, key, encode_event(name, data))
+
+    def dispatch(self, topics: list, key, event: bytes):
+        subscriptions = set()
+        for topic in topics:
+            subscriptions.update(self._subscriptions.get(topic, ()))
+        for subscription in subscriptions:
+            subscription.put(key, event)
+        self.delivered += len(subscriptions)
+
+    def stats(self):
+        return dict(
+            subscribers=self._count,
+            topics=len(self._subscriptions),
+            published=self.published,
+            delivered=self.delivered,
+            overflows=self.overflows
+        )
+
+
+class LocalBackend:
+    """Delivers events to the subscribers of this worker only."""
+
+    def __init__(self, broker: Broker):
+        self.broker = broker
+
+    def publish(self, topics: list, key, event: bytes):
+        self.broker.loop.call_soon_threadsafe(self.broker.dispatch, topics, key, event)
+
+
+class PostgresBackend:
+    """Delivers events to the subscribers of every worker through the event bus."""
+
+    def __init__(self, broker: Broker):
+        self.broker = broker
+
+    def publish(self, topics: list, key, event: bytes):
+        self.broker.loop.call_soon_threadsafe(self.broker.dispatch, topics, key, event)
+        bus.publish("live", dict(topics=topics, key=key, event=event.decode()))
+
+
+def received(data: dict):
+    """Events published on the other workers, on the event loop."""
+    if broker.backend is not None:
+        broker.dispatch(data["topics"], data["key"], data["event"].encode())
+
+
+def encode_event(name: str, data: dict):
+    # Encoded once however many subscribers get it
+    return "event: {}\ndata: {}\n\n".format(name, json.dumps(data, default=str)).encode()
+
+
+def get_backend(broker: Broker):
+    if settings.LIVE_BACKEND == "local":
+        return LocalBackend(broker)
+
+    if settings.LIVE_BACKEND != "postgres":
+        raise ValueError("Unknown LIVE_BACKEND : {}".format(settings.LIVE_BACKEND))
+
+    return PostgresBackend(broker)
+
+
+async def stream(topics: list):
+    """The server sent events of the topics, until the subscription overflows."""
+    subscription = broker.subscribe(topics)
+    try:
+        # Sends the headers right away so the client knows it's subscribed
+        yield b": subscribed\n\n"
+        while True:
+            events = await subscription.get(settings.LIVE_HEARTBEAT_INTERVAL)
+            if subscription.overflowed:
+                yield encode_event("overflow", {})
+                return
+            if not events:
+                # Keeps proxies from closing the connection and lets the
+                # response notice a client that went away
+                yield b": heartbeat\n\n"
+                continue
+            yield b"".join(events)
+            # Events published meanwhile are coalesced into the next batch
+            await asyncio.sleep(settings.LIVE_COALESCE_INTERVAL)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+broker = Broker()
+bus.subscribe("live", received)
+
+
+def start():
+    broker.start(get_backend(broker))
+    logger.info("Live updates started with {}".format(type(broker.backend).__name__))
+
+
+def stop():
+    broker.stop()
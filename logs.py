@@ -0,0 +1,180 @@
+"""
+Log setup of the API workers.
+
+Records at LOG_LEVEL and above are written to stderr and to
+logs/educator_api.log by a background thread, so requests don't wait on
+the disk. LOG_FORMAT json writes one JSON document per record with its
+structured fields, text the readable lines used in development.
+
+Every record carries the id of the request it was logged for, read from
+the X-Request-ID header or made up, and sent back in the response's.
+Requests get one access record, sampled per endpoint, and ones that
+failed or were slow are always logged. Queries slower than
+LOG_SLOW_QUERY_THRESHOLD are logged whatever LOG_SQL is.
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import traceback
+
+from contextvars import ContextVar
+
+from loguru import logger
+
+import dbpool
+import settings
+import util
+
+
+TEXT_FORMAT = "{time:YYYY-MM-DD at HH:mm:ss} | {level} | {extra[request_id]} | {message}"
+
+# Ids sent by clients are only kept when they are this plain
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+request_id = ContextVar("request_id", default="-")
+
+
+def add_request_id(record):
+    record["extra"].setdefault("request_id", request_id.get())
+
+
+def json_format(record):
+    document = dict(
+        time=record["time"].isoformat(),
+        level=record["level"].name,
+        message=record["message"],
+        source="{}:{}:{}".format(record["name"], record["function"], record["line"])
+    )
+    document.update(
+        (key, value) for key, value in record["extra"].items() if key != "json"
+    )
+    if record["exception"] is not None:
+        document["exception"] = "".join(traceback.format_exception(*record["exception"]))
+    # Passed through extra so braces in the message aren't taken for fields
+    record["extra"]["json"] = json.dumps(document, default=str)
+    return "{extra[json]}\n"
+
+
+def parse_sample_rates(rates: str):
+    """'create_submission=0.01,get_user=0.1' as rates by endpoint name."""
+    parsed = {}
+    for item in rates.split(","):
+        if not item.strip():
+            continue
+        endpoint, _, rate = item.partition("=")
+        parsed[endpoint.strip()] = float(rate)
+    return parsed
+
+
+sample_rates = parse_sample_rates(settings.LOG_REQUEST_SAMPLE_RATES)
+
+
+def setup(level: str = None, log_format: str = None, logs_dir: str = "logs", stderr: bool = True):
+    level = level or settings.LOG_LEVEL
+    log_format = log_format or settings.LOG_FORMAT
+    if log_format not in ("json", "text"):
+        raise ValueError("Unknown LOG_FORMAT : {}".format(log_format))
+    formatter = json_format if log_format == "json" else TEXT_FORMAT
+
+    util.mkdir_p(logs_dir)
+
+    logger.remove()
+    logger.configure(patcher=add_request_id)
+    # Variables' values in tracebacks may hold passwords, only shown in DEBUG
+    if stderr:
+        logger.add(
+            sys.stderr,
+            level=level,
+            format=formatter,
+            enqueue=True,
+            backtrace=settings.DEBUG,
+            diagnose=settings.DEBUG
+        )
+    logger.add(
+        "{}/educator_api.log".format(logs_dir),
+        level=level,
+        format=formatter,
+        rotation="12:00",
+        retention="30 days",
+        compression="zip",
+        enqueue=True,
+        backtrace=settings.DEBUG,
+        diagnose=settings.DEBUG
+    )
+
+
+def log_request(endpoint: str, method: str, path: str, status_code: int, seconds: float):
+    slow = seconds >= settings.LOG_SLOW_REQUEST_THRESHOLD
+    if status_code < 500 and not slow:
+        if random.random() >= sample_rates.get(endpoint, settings.LOG_REQUEST_SAMPLE_RATE):
+            return
+
+    if status_code >= 500:
+        level = "ERROR"
+    elif slow:
+        level = "WARNING"
+    else:
+        level = "INFO"
+
+    logger.bind(
+        endpoint=endpoint,
+        method=method,
+        path=path,
+        status=status_code,
+        duration_ms=round(seconds * 1000, 1)
+    ).log(level, "{} {} {} in {:.1f} ms", method, path, status_code, seconds * 1000)
+
+
+def query_finished(query, seconds: float):
+    if seconds < settings.LOG_SLOW_QUERY_THRESHOLD:
+        return
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    logger.bind(duration_ms=round(seconds * 1000, 1)).warning(
+        "Slow query ({:.1f} ms) : {}", seconds * 1000, " ".join(query.split())[:2000]
+    )
+
+
+dbpool.query_observers.append(query_finished)
+
+
+class RequestLogMiddleware:
+    """Gives every request its id and writes its access record."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        current = incoming if REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+        token = request_id.set(current)
+        started = time.monotonic()
+        response = dict(status=500, seconds=None)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                # Streams are timed to their first byte, not their end
+                response["status"] = message["status"]
+                response["seconds"] = time.monotonic() - started
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", current.encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            # The router sets the endpoint of the matched route in scope
+            endpoint = getattr(scope.get("endpoint"), "__name__", "-")
+            seconds = response["seconds"]
+            if seconds is None:
+                seconds = time.monotonic() - started
+            log_request(endpoint, scope["method"], scope["path"], response["status"], seconds)
+            request_id.reset(token)
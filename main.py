@@ -2,12 +2,56 @@ import os
 
 from fastapi import FastAPI
 
+from starlette.concurrency import run_in_threadpool
+
+import aiodb
+import bus
+import core
+import live
+import logs
+import metrics
+import models
+import notifier
+import profiler
 import settings
-import util
+import tokens
 
 from api import v1
 
-util.logger_setup()
+logs.setup()
 
 app = FastAPI(title='EducatorAPI ({})'.format(settings.ENVIRONMENT))
-app.include_router(v1.router, prefix='/api/v1')
\ No newline at end of file
+if settings.SQL_PROFILE:
+    app.add_middleware(profiler.ProfilerMiddleware)
+# Outermost, so records of the other middlewares carry the request id
+app.add_middleware(logs.RequestLogMiddleware)
+app.include_router(v1.router, prefix='/api/v1')
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return metrics.exposition()
+
+
+@app.on_event("startup")
+async def startup():
+    await aiodb.connect()
+    await run_in_threadpool(models.db.provider.pool.fill)
+    # Grade bands that overlap or leave gaps stop the worker from starting
+    await run_in_threadpool(core.load_grades)
+    await bus.start()
+    # Sessions signed out and users changed recently, the bus only tells of new ones
+    await tokens.load_revocations()
+    tokens.start()
+    live.start()
+    if settings.SMS_WORKER_ENABLED:
+        notifier.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    tokens.stop()
+    live.stop()
+    await run_in_threadpool(notifier.stop)
+    await bus.stop()
+    await aiodb.disconnect()
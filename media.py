@@ -0,0 +1,506 @@
+import os
+import re
+import json
+import time
+import fcntl
+import asyncio
+import hashlib
+import mimetypes
+
+from email.utils import formatdate
+from email.utils import parsedate_to_datetime
+from uuid import uuid4
+
+from fastapi import status
+from fastapi import HTTPException
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.responses import StreamingResponse
+
+import settings
+
+
+UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# Signatures of the container formats tutors upload, used when the file
+# name doesn't tell the content type
+SIGNATURES = (
+    (4, b"ftypqt  ", "video/quicktime"),
+    (4, b"ftyp", "video/mp4"),
+    (0, b"\x1a\x45\xdf\xa3", "video/webm"),
+    (0, b"OggS", "video/ogg"),
+    (0, b"FLV", "video/x-flv"),
+    (8, b"AVI ", "video/x-msvideo"),
+)
+
+
+class MediaResponse(StreamingResponse):
+    """
+    StreamingResponse that stops reading, and closes the file, as soon as
+    the client disconnects instead of draining the whole body into a
+    closed socket.
+    """
+
+    async def __call__(self, scope, receive, send):
+        disconnected = asyncio.Event()
+
+        async def listen_for_disconnect():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+
+        listener = asyncio.ensure_future(listen_for_disconnect())
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            })
+            async for chunk in self.body_iterator:
+                if disconnected.is_set():
+                    break
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": True
+                })
+            else:
+                await send({
+                    "type": "http.response.body",
+                    "body": b"",
+                    "more_body": False
+                })
+                if self.background is not None:
+                    await self.background()
+        finally:
+            listener.cancel()
+            await self.body_iterator.aclose()
+
+
+def guess_content_type(name: str, head: bytes = b""):
+    content_type, _ = mimetypes.guess_type(name)
+    if content_type:
+        return content_type
+    for offset, signature, sniffed_type in SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return sniffed_type
+    return "application/octet-stream"
+
+
+def make_etag(size: int, last_modified: float):
+    return '"{:x}-{:x}"'.format(int(last_modified * 1000000), size)
+
+
+def file_reader(path: str):
+    """Returns a reader of inclusive byte ranges of the file at path."""
+
+    async def read(start: int, end: int):
+        remaining = end - start + 1
+        f = await run_in_threadpool(open, path, "rb")
+        try:
+            await run_in_threadpool(f.seek, start)
+            while remaining > 0:
+                chunk = await run_in_threadpool(
+                    f.read, min(settings.VIDEO_CHUNK_SIZE, remaining)
+                )
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+    return read
+
+
+def parse_range(header: str, size: int):
+    """
+    Parses a Range header into sorted, merged, inclusive (start, end)
+    byte ranges. Returns None when the header should be ignored and an
+    empty list when none of the ranges can be satisfied.
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(","):
+        first, dash, last = spec.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+            else:
+                suffix = int(last)
+                start = max(size - suffix, 0)
+                end = size - 1
+                if suffix == 0:
+                    continue
+        except ValueError:
+            return None
+        if start < 0:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > settings.VIDEO_MAX_RANGES:
+        return None
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def etag_matches(if_none_match: str, etag: str):
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or "W/" + etag in tags
+
+
+def is_not_modified(request_headers, etag: str, last_modified: float):
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(last_modified) <= since
+    return False
+
+
+def range_is_current(request_headers, etag: str, last_modified: float):
+    """Evaluates If-Range, ranges only apply to the representation asked for."""
+    if_range = request_headers.get("if-range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == etag
+    if if_range.startswith("W/"):
+        return False
+    try:
+        return parsedate_to_datetime(if_range).timestamp() == int(last_modified)
+    except (TypeError, ValueError):
+        return False
+
+
+def media_response(request_headers, size: int, last_modified: float, content_type: str, reader, etag: str = None):
+    """
+    Builds the response to a GET of a media file of size bytes, honouring
+    conditional (If-None-Match, If-Modified-Since) and range (Range,
+    If-Range) requests. reader(start, end) yields the bytes of an
+    inclusive range in chunks of VIDEO_CHUNK_SIZE.
+    """
+    etag = etag or make_etag(size, last_modified)
+    headers = {
+        "accept-ranges": "bytes",
+        "etag": etag,
+        "last-modified": formatdate(last_modified, usegmt=True),
+        "cache-control": "private, max-age=0, must-revalidate"
+    }
+
+    if is_not_modified(request_headers, etag, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    range_header = request_headers.get("range")
+    ranges = None
+    if range_header and range_is_current(request_headers, etag, last_modified):
+        ranges = parse_range(range_header, size)
+
+    if ranges is None:
+        headers["content-length"] = str(size)
+        return MediaResponse(
+            reader(0, size - 1) if size else empty(),
+            headers=headers,
+            media_type=content_type
+        )
+
+    if not ranges:
+        headers["content-range"] = "bytes */{}".format(size)
+        return Response(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers=headers
+        )
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["content-range"] = "bytes {}-{}/{}".format(start, end, size)
+        headers["content-length"] = str(end - start + 1)
+        return MediaResponse(
+            reader(start, end),
+            status_code=status.HTTP_206_PARTIAL_CONTENT,
+            headers=headers,
+            media_type=content_type
+        )
+
+    boundary = uuid4().hex
+    parts = [
+        (
+            start, end,
+            (
+                "--{}\r\nContent-Type: {}\r\nContent-Range: bytes {}-{}/{}\r\n\r\n"
+                .format(boundary, content_type, start, end, size)
+                .encode("latin-1")
+            )
+        )
+        for start, end in ranges
+    ]
+    closing = "--{}--\r\n".format(boundary).encode("latin-1")
+    headers["content-length"] = str(
+        sum(len(part) + end - start + 1 + 2 for start, end, part in parts)
+        + len(closing)
+    )
+
+    async def multipart():
+        for start, end, part in parts:
+            yield part
+            async for chunk in reader(start, end):
+                yield chunk
+            yield b"\r\n"
+        yield closing
+
+    return MediaResponse(
+        multipart(),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        headers=headers,
+        media_type="multipart/byteranges; boundary={}".format(boundary)
+    )
+
+
+async def empty():
+    return
+    yield
+
+
+def upload_paths(uploads_dir: str, upload_id: str):
+    # upload ids are generated by us, anything else can't name a file
+    if not UPLOAD_ID.match(upload_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload not found : upload_id: {}".format(upload_id)
+        )
+    base = os.path.join(uploads_dir, upload_id)
+    return base + ".json", base + ".part"
+
+
+def create_upload(uploads_dir: str, user_id: str, file_name: str, size: int, sha256: str = None):
+    """
+    Starts a resumable upload of size bytes. Chunks are written straight
+    into a .part file next to the videos, which finish_upload renames
+    into place, so no temporary copy of the video is ever made.
+    """
+    file_name = os.path.basename(file_name or "")
+    if not file_name or file_name.startswith("."):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid file name : {}".format(file_name)
+        )
+    if size < 0 or size > settings.VIDEO_MAX_UPLOAD_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Videos can be at most {} bytes".format(
+                settings.VIDEO_MAX_UPLOAD_SIZE
+            )
+        )
+
+    remove_expired_uploads(uploads_dir)
+
+    upload = dict(
+        upload_id=uuid4().hex,
+        user_id=str(user_id),
+        file_name=file_name,
+        size=size,
+        sha256=sha256.lower() if sha256 else None,
+        offset=0,
+        max_chunk_size=settings.VIDEO_UPLOAD_MAX_CHUNK_SIZE,
+        created_at=time.time()
+    )
+    state_path, part_path = upload_paths(uploads_dir, upload["upload_id"])
+    open(part_path, "wb").close()
+    save_upload(state_path, upload)
+
+    return upload
+
+
+def get_upload(uploads_dir: str, user_id: str, upload_id: str):
+    state_path, _ = upload_paths(uploads_dir, upload_id)
+    try:
+        with open(state_path) as f:
+            upload = json.load(f)
+    except FileNotFoundError:
+        upload = None
+    if not upload or upload["user_id"] != str(user_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload not found : upload_id: {}".format(upload_id)
+        )
+    return upload
+
+
+def write_chunk(uploads_dir: str, user_id: str, upload_id: str, offset: int, chunk: bytes, sha256: str):
+    """
+    Appends chunk at offset after checking it against its SHA-256. A
+    chunk for any other offset than the upload's current one is refused
+    with 409 so the client can resume from the offset it is told.
+    """
+    if not sha256:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The Content-SHA256 header is required"
+        )
+    if hashlib.sha256(chunk).hexdigest() != sha256.strip().lower():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Chunk checksum mismatch at offset {}".format(offset)
+        )
+
+    state_path, part_path = upload_paths(uploads_dir, upload_id)
+    with open_part(part_path, upload_id, "r+b") as part:
+        # Serialises chunks of the same upload across threads and workers
+        fcntl.flock(part, fcntl.LOCK_EX)
+        upload = get_upload(uploads_dir, user_id, upload_id)
+        if offset != upload["offset"]:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=dict(
+                    message="Expected a chunk at offset {}".format(upload["offset"]),
+                    offset=upload["offset"]
+                )
+            )
+        if offset + len(chunk) > upload["size"]:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Chunk ends past the declared size of {} bytes".format(
+                    upload["size"]
+                )
+            )
+        part.seek(offset)
+        part.write(chunk)
+        part.flush()
+        os.fsync(part.fileno())
+
+        upload["offset"] = offset + len(chunk)
+        save_upload(state_path, upload)
+
+    return upload
+
+
+def finish_upload(uploads_dir: str, user_id: str, upload_id: str):
+    """
+    Checks that an upload is complete and matches its SHA-256, then hands
+    its file over. Returns the upload with the path of the file, its
+    sha256 and content_type.
+    """
+    state_path, part_path = upload_paths(uploads_dir, upload_id)
+    with open_part(part_path, upload_id, "rb") as part:
+        fcntl.flock(part, fcntl.LOCK_EX)
+        upload = get_upload(uploads_dir, user_id, upload_id)
+        if upload["offset"] != upload["size"]:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=dict(
+                    message="Upload incomplete, {} of {} bytes received".format(
+                        upload["offset"], upload["size"]
+                    ),
+                    offset=upload["offset"]
+                )
+            )
+        digest = hashlib.sha256()
+        for block in iter(lambda: part.read(settings.VIDEO_CHUNK_SIZE), b""):
+            digest.update(block)
+        if upload["sha256"] and digest.hexdigest() != upload["sha256"]:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Video checksum mismatch"
+            )
+        head = os.pread(part.fileno(), 16, 0)
+
+        finished_path = os.path.join(uploads_dir, upload_id + ".done")
+        os.replace(part_path, finished_path)
+        os.remove(state_path)
+
+    upload["path"] = finished_path
+    upload["sha256"] = digest.hexdigest()
+    upload["content_type"] = guess_content_type(upload["file_name"], head)
+    return upload
+
+
+def receive_file(fileobj, uploads_dir: str, file_name: str):
+    """
+    Copies an uploaded file into uploads_dir, hashing it on the way and
+    refusing it once it exceeds VIDEO_MAX_UPLOAD_SIZE. Returns the same
+    dict as finish_upload.
+    """
+    path = os.path.join(uploads_dir, uuid4().hex + ".done")
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    try:
+        with open(path, "wb") as buffer:
+            for block in iter(lambda: fileobj.read(settings.VIDEO_CHUNK_SIZE), b""):
+                size += len(block)
+                if size > settings.VIDEO_MAX_UPLOAD_SIZE:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail="Videos can be at most {} bytes".format(
+                            settings.VIDEO_MAX_UPLOAD_SIZE
+                        )
+                    )
+                if len(head) < 16:
+                    head += block[:16 - len(head)]
+                digest.update(block)
+                buffer.write(block)
+    except Exception:
+        os.remove(path)
+        raise
+
+    return dict(
+        file_name=file_name,
+        size=size,
+        path=path,
+        sha256=digest.hexdigest(),
+        content_type=guess_content_type(file_name, head)
+    )
+
+
+def open_part(part_path: str, upload_id: str, mode: str):
+    try:
+        return open(part_path, mode)
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload not found : upload_id: {}".format(upload_id)
+        )
+
+
+def save_upload(state_path: str, upload: dict):
+    temporary_path = state_path + ".tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(upload, f)
+    os.replace(temporary_path, state_path)
+
+
+def remove_expired_uploads(uploads_dir: str):
+    expired_before = time.time() - settings.VIDEO_UPLOAD_TTL
+    for name in os.listdir(uploads_dir):
+        path = os.path.join(uploads_dir, name)
+        try:
+            if os.stat(path).st_mtime < expired_before:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,170 @@
+"""
+Prometheus metrics of the API, served at GET /metrics.
+
+Every route of the API is an InstrumentedRoute, its requests are timed
+and counted in flight by route, with the number and duration of the
+database queries each one ran. Hot sections are timed as spans:
+
+    with metrics.span("send_sms"):
+        ...
+
+    @metrics.timed("performance_review")
+    def review_performance(...):
+
+With gunicorn every worker is a process of its own, set the
+prometheus_multiproc_dir environment variable to an empty directory they
+share (run-container.sh does) and /metrics reports the sum of all of
+them whichever worker serves it.
+"""
+import os
+import time
+import asyncio
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from fastapi import HTTPException
+from fastapi.routing import APIRoute
+
+from prometheus_client import CollectorRegistry
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import REGISTRY
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from prometheus_client import generate_latest
+from prometheus_client import multiprocess
+
+from starlette.responses import Response
+
+
+MULTIPROCESS = "prometheus_multiproc_dir" in os.environ
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time to the response of the route's requests, by method, route and status",
+    ["method", "route", "status"]
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests of the route being handled",
+    ["method", "route"],
+    multiprocess_mode="livesum"
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Database queries run by one request of the route",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, float("inf"))
+)
+REQUEST_QUERY_DURATION = Histogram(
+    "http_request_db_duration_seconds",
+    "Time one request of the route spent waiting on database queries",
+    ["method", "route"]
+)
+SPAN_DURATION = Histogram(
+    "span_duration_seconds",
+    "Time spent in hot sections of the request handling, by span",
+    ["span"]
+)
+DB_POOL_WAITING = Gauge(
+    "db_pool_waiting",
+    "Requests waiting for a free database connection, by pool",
+    ["pool"],
+    multiprocess_mode="livesum"
+)
+DB_POOL_IN_USE = Gauge(
+    "db_pool_in_use",
+    "Database connections in use, by pool",
+    ["pool"],
+    multiprocess_mode="livesum"
+)
+
+
+class RequestQueries:
+    """The queries of the request being handled."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+request_queries = ContextVar("request_queries", default=None)
+
+
+def query_finished(query, seconds: float):
+    queries = request_queries.get()
+    if queries is not None:
+        queries.count += 1
+        queries.seconds += seconds
+
+
+@contextmanager
+def span(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_DURATION.labels(name).observe(time.perf_counter() - started)
+
+
+def timed(name: str):
+    """Times every call of the decorated function as the span name."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def coroutine_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return coroutine_wrapper
+
+        @wraps(func)
+        def function_wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return function_wrapper
+    return decorator
+
+
+class InstrumentedRoute(APIRoute):
+    """APIRoute measuring its requests, from the dependencies to the response."""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        # The route's path template keeps the number of series bounded
+        route = self.path
+
+        async def instrumented_handler(request):
+            method = request.method
+            in_progress = REQUESTS_IN_PROGRESS.labels(method, route)
+            in_progress.inc()
+            queries = RequestQueries()
+            token = request_queries.set(queries)
+            started = time.perf_counter()
+            status_code = 500
+            try:
+                response = await handler(request)
+                status_code = response.status_code
+                return response
+            except HTTPException as error:
+                status_code = error.status_code
+                raise
+            finally:
+                REQUEST_DURATION.labels(method, route, status_code).observe(
+                    time.perf_counter() - started
+                )
+                REQUEST_QUERIES.labels(method, route).observe(queries.count)
+                REQUEST_QUERY_DURATION.labels(method, route).observe(queries.seconds)
+                request_queries.reset(token)
+                in_progress.dec()
+
+        return instrumented_handler
+
+
+def exposition():
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -1,9 +1,12 @@
 import os
+import time
 import random
 from enum import Enum
 from datetime import datetime as dt
 from loguru import logger
 
+import psycopg2
+
 from uuid import UUID
 from uuid import uuid4
 
@@ -22,30 +25,68 @@ from pony.orm import set_sql_debug
 from util import Status
 from util import Role
 from util import Mark
+from util import NotificationStatus
 from util import EnumConverter
 
 
+import cache
+import dbpool
 import settings
 
 
 db = Database()
 
-set_sql_debug(True)
+set_sql_debug(settings.LOG_SQL)
 
-logger.debug("DB_USER: {}".format(settings.DB_USER))
-logger.debug("DB_PASS: {}".format(str(settings.DB_PASS)))
-logger.debug("DB_HOST: {}".format(settings.DB_HOST))
-logger.debug("DB_NAME: {}".format(settings.DB_NAME))
-logger.debug("DB_PORT: {}".format(settings.DB_PORT))
+logger.debug("Database {} on {}:{} as {}", settings.DB_NAME, settings.DB_HOST, settings.DB_PORT, settings.DB_USER)
 
-db.bind(
-    provider='postgres',
+connection_options = dict(
     user=settings.DB_USER,
     password=str(settings.DB_PASS),
     host=settings.DB_HOST,
     database=settings.DB_NAME,
     port=settings.DB_PORT
 )
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Reports how long each of its queries took, see dbpool.query_finished."""
+
+    def execute(self, query, vars=None):
+        started = time.monotonic()
+        try:
+            return super().execute(query, vars)
+        finally:
+            dbpool.query_finished(query, started)
+
+    def executemany(self, query, vars_list):
+        started = time.monotonic()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            dbpool.query_finished(query, started)
+
+
+def connect():
+    connection = psycopg2.connect(**connection_options, cursor_factory=TimedCursor)
+    connection.set_client_encoding("UTF8")
+    return connection
+
+
+db.bind(provider='postgres', **connection_options)
+
+# Threads share a bounded pool instead of holding a connection each
+db.provider.pool.disconnect()
+db.provider.pool = dbpool.ConnectionPool(
+    connect,
+    min_size=settings.DB_SYNC_POOL_MIN_SIZE,
+    max_size=settings.DB_SYNC_POOL_MAX_SIZE,
+    timeout=settings.DB_POOL_TIMEOUT,
+    idle_timeout=settings.DB_POOL_IDLE_TIMEOUT,
+    max_lifetime=settings.DB_POOL_MAX_LIFETIME,
+    health_check_query=settings.DB_POOL_HEALTH_CHECK_QUERY,
+    health_check_interval=settings.DB_POOL_HEALTH_CHECK_INTERVAL
+)
 db.provider.converter_classes.append((Enum, EnumConverter))
 
 class User(db.Entity):
@@ -62,6 +103,8 @@ class User(db.Entity):
     metadata = Required(Json, default={})
     created_at = Required(dt, default=lambda: dt.utcnow(), index=True)
     updated_at = Required(dt, default=lambda: dt.utcnow())
+    # Set by a trigger when the status or password changes, see tokens.py
+    token_valid_after = Optional(dt, index=True, volatile=True)
     notifications = Set('Notification')
     exams = Set('Exam')
     submissions = Set('Submission')
@@ -69,6 +112,16 @@ class User(db.Entity):
     notifications = Set('Notification')
     mentorships = Set('Mentorship')
     participants = Set('Participant')
+    videos = Set('Video')
+    sessions = Set('Session')
+    notification_jobs = Set('NotificationJob')
+
+    def after_update(self):
+        # Status or password changes must not be served from the cache
+        cache.credentials.invalidate_user(self.username)
+
+    def after_delete(self):
+        cache.credentials.invalidate_user(self.username)
 
 
 class Exam(db.Entity):
@@ -76,6 +129,10 @@ class Exam(db.Entity):
     name = Required(str, unique=True)
     video_tutorial_name = Optional(str, index=True)
     time_duration = Required(int, default=90)
+    total_marks = Required(int, default=0)
+    total_number_of_questions = Required(int, default=0)
+    # Bumped whenever the questions change, see core.get_exam_paper
+    version = Required(int, default=1)
     is_active = Required(bool, default=True)
     metadata = Required(Json, default={})
     created_at = Required(dt, default=lambda: dt.utcnow(), index=True)
@@ -84,6 +141,7 @@ class Exam(db.Entity):
     questions = Set('Question')
     performances = Set('Performance')
     participants = Set('Participant')
+    notification_jobs = Set('NotificationJob')
 
 class Participant(db.Entity):
     id = PrimaryKey(UUID, default=uuid4, auto=True)
@@ -92,6 +150,9 @@ class Participant(db.Entity):
     updated_at = Required(dt, default=lambda: dt.utcnow())
     exam = Required(Exam)
     user = Required(User)
+    # Set by core.start_exam
+    started_at = Optional(dt)
+    deadline = Optional(dt)
     composite_key(user, exam)
 
 class Question(db.Entity):
@@ -134,6 +195,54 @@ class Mentorship(db.Entity):
 
 class Notification(db.Entity):
     id = PrimaryKey(UUID, default=uuid4, auto=True)
+    message = Optional(str)
+    recipient = Optional(str)
+    status = Required(NotificationStatus, default=NotificationStatus.queued)
+    attempts = Required(int, default=0)
+    next_attempt_at = Required(dt, default=lambda: dt.utcnow())
+    locked_until = Optional(dt)
+    sent_at = Optional(dt)
+    error = Optional(str)
+    idempotency_key = Required(str, unique=True, default=lambda: uuid4().hex)
+    # Set on the notifications of one broadcast
+    job = Optional(UUID, index=True)
+    metadata = Required(Json, default={})
+    created_at = Required(dt, default=lambda: dt.utcnow(), index=True)
+    updated_at = Required(dt, default=lambda: dt.utcnow())
+    user = Required(User)
+
+
+class NotificationJob(db.Entity):
+    # One broadcast to the participants of an exam, its notifications
+    # carry its id in Notification.job
+    _table_ = "notification_job"
+    id = PrimaryKey(UUID, default=uuid4, auto=True)
+    # "<exam>:<sender>:<key of the request>", see core.broadcast_notification
+    idempotency_key = Required(str, unique=True)
+    metadata = Required(Json, default={})
+    created_at = Required(dt, default=lambda: dt.utcnow(), index=True)
+    updated_at = Required(dt, default=lambda: dt.utcnow())
+    exam = Required(Exam)
+    user = Required(User)
+
+
+class Video(db.Entity):
+    id = PrimaryKey(UUID, default=uuid4, auto=True)
+    name = Required(str, unique=True)
+    sha256 = Required(str, index=True)
+    size = Required(int, size=64)
+    content_type = Required(str)
+    metadata = Required(Json, default={})
+    created_at = Required(dt, default=lambda: dt.utcnow(), index=True)
+    updated_at = Required(dt, default=lambda: dt.utcnow())
+    user = Required(User)
+
+
+class Session(db.Entity):
+    # Signed in with POST /auth/token, see tokens.py
+    id = PrimaryKey(UUID, default=uuid4, auto=True)
+    expires_at = Required(dt)
+    revoked_at = Optional(dt, index=True)
     metadata = Required(Json, default={})
     created_at = Required(dt, default=lambda: dt.utcnow(), index=True)
     updated_at = Required(dt, default=lambda: dt.utcnow())
@@ -151,6 +260,16 @@ class Grade(db.Entity):
     updated_at = Required(dt, default=lambda: dt.utcnow())
     performances = Set('Performance')
 
+    def after_insert(self):
+        # Performances are graded from the in memory bands, see cache.grades
+        cache.grades.invalidate()
+
+    def after_update(self):
+        cache.grades.invalidate()
+
+    def after_delete(self):
+        cache.grades.invalidate()
+
 
 class Performance(db.Entity):
     id = PrimaryKey(UUID, default=uuid4, auto=True)
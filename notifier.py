@@ -0,0 +1,324 @@
+"""
+Outbox worker sending queued SMS notifications.
+
+notify_user only stores a Notification, this worker claims due ones,
+sends recipients of the same message in one provider call and records
+the outcome, retrying failures with exponential backoff. Every API
+worker process runs one unless SMS_WORKER_ENABLED is off, it can also
+run on its own:
+
+    python notifier.py
+"""
+import random
+import hashlib
+import threading
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt
+from datetime import timedelta
+from typing import List
+
+import requests
+
+from loguru import logger
+from pony.orm import db_session
+from psycopg2.extras import Json
+from psycopg2.extras import execute_values
+from requests.adapters import HTTPAdapter
+
+from models import NotificationStatus
+
+import logs
+import metrics
+import models
+import settings
+
+
+# Africa's Talking recipient status codes
+# https://developers.africastalking.com/docs/sms/sending/bulk
+SENT_STATUS_CODES = {100, 101, 102}
+# Insufficient balance, could not route and gateway errors can go through later
+RETRYABLE_STATUS_CODES = {405, 407, 500, 501, 502}
+
+# Claims due notifications, and ones whose sender died mid send, by
+# moving them to sending for SMS_LEASE seconds. SKIP LOCKED lets several
+# workers drain the outbox without picking the same rows
+CLAIM_NOTIFICATIONS = """
+UPDATE "notification" SET
+    "status" = 'sending',
+    "attempts" = "attempts" + 1,
+    "locked_until" = $locked_until,
+    "updated_at" = $now
+WHERE "id" IN (
+    SELECT "id" FROM "notification"
+    WHERE ("status" = 'queued' AND "next_attempt_at" <= $now)
+        OR ("status" = 'sending' AND "locked_until" < $now)
+    ORDER BY "next_attempt_at"
+    LIMIT $limit
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING "id", "recipient", "message", "attempts", "idempotency_key"
+"""
+
+# Records the outcome of a round in one statement, NULLs keep the
+# notification's metadata, sent_at and next_attempt_at
+RECORD_OUTCOMES = """
+UPDATE "notification" SET
+    "status" = "v"."status",
+    "error" = "v"."error",
+    "locked_until" = NULL,
+    "updated_at" = "v"."updated_at",
+    "metadata" = COALESCE("v"."metadata", "notification"."metadata"),
+    "sent_at" = COALESCE("v"."sent_at", "notification"."sent_at"),
+    "next_attempt_at" = COALESCE("v"."next_attempt_at", "notification"."next_attempt_at")
+FROM (VALUES %s) AS "v" ("id", "status", "error", "updated_at", "metadata", "sent_at", "next_attempt_at")
+WHERE "notification"."id" = "v"."id"
+"""
+
+
+Claimed = namedtuple('Claimed', ('id', 'recipient', 'message', 'attempts', 'idempotency_key'))
+
+
+class ProviderError(Exception):
+    """The provider couldn't be reached or refused the whole request."""
+
+
+class AfricasTalkingProvider:
+    def __init__(self):
+        # Keeps a connection to the provider alive for each concurrent sender
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.SMS_MAX_CONCURRENCY)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'apiKey': str(settings.AFRICASTALKING_API_KEY),
+            'Accept': 'application/json'
+        })
+
+    def send(self, recipients: List[str], message: str, idempotency_key: str):
+        """Returns the provider's recipient entries by phone number."""
+        data = {
+            'username': str(settings.AFRICASTALKING_API_USERNAME),
+            'to': ','.join(recipients),
+            'message': message,
+            # 'from': str(settings.AFRICASTALKING_API_SENDER_ID)
+        }
+        try:
+            response = self.session.post(
+                settings.AFRICASTALKING_API_URL,
+                data=data,
+                headers={'Idempotency-Key': idempotency_key},
+                timeout=(settings.SMS_CONNECT_TIMEOUT, settings.SMS_READ_TIMEOUT)
+            )
+            response.raise_for_status()
+            recipient_entries = response.json()['SMSMessageData']['Recipients']
+        except (requests.RequestException, ValueError, KeyError, TypeError) as error:
+            raise ProviderError(str(error))
+
+        return {entry['number']: entry for entry in recipient_entries}
+
+
+class FakeProvider:
+    """
+    Accepts every message without sending it, for development and tests.
+    Numbers in fail_numbers get a retryable error instead.
+    """
+
+    def __init__(self, fail_numbers=()):
+        self.fail_numbers = set(fail_numbers)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def send(self, recipients: List[str], message: str, idempotency_key: str):
+        with self._lock:
+            self.calls.append((list(recipients), message, idempotency_key))
+        logger.info("Fake SMS to {} : {}".format(','.join(recipients), message))
+        return {
+            number: dict(
+                number=number,
+                status='Failed' if number in self.fail_numbers else 'Success',
+                statusCode=500 if number in self.fail_numbers else 101,
+                messageId='fake-{}-{}'.format(idempotency_key, index)
+            )
+            for index, number in enumerate(recipients)
+        }
+
+
+def get_provider():
+    if settings.SMS_PROVIDER == 'fake':
+        return FakeProvider()
+
+    if settings.SMS_PROVIDER != 'africastalking':
+        raise ValueError("Unknown SMS_PROVIDER : {}".format(settings.SMS_PROVIDER))
+
+    return AfricasTalkingProvider()
+
+
+def backoff(attempts: int):
+    """Seconds to wait after the given number of failed attempts, with jitter."""
+    delay = min(settings.SMS_BACKOFF_BASE * 2 ** (attempts - 1), settings.SMS_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1)
+
+
+class Notifier:
+    def __init__(self, provider):
+        self.provider = provider
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # Provider calls of one round run concurrently, at most this many at once
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.SMS_MAX_CONCURRENCY, thread_name_prefix='notifier-send'
+        )
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='notifier', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.executor.shutdown(wait=False)
+
+    def wake(self):
+        self._wake.set()
+
+    def run(self):
+        logger.info("Notifier started with {}".format(type(self.provider).__name__))
+        while not self._stop.is_set():
+            try:
+                claimed = self.drain()
+            except Exception as error:
+                logger.exception("Notifier failed : {}".format(error))
+                claimed = 0
+            if not claimed:
+                self._wake.wait(settings.SMS_POLL_INTERVAL)
+                self._wake.clear()
+
+    def drain(self):
+        """Sends one batch of due notifications, returns how many were claimed."""
+        notifications = self.claim()
+        if not notifications:
+            return 0
+
+        # Identical messages are sent with one call per SMS_BATCH_SIZE recipients
+        by_message = {}
+        for notification in notifications:
+            by_message.setdefault(notification.message, []).append(notification)
+
+        batches = [
+            (message, group[start:start + settings.SMS_BATCH_SIZE])
+            for message, group in by_message.items()
+            for start in range(0, len(group), settings.SMS_BATCH_SIZE)
+        ]
+
+        outcomes = {}
+        for batch_outcomes in self.executor.map(lambda batch: self.send(*batch), batches):
+            outcomes.update(batch_outcomes)
+
+        self.record(notifications, outcomes)
+        return len(notifications)
+
+    @db_session
+    def claim(self):
+        now = dt.utcnow()
+        cursor = models.db.execute(CLAIM_NOTIFICATIONS, dict(
+            now=now,
+            locked_until=now + timedelta(seconds=settings.SMS_LEASE),
+            limit=settings.SMS_CLAIM_SIZE
+        ))
+        columns = [column[0] for column in cursor.description]
+        return [Claimed(**dict(zip(columns, row))) for row in cursor.fetchall()]
+
+    def send(self, message: str, notifications: list):
+        """Returns (status, error, entry) by notification id."""
+        recipients = sorted({notification.recipient for notification in notifications})
+        # Stable for a given set of notifications so a retried call carries
+        # the same key as the one that may have gone through
+        idempotency_key = notifications[0].idempotency_key
+        if len(notifications) > 1:
+            idempotency_key = hashlib.sha256('\0'.join(
+                sorted(notification.idempotency_key for notification in notifications)
+            ).encode()).hexdigest()
+
+        try:
+            with metrics.span("send_sms"):
+                entries = self.provider.send(recipients, message, idempotency_key)
+        except ProviderError as error:
+            logger.warning("SMS provider error : {}".format(error))
+            return {
+                notification.id: (None, str(error), None)
+                for notification in notifications
+            }
+
+        outcomes = {}
+        for notification in notifications:
+            entry = entries.get(notification.recipient)
+            if entry is None:
+                outcomes[notification.id] = (None, "Missing from the provider's response", None)
+            elif entry.get('statusCode') in SENT_STATUS_CODES:
+                outcomes[notification.id] = (NotificationStatus.sent, '', entry)
+            elif entry.get('statusCode') in RETRYABLE_STATUS_CODES:
+                outcomes[notification.id] = (None, entry.get('status', ''), entry)
+            else:
+                outcomes[notification.id] = (NotificationStatus.failed, entry.get('status', ''), entry)
+        return outcomes
+
+    @db_session
+    def record(self, notifications: list, outcomes: dict):
+        now = dt.utcnow()
+        rows = []
+        for claimed in notifications:
+            status, error, entry = outcomes[claimed.id]
+            if status is None:
+                if claimed.attempts < settings.SMS_MAX_ATTEMPTS:
+                    status = NotificationStatus.queued
+                else:
+                    status = NotificationStatus.failed
+
+            next_attempt_at = None
+            if status == NotificationStatus.queued:
+                next_attempt_at = now + timedelta(seconds=backoff(claimed.attempts))
+            elif status == NotificationStatus.failed:
+                logger.warning("SMS to {} failed for good : {}".format(claimed.recipient, error))
+
+            rows.append((
+                claimed.id, status.name, error, now,
+                Json(entry) if entry is not None else None,
+                now if status == NotificationStatus.sent else None,
+                next_attempt_at
+            ))
+
+        execute_values(
+            models.db.get_connection().cursor(),
+            RECORD_OUTCOMES,
+            rows,
+            template="(%s::uuid, %s, %s, %s::timestamp, %s::jsonb, %s::timestamp, %s::timestamp)"
+        )
+
+
+notifier = None
+
+
+def start():
+    global notifier
+    notifier = Notifier(get_provider())
+    notifier.start()
+
+
+def stop():
+    if notifier is not None:
+        notifier.stop(settings.SMS_READ_TIMEOUT + settings.SMS_CONNECT_TIMEOUT)
+
+
+def wake():
+    if notifier is not None:
+        notifier.wake()
+
+
+if __name__ == '__main__':
+    logs.setup()
+    Notifier(get_provider()).run()
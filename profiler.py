@@ -0,0 +1,159 @@
+"""
+Per request SQL profile, for finding requests that run more queries
+than they should.
+
+With SQL_PROFILE on every request counts and times its queries, sends
+the totals back in the Server-Timing and X-SQL-Queries headers and logs
+them with the queries it ran SQL_PROFILE_REPEATS times or more. Those
+are N+1 candidates, typically Pony loading a relationship one row at a
+time, e.g submission.question.exam for every submission of a list.
+
+Tests can hold code to a number of queries whatever SQL_PROFILE is:
+
+    with profiler.query_budget(5):
+        client.post("/api/v1/exam/submission", ...)
+"""
+import re
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from loguru import logger
+
+import dbpool
+import settings
+
+
+class QueryBudgetExceeded(AssertionError):
+    """The block ran more queries than its budget."""
+
+
+def query_shape(query):
+    """The query with its literals taken out, so repeats of it look alike."""
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    query = " ".join(query.split())
+    query = re.sub(r"'(?:[^']|'')*'", "?", query)
+    query = re.sub(r"\b\d+(?:\.\d+)?\b", "?", query)
+    # IN lists of any length
+    return re.sub(r"\(\?(?:, \?)*\)", "(?)", query)
+
+
+class Profile:
+    """The queries run while it is current, also added to its parent's."""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.count = 0
+        self.seconds = 0.0
+        # [count, seconds] by query shape
+        self.shapes = {}
+
+    def record(self, query, seconds: float):
+        profile = self
+        shape = query_shape(query)
+        while profile is not None:
+            profile.count += 1
+            profile.seconds += seconds
+            totals = profile.shapes.setdefault(shape, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            profile = profile.parent
+
+    def repeated(self, times: int = None):
+        """(shape, count, seconds) of the queries run times or more, most run first."""
+        times = times or settings.SQL_PROFILE_REPEATS
+        return sorted(
+            (
+                (shape, count, seconds)
+                for shape, (count, seconds) in self.shapes.items()
+                if count >= times
+            ),
+            key=lambda repeat: -repeat[1]
+        )
+
+
+current = ContextVar("sql_profile", default=None)
+
+
+def query_finished(query, seconds: float):
+    profile = current.get()
+    if profile is not None:
+        profile.record(query, seconds)
+
+
+dbpool.query_observers.append(query_finished)
+
+
+@contextmanager
+def query_budget(max_queries: int, max_repeats: int = None):
+    """
+    Raises QueryBudgetExceeded once the block ran more than max_queries
+    queries, or one query more than max_repeats times.
+    """
+    profile = Profile(current.get())
+    token = current.set(profile)
+    try:
+        yield profile
+    finally:
+        current.reset(token)
+
+    if profile.count > max_queries:
+        raise QueryBudgetExceeded("{} queries run, the budget is {} : {}".format(
+            profile.count, max_queries, list(profile.shapes)
+        ))
+    if max_repeats is not None:
+        repeated = profile.repeated(max_repeats + 1)
+        if repeated:
+            raise QueryBudgetExceeded("Queries run more than {} times : {}".format(
+                max_repeats, [(shape, count) for shape, count, _ in repeated]
+            ))
+
+
+class ProfilerMiddleware:
+    """Profiles every request, only added with SQL_PROFILE on."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(current.get())
+        token = current.set(profile)
+        started = time.monotonic()
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-sql-queries", str(profile.count).encode()),
+                    (b"server-timing", 'db;dur={:.1f};desc="{} queries"'.format(
+                        profile.seconds * 1000, profile.count
+                    ).encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            current.reset(token)
+            endpoint = getattr(scope.get("endpoint"), "__name__", "-")
+            repeated = profile.repeated()
+            logger.bind(
+                endpoint=endpoint,
+                queries=profile.count,
+                db_ms=round(profile.seconds * 1000, 1),
+                repeated=[dict(query=shape, count=count) for shape, count, _ in repeated]
+            ).log(
+                "WARNING" if repeated else "INFO",
+                "SQL profile of {} : {} queries in {:.1f} ms of {:.1f} ms{}",
+                endpoint, profile.count, profile.seconds * 1000,
+                (time.monotonic() - started) * 1000,
+                "".join(
+                    "\n    N+1 candidate, {} times : {}".format(count, shape)
+                    for shape, count, _ in repeated
+                )
+            )
@@ -0,0 +1,19 @@
+import sys
+
+from loguru import logger
+
+import core
+
+
+if __name__ == '__main__':
+    # python reconcile.py [--fix]
+    fix = '--fix' in sys.argv[1:]
+
+    drift = core.reconcile_performance(fix=fix)
+
+    logger.info(
+        "{} drifted record(s) found{}".format(
+            len(drift), ", fixed" if fix and drift else ""
+        )
+    )
+    sys.exit(1 if drift and not fix else 0)
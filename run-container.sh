@@ -7,4 +7,10 @@ dbmate up
 
 # python app/seed.py
 
-exec gunicorn main:app -w 4 -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8000
+# Workers write their metrics to files in this directory for GET /metrics
+# to add up, the ones of a previous run would be added too
+export prometheus_multiproc_dir=${prometheus_multiproc_dir:-/tmp/educator_api_metrics}
+rm -rf "$prometheus_multiproc_dir"
+mkdir -p "$prometheus_multiproc_dir"
+
+exec gunicorn main:app -c gunicorn.conf.py -w 4 -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8000
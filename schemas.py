@@ -19,6 +19,24 @@ class User(BaseModel):
     class Config:
         orm_mode = True
 
+class SignIn(BaseModel):
+    username : str
+    password : str
+
+class RefreshToken(BaseModel):
+    refresh_token : str
+
+class Token(BaseModel):
+    access_token : str
+    token_type : str
+    expires_in : int
+    refresh_token : str
+    refresh_expires_in : int
+
+class SignOut(BaseModel):
+    session : UUID
+    signed_out : bool
+
 class Question(BaseModel):
     exam_id : str
     text : str
@@ -26,6 +44,12 @@ class Question(BaseModel):
     marks : int
     answer : str
 
+class BulkQuestion(BaseModel):
+    text : str
+    multi_choice : List[str] = None # If None then free_text
+    marks : int
+    answer : str
+
 class ExamOut(BaseModel):
     id : UUID
     name : str
@@ -44,21 +68,19 @@ class QuestionOut(BaseModel):
     multi_choice : List[str] = None # If None then free_text
     marks : int
     answer : str = None
-    exam : ExamOut
+    metadata : dict
+    exam : UUID
     created_at: datetime
     updated_at: datetime
 
-    class Config:
-        orm_mode = True
-
 class Exam(BaseModel):
     name : str
     video_tutorial_name : str = None
 
 class StartExam(BaseModel):
     exam_id : str
-    duration : int = None
-    alert_after : List[int] = None
+    duration : int = None # minutes, at most the exam's time_duration
+    alert_after : List[int] = None # minutes after the start
 
 class Participant(BaseModel):
     exam_id : str
@@ -68,11 +90,21 @@ class Submission(BaseModel):
     question_id : str
     answer : str
 
+class Answer(BaseModel):
+    question_id : str
+    answer : str
+
+class AnswerSheet(BaseModel):
+    answers : List[Answer]
+
 class MarkSubmission(BaseModel):
     submission_id : str
     mark : str # tick or cross
     marks : int = None
 
+class MarkingBatch(BaseModel):
+    submissions : List[MarkSubmission]
+
 class Grade(BaseModel):
     id : UUID
     starting_percentage : int
@@ -94,14 +126,12 @@ class Performance(BaseModel):
     total_marks : int
     total_number_of_questions : int
     percentage : int
-    grade : Grade
-    exam : ExamOut
-    user : User
+    metadata : dict
+    grade : UUID
+    exam : UUID
+    user : UUID
     created_at: datetime
     updated_at: datetime
-
-    class Config:
-        orm_mode = True
     
 class SubmissionOut(BaseModel):
     id : UUID
@@ -109,18 +139,19 @@ class SubmissionOut(BaseModel):
     mark : Mark
     marks_obtained : int
     comment : str = None
-    question : QuestionOut
-    user : User
+    metadata : dict
+    question : UUID
+    user : UUID
     created_at: datetime
     updated_at: datetime
 
-    class Config:
-        orm_mode = True
-
 class Notification(BaseModel):
     user_id : str
     message : str
 
+class ExamNotification(BaseModel):
+    message : str
+
 class Mentorship(BaseModel):
     tutor_id : str
     challenge_being_faced : str
@@ -130,13 +161,24 @@ class MentorshipOut(BaseModel):
     tutor : UUID
     challenge_being_faced : str
     is_active : bool
+    metadata : dict
+    user : UUID
     created_at: datetime
     updated_at: datetime
 
-    class Config:
-        orm_mode = True
-
 
 class UploadedFile(BaseModel):
     file_name : str
-    content_type : str
\ No newline at end of file
+    content_type : str
+
+class VideoUpload(BaseModel):
+    file_name : str
+    size : int
+    sha256 : str = None
+
+class VideoUploadOut(BaseModel):
+    upload_id : str
+    file_name : str
+    size : int
+    offset : int
+    max_chunk_size : int
@@ -26,7 +26,7 @@ def create_user(username : str, password : str, phone_number : str, email : str,
 @db_session
 def populate_grades():
     grades = [
-        dict(starting_percentage=0, ending_percentage=65, letter_grade="E/F", four_point_zero_grade=0.0),
+        dict(starting_percentage=0, ending_percentage=64, letter_grade="E/F", four_point_zero_grade=0.0),
         dict(starting_percentage=65, ending_percentage=66, letter_grade="D", four_point_zero_grade=1.0),
         dict(starting_percentage=67, ending_percentage=69, letter_grade="D+", four_point_zero_grade=1.3),
         dict(starting_percentage=70, ending_percentage=72, letter_grade="C-", four_point_zero_grade=1.7),
@@ -0,0 +1,97 @@
+"""
+JSON responses of the API written by orjson.
+
+FastAPI validates what an endpoint returns against its response model,
+then converts it with jsonable_encoder before the response class encodes
+it, walking every value in Python twice more. Routes of the v1 router
+skip both for content core returns as Projected: the columns of the
+response model only, written by orjson as they are, UUID, datetime and
+Enum values included. The response model then only documents them.
+
+    return serialization.Projected(serialization.columns(question, QUESTION_COLUMNS))
+
+Anything else an endpoint returns goes through FastAPI as before, e.g
+entities and objects its response model picks the fields of.
+"""
+import uuid
+import asyncio
+
+from decimal import Decimal
+from functools import wraps
+
+import asyncpg
+import orjson
+
+from fastapi.routing import APIRoute
+
+from starlette import responses
+
+
+def default(value):
+    """Values orjson doesn't write itself."""
+    if isinstance(value, asyncpg.Record):
+        return dict(value)
+    # asyncpg's UUIDs are a subclass orjson doesn't take for one
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError("{} is not JSON serializable".format(type(value).__name__))
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=default)
+
+
+def columns(entity, names: tuple):
+    """The named columns of a Pony entity, references as their primary keys."""
+    row = {}
+    for name in names:
+        value = getattr(entity, name)
+        # Reading the key of a reference doesn't load the row it points at
+        row[name] = value.get_pk() if hasattr(value, "get_pk") else value
+    return row
+
+
+class JSONResponse(responses.JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+class Projected:
+    """Content shaped as its route's response model already."""
+
+    __slots__ = ("content",)
+
+    def __init__(self, content):
+        self.content = content
+
+    def __repr__(self):
+        return "Projected({!r})".format(self.content)
+
+
+def respond(content, status_code: int):
+    if isinstance(content, Projected):
+        return JSONResponse(content.content, status_code=status_code)
+    return content
+
+
+class JSONRoute(APIRoute):
+    """APIRoute writing the Projected content of its endpoint with dumps."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        status_code = kwargs.get("status_code") or 200
+
+        # FastAPI reads the endpoint's parameters through wraps
+        if asyncio.iscoroutinefunction(endpoint):
+            @wraps(endpoint)
+            async def projecting_endpoint(*args, **kwargs):
+                return respond(await endpoint(*args, **kwargs), status_code)
+        else:
+            @wraps(endpoint)
+            def projecting_endpoint(*args, **kwargs):
+                return respond(endpoint(*args, **kwargs), status_code)
+
+        super().__init__(path, projecting_endpoint, **kwargs)
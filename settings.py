@@ -11,6 +11,25 @@ DEBUG = config('DEBUG', cast=bool, default=False)
 
 ENVIRONMENT = config('ENVIRONMENT', default='staging')
 
+# DEBUG logs everything as readable text, otherwise INFO and above as
+# JSON. Requests get one access record each, sampled at this rate unless
+# their endpoint has its own e.g create_submission=0.01,get_user=0.1.
+# Failed requests and slow ones (seconds) are always logged, like slow
+# queries. LOG_SQL also logs every statement of the sync endpoints
+LOG_LEVEL = config('LOG_LEVEL', default='DEBUG' if DEBUG else 'INFO')
+LOG_FORMAT = config('LOG_FORMAT', default='text' if DEBUG else 'json')
+LOG_REQUEST_SAMPLE_RATE = config('LOG_REQUEST_SAMPLE_RATE', cast=float, default=1.0 if DEBUG else 0.1)
+LOG_REQUEST_SAMPLE_RATES = config('LOG_REQUEST_SAMPLE_RATES', default='')
+LOG_SLOW_REQUEST_THRESHOLD = config('LOG_SLOW_REQUEST_THRESHOLD', cast=float, default=1.0)
+LOG_SLOW_QUERY_THRESHOLD = config('LOG_SLOW_QUERY_THRESHOLD', cast=float, default=0.2)
+LOG_SQL = config('LOG_SQL', cast=bool, default=False)
+
+# Counts and times the queries of every request, sent back in the
+# X-SQL-Queries and Server-Timing headers and logged with the queries
+# run SQL_PROFILE_REPEATS times or more by one request (N+1 candidates)
+SQL_PROFILE = config('SQL_PROFILE', cast=bool, default=False)
+SQL_PROFILE_REPEATS = config('SQL_PROFILE_REPEATS', cast=int, default=3)
+
 SECRET_KEY = config('SECRET_KEY', cast=Secret)
 
 DB_USER = config('DB_USER')
@@ -21,6 +40,135 @@ DB_PORT = config('DB_PORT', default='5432')
 
 DATABASE_URL = config('DATABASE_URL')
 
+# Connections per worker of the asyncio pool used by the async endpoints
+# and of the pool shared by the threads running the sync ones. Workers
+# times both maximums has to stay below Postgres' max_connections
+DB_POOL_MIN_SIZE = config('DB_POOL_MIN_SIZE', cast=int, default=10)
+DB_POOL_MAX_SIZE = config('DB_POOL_MAX_SIZE', cast=int, default=20)
+DB_SYNC_POOL_MIN_SIZE = config('DB_SYNC_POOL_MIN_SIZE', cast=int, default=2)
+DB_SYNC_POOL_MAX_SIZE = config('DB_SYNC_POOL_MAX_SIZE', cast=int, default=10)
+# Seconds a request waits for a free connection before it gets a 503
+DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', cast=float, default=10)
+# Seconds before idle connections are closed and before any connection
+# is replaced
+DB_POOL_IDLE_TIMEOUT = config('DB_POOL_IDLE_TIMEOUT', cast=float, default=300)
+DB_POOL_MAX_LIFETIME = config('DB_POOL_MAX_LIFETIME', cast=float, default=1800)
+# Connections idle for longer than the interval (seconds) are checked
+# with the query before they are used
+DB_POOL_HEALTH_CHECK_QUERY = config('DB_POOL_HEALTH_CHECK_QUERY', default='SELECT 1')
+DB_POOL_HEALTH_CHECK_INTERVAL = config('DB_POOL_HEALTH_CHECK_INTERVAL', cast=float, default=30)
+# Server side prepared statements kept per connection of the asyncio pool
+DB_STATEMENT_CACHE_SIZE = config('DB_STATEMENT_CACHE_SIZE', cast=int, default=100)
+
+# Verified credentials are remembered so bcrypt doesn't run on every request
+AUTH_CACHE_SIZE = config('AUTH_CACHE_SIZE', cast=int, default=10000)
+AUTH_CACHE_TTL = config('AUTH_CACHE_TTL', cast=int, default=300)
+# Seconds bearer tokens of POST /auth/token are valid for, access tokens
+# of signed out sessions are refused until they expire (see tokens.py).
+# Without the event bus revocations are read from the database every
+# TOKEN_RELOAD_INTERVAL seconds
+TOKEN_TTL = config('TOKEN_TTL', cast=int, default=900)
+REFRESH_TOKEN_TTL = config('REFRESH_TOKEN_TTL', cast=int, default=604800)
+TOKEN_RELOAD_INTERVAL = config('TOKEN_RELOAD_INTERVAL', cast=float, default=30)
+# Leaderboard pages hold this many performances unless a limit is asked for
+LEADERBOARD_PAGE_SIZE = config('LEADERBOARD_PAGE_SIZE', cast=int, default=50)
+LEADERBOARD_MAX_PAGE_SIZE = config('LEADERBOARD_MAX_PAGE_SIZE', cast=int, default=500)
+# Rows read from the database, and written out, at a time by exports
+EXPORT_FETCH_SIZE = config('EXPORT_FETCH_SIZE', cast=int, default=1000)
+
+# Exam statistics are cached until a submission or mark of the exam, or
+# for this many seconds in case an event from another worker was missed
+EXAM_STATS_CACHE_SIZE = config('EXAM_STATS_CACHE_SIZE', cast=int, default=1000)
+EXAM_STATS_CACHE_TTL = config('EXAM_STATS_CACHE_TTL', cast=float, default=60)
+
+# Learners' exam papers are kept per worker, and in redis when the url
+# is set so a paper is built once for all workers
+PAPER_CACHE_SIZE = config('PAPER_CACHE_SIZE', cast=int, default=1000)
+PAPER_CACHE_TTL = config('PAPER_CACHE_TTL', cast=float, default=3600)
+PAPER_CACHE_REDIS_URL = config('PAPER_CACHE_REDIS_URL', default='')
+
+# Seconds the grade bands are kept in memory before they are read again
+GRADE_CACHE_TTL = config('GRADE_CACHE_TTL', cast=float, default=300)
+
+# Videos are streamed in chunks of this many bytes
+VIDEO_CHUNK_SIZE = config('VIDEO_CHUNK_SIZE', cast=int, default=1024 * 1024)
+# Requests asking for more ranges than this get the whole file
+VIDEO_MAX_RANGES = config('VIDEO_MAX_RANGES', cast=int, default=16)
+
+# Upload limits (bytes) and how long an unfinished upload is kept (seconds)
+VIDEO_MAX_UPLOAD_SIZE = config('VIDEO_MAX_UPLOAD_SIZE', cast=int, default=4 * 1024 ** 3)
+VIDEO_UPLOAD_MAX_CHUNK_SIZE = config('VIDEO_UPLOAD_MAX_CHUNK_SIZE', cast=int, default=16 * 1024 ** 2)
+VIDEO_UPLOAD_TTL = config('VIDEO_UPLOAD_TTL', cast=int, default=24 * 60 * 60)
+
+# Where videos are stored by their SHA-256, local or s3
+STORAGE_DRIVER = config('STORAGE_DRIVER', default='local')
+STORAGE_ROOT = config('STORAGE_ROOT', default='videos/blobs')
+S3_BUCKET = config('S3_BUCKET', default='')
+S3_PREFIX = config('S3_PREFIX', default='videos/')
+S3_REGION = config('S3_REGION', default='')
+# e.g http://localhost:9000 for a local MinIO
+S3_ENDPOINT_URL = config('S3_ENDPOINT_URL', default='')
+S3_ACCESS_KEY = config('S3_ACCESS_KEY', default='')
+S3_SECRET_KEY = config('S3_SECRET_KEY', cast=Secret, default='')
+
+# Maximum number of questions accepted by a single bulk import
+QUESTION_BULK_MAX_ROWS = config('QUESTION_BULK_MAX_ROWS', cast=int, default=1000)
+# Maximum number of submissions marked by a single batch
+MARKING_BATCH_MAX_ROWS = config('MARKING_BATCH_MAX_ROWS', cast=int, default=500)
+# Marking queue pages hold this many submissions unless a limit is asked for
+MARKING_QUEUE_PAGE_SIZE = config('MARKING_QUEUE_PAGE_SIZE', cast=int, default=50)
+MARKING_QUEUE_MAX_PAGE_SIZE = config('MARKING_QUEUE_MAX_PAGE_SIZE', cast=int, default=500)
+
+# Seconds submissions are still accepted after a learner's deadline, for
+# answers sent just in time. With EXAM_START_REQUIRED learners have to
+# start the exam before they can submit answers.
+EXAM_DEADLINE_GRACE = config('EXAM_DEADLINE_GRACE', cast=float, default=30)
+EXAM_START_REQUIRED = config('EXAM_START_REQUIRED', cast=bool, default=False)
+
+# incremental: apply per-submission deltas to the Performance row
+# full: rescan the exam's questions and the learner's submissions
+PERFORMANCE_REVIEW_MODE = config('PERFORMANCE_REVIEW_MODE', default='incremental')
+
+# Events of one worker reach the others through Postgres LISTEN/NOTIFY
+# unless BUS_ENABLED is off. Seconds events are collected for before
+# they are sent together and between attempts to reconnect the listener
+BUS_ENABLED = config('BUS_ENABLED', cast=bool, default=True)
+BUS_FLUSH_INTERVAL = config('BUS_FLUSH_INTERVAL', cast=float, default=0.05)
+BUS_RECONNECT_INTERVAL = config('BUS_RECONNECT_INTERVAL', cast=float, default=5)
+
+# Live updates (server sent events). local only reaches the subscribers
+# of the worker the change was made on, postgres those of every worker
+# through the event bus. Subscribers per worker, events a slow
+# subscriber may fall behind by before it's disconnected and seconds
+# between batches of events and between heartbeats
+LIVE_BACKEND = config('LIVE_BACKEND', default='postgres')
+LIVE_MAX_SUBSCRIBERS = config('LIVE_MAX_SUBSCRIBERS', cast=int, default=10000)
+LIVE_MAX_PENDING = config('LIVE_MAX_PENDING', cast=int, default=10000)
+LIVE_COALESCE_INTERVAL = config('LIVE_COALESCE_INTERVAL', cast=float, default=0.5)
+LIVE_HEARTBEAT_INTERVAL = config('LIVE_HEARTBEAT_INTERVAL', cast=float, default=15)
+
+# SMS are sent from an outbox by a worker thread in each API process
+# unless SMS_WORKER_ENABLED is off (then run python notifier.py).
+# SMS_PROVIDER is africastalking, or fake to only log messages
+SMS_PROVIDER = config('SMS_PROVIDER', default='africastalking')
+SMS_WORKER_ENABLED = config('SMS_WORKER_ENABLED', cast=bool, default=True)
+# Seconds between outbox polls when there is nothing to send
+SMS_POLL_INTERVAL = config('SMS_POLL_INTERVAL', cast=float, default=2)
+# Notifications claimed per round, and recipients per provider call
+SMS_CLAIM_SIZE = config('SMS_CLAIM_SIZE', cast=int, default=500)
+SMS_BATCH_SIZE = config('SMS_BATCH_SIZE', cast=int, default=100)
+# Provider calls in flight at once per worker
+SMS_MAX_CONCURRENCY = config('SMS_MAX_CONCURRENCY', cast=int, default=4)
+# Seconds claimed notifications stay reserved, they are picked up again
+# afterwards should the worker die mid send
+SMS_LEASE = config('SMS_LEASE', cast=int, default=300)
+SMS_MAX_ATTEMPTS = config('SMS_MAX_ATTEMPTS', cast=int, default=5)
+# Retry n waits up to SMS_BACKOFF_BASE * 2^(n-1) seconds, at most SMS_BACKOFF_MAX
+SMS_BACKOFF_BASE = config('SMS_BACKOFF_BASE', cast=float, default=30)
+SMS_BACKOFF_MAX = config('SMS_BACKOFF_MAX', cast=float, default=3600)
+SMS_CONNECT_TIMEOUT = config('SMS_CONNECT_TIMEOUT', cast=float, default=5)
+SMS_READ_TIMEOUT = config('SMS_READ_TIMEOUT', cast=float, default=30)
+
 AFRICASTALKING_API_KEY = config('AFRICASTALKING_API_KEY', cast=Secret)
 AFRICASTALKING_API_SENDER_ID = config('AFRICASTALKING_API_SENDER_ID')
 AFRICASTALKING_API_URL = config('AFRICASTALKING_API_URL')
@@ -32,8 +180,17 @@ roles = dict(
     add_participant=[Role.tutor],
     create_question=[Role.tutor],
     create_submission=[Role.learner],
+    start_exam=[Role.learner],
+    subscribe_performance=[Role.learner, Role.tutor],
     mark_submission=[Role.tutor],
+    get_marking_queue=[Role.tutor],
     get_exam_performance=[Role.tutor],
+    get_exam_leaderboard=[Role.tutor],
+    export_exam_performance=[Role.tutor],
+    get_exam_stats=[Role.tutor],
+    get_exam_paper=[Role.learner, Role.tutor],
     notify_user=[Role.tutor, Role.staff, Role.admin],
-    request_form_mentorship=[Role.learner]
+    notify_participants=[Role.tutor, Role.staff, Role.admin],
+    request_form_mentorship=[Role.learner],
+    get_stats=[Role.staff, Role.admin]
 )
\ No newline at end of file
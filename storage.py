@@ -0,0 +1,132 @@
+import os
+
+from starlette.concurrency import run_in_threadpool
+
+import media
+import settings
+import util
+
+
+class LocalStorage:
+    """
+    Stores blobs on the local file system by their SHA-256, sharded by
+    the first two byte pairs of the digest e.g root/ab/cd/abcd....
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        util.mkdir_p(root)
+
+    def path(self, digest: str):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest: str):
+        return os.path.isfile(self.path(digest))
+
+    def put_file(self, source: str, digest: str, content_type: str):
+        """Moves the file at source into the store, unless the blob is already there."""
+        destination = self.path(digest)
+        if os.path.isfile(destination):
+            os.remove(source)
+            return False
+        util.mkdir_p(os.path.dirname(destination))
+        os.replace(source, destination)
+        return True
+
+    def stat(self, digest: str):
+        stat = os.stat(self.path(digest))
+        return stat.st_size, stat.st_mtime
+
+    def reader(self, digest: str):
+        return media.file_reader(self.path(digest))
+
+
+class S3Storage:
+    """
+    Stores blobs by their SHA-256 in an S3 compatible bucket, with the
+    same sharded layout as LocalStorage under prefix. S3_ENDPOINT_URL
+    points it at a stand-in such as MinIO for development and testing.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", **client_options):
+        # boto3 is only needed when this driver is configured
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", **client_options)
+
+    def key(self, digest: str):
+        return "{}{}/{}/{}".format(self.prefix, digest[:2], digest[2:4], digest)
+
+    def head(self, digest: str):
+        """The object's metadata, FileNotFoundError like os.stat if it's not there."""
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(digest))
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(self.key(digest))
+            raise
+
+    def exists(self, digest: str):
+        try:
+            self.head(digest)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put_file(self, source: str, digest: str, content_type: str):
+        stored = False
+        if not self.exists(digest):
+            self.client.upload_file(
+                source, self.bucket, self.key(digest),
+                ExtraArgs=dict(ContentType=content_type)
+            )
+            stored = True
+        os.remove(source)
+        return stored
+
+    def stat(self, digest: str):
+        head = self.head(digest)
+        return head["ContentLength"], head["LastModified"].timestamp()
+
+    def reader(self, digest: str):
+        key = self.key(digest)
+
+        async def read(start: int, end: int):
+            response = await run_in_threadpool(
+                self.client.get_object,
+                Bucket=self.bucket, Key=key,
+                Range="bytes={}-{}".format(start, end)
+            )
+            body = response["Body"]
+            try:
+                while True:
+                    chunk = await run_in_threadpool(
+                        body.read, settings.VIDEO_CHUNK_SIZE
+                    )
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                body.close()
+
+        return read
+
+
+def get_storage():
+    if settings.STORAGE_DRIVER == "s3":
+        client_options = dict(
+            endpoint_url=settings.S3_ENDPOINT_URL or None,
+            region_name=settings.S3_REGION or None
+        )
+        if settings.S3_ACCESS_KEY:
+            client_options["aws_access_key_id"] = settings.S3_ACCESS_KEY
+            client_options["aws_secret_access_key"] = str(settings.S3_SECRET_KEY)
+        return S3Storage(settings.S3_BUCKET, settings.S3_PREFIX, **client_options)
+
+    if settings.STORAGE_DRIVER != "local":
+        raise ValueError("Unknown STORAGE_DRIVER : {}".format(settings.STORAGE_DRIVER))
+
+    return LocalStorage(os.path.abspath(settings.STORAGE_ROOT))
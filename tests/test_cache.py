@@ -0,0 +1,42 @@
+"""
+ResultCache: results invalidated while they were computed aren't stored,
+and the invalidations it remembers stay within maxsize keys.
+"""
+from cache import ResultCache
+
+
+def test_result_invalidated_while_computed_is_not_stored():
+    results = ResultCache(maxsize=10, ttl=60)
+    generation = results.generation("exam")
+    results.invalidate("exam")
+    results.set("exam", "stale", generation)
+    assert results.get("exam") is None
+
+    generation = results.generation("exam")
+    results.invalidate("other exam")
+    results.set("exam", "fresh", generation)
+    assert results.get("exam") == "fresh"
+
+
+def test_generations_are_bounded():
+    results = ResultCache(maxsize=3, ttl=60)
+    generation = results.generation(0)
+    for key in range(100):
+        results.invalidate(key)
+    assert results.stats()["generations"] == 3
+
+    # Dropped from the LRU, the key still counts as invalidated
+    results.set(0, "stale", generation)
+    assert results.get(0) is None
+    results.set(0, "fresh", results.generation(0))
+    assert results.get(0) == "fresh"
+
+
+def test_clear_refuses_results_computed_before():
+    results = ResultCache(maxsize=10, ttl=60)
+    results.invalidate("exam")
+    generation = results.generation("exam")
+    results.clear()
+    assert results.stats()["generations"] == 0
+    results.set("exam", "stale", generation)
+    assert results.get("exam") is None
@@ -0,0 +1,53 @@
+"""
+MediaResponse: the background task runs once the body has been sent,
+and not when the client disconnects before that.
+"""
+import asyncio
+
+from starlette.background import BackgroundTask
+
+from media import MediaResponse
+
+
+def respond(chunks, disconnect=False):
+    """The ASGI messages sent, and whether the background task ran."""
+    ran = []
+    sent = []
+
+    async def body():
+        for chunk in chunks:
+            # Gives the disconnect listener a turn
+            await asyncio.sleep(0)
+            yield chunk
+
+    async def receive():
+        if disconnect:
+            return {"type": "http.disconnect"}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    async def background():
+        ran.append(True)
+
+    response = MediaResponse(body(), background=BackgroundTask(background))
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(response({"type": "http"}, receive, send))
+    finally:
+        loop.close()
+    return sent, bool(ran)
+
+
+def test_background_runs_after_the_body():
+    sent, ran = respond([b"a", b"b"])
+    assert [message.get("body") for message in sent[1:]] == [b"a", b"b", b""]
+    assert sent[-1]["more_body"] is False
+    assert ran
+
+
+def test_background_skipped_on_disconnect():
+    sent, ran = respond([b"a", b"b", b"c"], disconnect=True)
+    assert all(message.get("more_body", True) for message in sent)
+    assert not ran
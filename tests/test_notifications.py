@@ -0,0 +1,194 @@
+"""
+The SMS outbox: idempotency keys of notifications and broadcast jobs,
+and the claim, retry and backoff cycle of the notifier against
+notifier.FakeProvider.
+"""
+import uuid
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt
+from datetime import timedelta
+
+import pytest
+
+from fastapi import HTTPException
+from pony.orm import db_session
+
+from models import Exam
+from models import Notification
+from models import Participant
+from models import User
+from util import NotificationStatus
+from util import Role
+
+import core
+import notifier
+import seed
+import settings
+
+
+@pytest.fixture(scope="module")
+def users():
+    """(id, phone number) of a new tutor and two new learners."""
+    suffix = uuid.uuid4().hex[:8]
+    phone = int(suffix, 16) % 10 ** 7
+    with db_session:
+        created = [
+            seed.create_user(
+                "sms-{}-{}".format(suffix, i), "test-password", "+2552{:07d}{}".format(phone, i),
+                "sms-{}-{}@example.com".format(suffix, i), Role.tutor if i == 0 else Role.learner
+            )
+            for i in range(3)
+        ]
+        return [(user.id, user.phone_number) for user in created]
+
+
+@db_session
+def new_user(role: Role):
+    """The id of a new user, besides the ones of the users fixture."""
+    suffix = uuid.uuid4().hex[:8]
+    return seed.create_user(
+        "sms-{}-{}".format(role.name, suffix), "test-password", "+2554{:07d}0".format(int(suffix, 16) % 10 ** 7),
+        "sms-{}-{}@example.com".format(role.name, suffix), role
+    ).id
+
+
+@db_session
+def notification(notification_id):
+    return Notification[notification_id].to_dict()
+
+
+def test_idempotency_key_is_the_senders_own(users):
+    (tutor, _), (learner, _), (other_learner, _) = users
+    other_sender = uuid.uuid4()
+    key = uuid.uuid4().hex
+
+    first = core.enqueue_notification(tutor, str(learner), "Hello", key)
+    retried = core.enqueue_notification(tutor, str(learner), "Hello", key)
+    assert retried["id"] == first["id"]
+
+    # Another sender, or another recipient, reusing the key gets a
+    # notification of its own rather than the first one
+    guessed = core.enqueue_notification(other_sender, str(learner), "Hi", key)
+    assert guessed["id"] != first["id"]
+    assert guessed["message"] == "Hi"
+    other = core.enqueue_notification(tutor, str(other_learner), "Hello", key)
+    assert other["id"] != first["id"]
+    assert other["recipient"] != first["recipient"]
+
+
+def test_broadcast_idempotency_key_is_scoped_to_exam_and_sender(users):
+    (tutor, _), (learner, _), (other_learner, _) = users
+    with db_session:
+        exams = []
+        for participant in (learner, other_learner):
+            exam = Exam(name="sms-exam-{}".format(uuid.uuid4().hex), user=User[tutor])
+            Participant(exam=exam, user=User[participant])
+            exams.append(exam.id)
+    key = uuid.uuid4().hex
+
+    first = core.broadcast_notification(tutor, Role.tutor, str(exams[0]), "Hello", key)
+    assert first["total"] == 1
+    retried = core.broadcast_notification(tutor, Role.tutor, str(exams[0]), "Hello", key)
+    assert retried["job"] == first["job"]
+
+    # The same key for another exam, or from staff, is another job
+    other_exam = core.broadcast_notification(tutor, Role.tutor, str(exams[1]), "Hello", key)
+    assert other_exam["job"] != first["job"]
+    other_sender = core.broadcast_notification(new_user(Role.staff), Role.staff, str(exams[0]), "Hi", key)
+    assert other_sender["job"] != first["job"]
+
+
+def test_concurrent_broadcast_retries_get_one_job(users):
+    (tutor, _), (learner, _), _ = users
+    with db_session:
+        exam = Exam(name="sms-exam-{}".format(uuid.uuid4().hex), user=User[tutor])
+        Participant(exam=exam, user=User[learner])
+        exam = str(exam.id)
+    key = uuid.uuid4().hex
+    start = threading.Barrier(8)
+
+    def broadcast():
+        start.wait()
+        return core.broadcast_notification(tutor, Role.tutor, exam, "Hello", key)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        jobs = list(executor.map(lambda _: broadcast(), range(8)))
+
+    assert len({job["job"] for job in jobs}) == 1
+    assert all(job["total"] == 1 for job in jobs)
+
+
+def test_jobs_are_read_by_the_exams_tutor(users):
+    (tutor, _), (learner, _), _ = users
+    other_tutor = new_user(Role.tutor)
+    with db_session:
+        exam = Exam(name="sms-exam-{}".format(uuid.uuid4().hex), user=User[tutor])
+        Participant(exam=exam, user=User[learner])
+        exam = str(exam.id)
+    job = core.broadcast_notification(tutor, Role.tutor, exam, "Hello")["job"]
+
+    assert core.get_notification_job(tutor, Role.tutor, str(job))["total"] == 1
+    assert core.get_notification_job(new_user(Role.staff), Role.staff, str(job))["total"] == 1
+    with pytest.raises(HTTPException) as error:
+        core.get_notification_job(other_tutor, Role.tutor, str(job))
+    assert error.value.status_code == 404
+
+
+def test_claim_retry_and_backoff(users, monkeypatch):
+    (tutor, _), (learner, _), (failing_learner, failing_phone) = users
+    monkeypatch.setattr(settings, "SMS_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(settings, "SMS_BACKOFF_BASE", 30)
+    provider = notifier.FakeProvider(fail_numbers=[failing_phone])
+    outbox = notifier.Notifier(provider)
+
+    message = "Exam results are out {}".format(uuid.uuid4().hex)
+    delivered = core.enqueue_notification(tutor, str(learner), message)["id"]
+    retried = core.enqueue_notification(tutor, str(failing_learner), message)["id"]
+
+    # Both recipients of the message go out in one provider call
+    started = dt.utcnow()
+    outbox.drain()
+    calls = [call for call in provider.calls if call[1] == message]
+    assert len(calls) == 1
+    assert sorted(calls[0][0]) == sorted([
+        notification(delivered)["recipient"], failing_phone
+    ])
+
+    sent = notification(delivered)
+    assert sent["status"] == NotificationStatus.sent
+    assert sent["attempts"] == 1
+    assert sent["sent_at"] is not None
+
+    # A retryable error is queued again, after 15 to 30 s for a first attempt
+    queued = notification(retried)
+    assert queued["status"] == NotificationStatus.queued
+    assert queued["attempts"] == 1
+    assert queued["error"] == "Failed"
+    assert started + timedelta(seconds=15) <= queued["next_attempt_at"]
+    assert queued["next_attempt_at"] <= dt.utcnow() + timedelta(seconds=30)
+
+    # Not claimed again before it's due
+    outbox.drain()
+    assert len([call for call in provider.calls if call[1] == message]) == 1
+
+    with db_session:
+        Notification[retried].next_attempt_at = dt.utcnow() - timedelta(seconds=1)
+    outbox.drain()
+    calls = [call for call in provider.calls if call[1] == message]
+    assert len(calls) == 2
+    assert calls[1][0] == [failing_phone]
+
+    # SMS_MAX_ATTEMPTS reached, it's given up on
+    failed = notification(retried)
+    assert failed["status"] == NotificationStatus.failed
+    assert failed["attempts"] == 2
+    assert notification(delivered)["attempts"] == 1
+
+
+def test_backoff_doubles_up_to_the_maximum(monkeypatch):
+    monkeypatch.setattr(settings, "SMS_BACKOFF_BASE", 30)
+    monkeypatch.setattr(settings, "SMS_BACKOFF_MAX", 100)
+    for attempts, delay in ((1, 30), (2, 60), (3, 100), (10, 100)):
+        assert delay / 2 <= notifier.backoff(attempts) <= delay
@@ -0,0 +1,99 @@
+"""
+Queries run by the hot endpoints, so a change that adds one per row, an
+N+1, fails here rather than under load. Raise a budget only when the
+new query is meant to be there.
+"""
+import pytest
+
+
+API = "/api/v1"
+
+
+@pytest.fixture(scope="module")
+def answered(client, exam):
+    """The exam answered by every learner but the first."""
+    for learner in exam["learners"][1:]:
+        for question in exam["questions"]:
+            response = client.post(
+                API + "/exam/submission",
+                json=dict(question_id=question["id"], answer="A"),
+                headers=learner["headers"]
+            )
+            assert response.status_code == 201, response.text
+    return exam
+
+
+def test_create_submission(client, exam, query_budget):
+    learner = exam["learners"][0]
+    first, *others = exam["questions"]
+
+    # The first answer of a learner also creates the performance
+    with query_budget(8, max_repeats=1):
+        response = client.post(
+            API + "/exam/submission",
+            json=dict(question_id=first["id"], answer="A"),
+            headers=learner["headers"]
+        )
+    assert response.status_code == 201, response.text
+
+    for question in others:
+        with query_budget(6, max_repeats=1):
+            response = client.post(
+                API + "/exam/submission",
+                json=dict(question_id=question["id"], answer="B"),
+                headers=learner["headers"]
+            )
+        assert response.status_code == 201, response.text
+
+
+def test_get_exam_performance(client, answered, query_budget):
+    with query_budget(3, max_repeats=1):
+        response = client.get(
+            API + "/exam/{}/performance".format(answered["id"]), headers=answered["tutor"]
+        )
+    assert response.status_code == 200, response.text
+    assert len(response.json()) >= 2
+
+
+def test_get_marking_queue(client, answered, query_budget):
+    with query_budget(2, max_repeats=1):
+        response = client.get(
+            API + "/marking-queue?exam_id={}".format(answered["id"]), headers=answered["tutor"]
+        )
+    assert response.status_code == 200, response.text
+    assert response.json()["submissions"]
+
+
+def test_mark_submissions(client, answered, query_budget):
+    learners = {learner["id"] for learner in answered["learners"][1:]}
+    response = client.get(
+        API + "/marking-queue?exam_id={}".format(answered["id"]), headers=answered["tutor"]
+    )
+    submissions = [
+        submission for submission in response.json()["submissions"]
+        if submission["user"] in learners
+    ]
+    # Free text answers of two learners to two questions
+    assert len(submissions) == 4
+
+    # Every submission and performance is written on its own, and each
+    # grade given read once, anything else read per row is an N+1
+    with query_budget(15, max_repeats=len(submissions)):
+        response = client.post(
+            API + "/marking-queue/mark",
+            json=dict(submissions=[
+                dict(submission_id=submission["id"], mark="tick")
+                for submission in submissions
+            ]),
+            headers=answered["tutor"]
+        )
+    assert response.status_code == 200, response.text
+    assert response.json()["marked"] == len(submissions)
+
+
+def test_get_exam_leaderboard(client, answered, query_budget):
+    with query_budget(2, max_repeats=1):
+        response = client.get(
+            API + "/exam/{}/leaderboard".format(answered["id"]), headers=answered["tutor"]
+        )
+    assert response.status_code == 200, response.text
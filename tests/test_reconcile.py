@@ -0,0 +1,58 @@
+"""
+reconcile_performance checks the exam totals and every learner's
+Performance against the Question and Submission rows.
+"""
+import pytest
+
+from pony.orm import db_session
+
+from models import Exam
+from models import Performance
+
+import core
+
+
+API = "/api/v1"
+
+
+@pytest.fixture(scope="module")
+def answered(client, exam):
+    """The exam answered by its first learner."""
+    learner = exam["learners"][0]
+    for question in exam["questions"]:
+        response = client.post(
+            API + "/exam/submission",
+            json=dict(question_id=question["id"], answer="A"),
+            headers=learner["headers"]
+        )
+        assert response.status_code == 201, response.text
+    return exam
+
+
+def drift_of(drift, exam_id):
+    return {
+        record["user"] and str(record["user"]): record
+        for record in drift if str(record["exam"]) == exam_id
+    }
+
+
+def test_stale_totals_of_exam_and_learner_are_both_reported(answered):
+    learner = answered["learners"][0]["id"]
+    with db_session:
+        exam = Exam[answered["id"]]
+        totals = (exam.total_marks, exam.total_number_of_questions)
+        # The same stale totals on the exam and the learner's performance
+        exam.total_marks -= 5
+        exam.total_number_of_questions -= 1
+        performance = Performance.get(exam=exam, user=learner)
+        performance.total_marks -= 5
+        performance.total_number_of_questions -= 1
+
+    drift = drift_of(core.reconcile_performance(), answered["id"])
+    assert drift[None]["expected"] == dict(zip(("total_marks", "total_number_of_questions"), totals))
+    assert drift[learner]["expected"]["total_marks"] == totals[0]
+    assert drift[learner]["actual"]["total_marks"] == totals[0] - 5
+
+    drift = drift_of(core.reconcile_performance(fix=True), answered["id"])
+    assert set(drift) == {None, learner}
+    assert not drift_of(core.reconcile_performance(), answered["id"])
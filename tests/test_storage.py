@@ -0,0 +1,162 @@
+"""
+The storage drivers: blobs sharded by their SHA-256 and stored once
+however many times they are uploaded. S3Storage runs against botocore's
+Stubber, so no bucket is needed.
+"""
+import io
+import asyncio
+import hashlib
+import datetime
+
+import pytest
+
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+
+from storage import LocalStorage
+from storage import S3Storage
+
+import settings
+
+
+DATA = b"0123456789" * 10
+DIGEST = hashlib.sha256(DATA).hexdigest()
+
+
+def read(reader, start, end):
+    async def chunks():
+        return b"".join([chunk async for chunk in reader(start, end)])
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(chunks())
+    finally:
+        loop.close()
+
+
+def upload(tmp_path, data=DATA):
+    """A received upload waiting to be stored."""
+    source = tmp_path / "upload-{}".format(len(list(tmp_path.iterdir())))
+    source.write_bytes(data)
+    return str(source)
+
+
+@pytest.fixture
+def local(tmp_path):
+    return LocalStorage(str(tmp_path / "blobs"))
+
+
+def test_local_blobs_are_sharded_by_digest(local, tmp_path):
+    assert local.path(DIGEST) == str(
+        tmp_path / "blobs" / DIGEST[:2] / DIGEST[2:4] / DIGEST
+    )
+    assert not local.exists(DIGEST)
+
+    assert local.put_file(upload(tmp_path), DIGEST, "video/mp4")
+    assert local.exists(DIGEST)
+    assert (tmp_path / "blobs" / DIGEST[:2] / DIGEST[2:4] / DIGEST).read_bytes() == DATA
+
+
+def test_local_identical_upload_is_stored_once(local, tmp_path):
+    first = upload(tmp_path)
+    assert local.put_file(first, DIGEST, "video/mp4")
+    mtime = local.stat(DIGEST)[1]
+
+    second = upload(tmp_path)
+    assert not local.put_file(second, DIGEST, "video/mp4")
+    # The upload is dropped and the stored blob left as it was
+    assert [path.name for path in tmp_path.iterdir()] == ["blobs"]
+    assert local.stat(DIGEST) == (len(DATA), mtime)
+
+
+def test_local_reader_reads_inclusive_ranges(local, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "VIDEO_CHUNK_SIZE", 7)
+    local.put_file(upload(tmp_path), DIGEST, "video/mp4")
+    assert read(local.reader(DIGEST), 0, len(DATA) - 1) == DATA
+    assert read(local.reader(DIGEST), 5, 24) == DATA[5:25]
+
+
+def test_local_stat_of_a_missing_blob(local):
+    with pytest.raises(FileNotFoundError):
+        local.stat(DIGEST)
+
+
+@pytest.fixture
+def s3():
+    storage = S3Storage(
+        "videos", "blobs/", region_name="us-east-1",
+        aws_access_key_id="test", aws_secret_access_key="test"
+    )
+    with Stubber(storage.client) as stubber:
+        yield storage, stubber
+        stubber.assert_no_pending_responses()
+
+
+def head(stubber, key, found=True):
+    expected = dict(Bucket="videos", Key=key)
+    if found:
+        stubber.add_response("head_object", dict(
+            ContentLength=len(DATA),
+            LastModified=datetime.datetime(2026, 10, 18, tzinfo=datetime.timezone.utc)
+        ), expected)
+    else:
+        stubber.add_client_error(
+            "head_object", service_error_code="404", http_status_code=404,
+            expected_params=expected
+        )
+
+
+def test_s3_keys_are_sharded_like_local(s3):
+    storage, _ = s3
+    assert storage.key(DIGEST) == "blobs/{}/{}/{}".format(DIGEST[:2], DIGEST[2:4], DIGEST)
+
+
+def test_s3_new_blob_is_uploaded(s3, tmp_path):
+    storage, stubber = s3
+    head(stubber, storage.key(DIGEST), found=False)
+    stubber.add_response("put_object", {}, None)
+
+    source = upload(tmp_path)
+    assert storage.put_file(source, DIGEST, "video/mp4")
+    assert not list(tmp_path.iterdir())
+
+
+def test_s3_identical_upload_is_stored_once(s3, tmp_path):
+    storage, stubber = s3
+    head(stubber, storage.key(DIGEST))
+
+    # No put_object stubbed, an upload would fail the test
+    source = upload(tmp_path)
+    assert not storage.put_file(source, DIGEST, "video/mp4")
+    assert not list(tmp_path.iterdir())
+
+
+def test_s3_stat(s3):
+    storage, stubber = s3
+    head(stubber, storage.key(DIGEST))
+    head(stubber, storage.key(DIGEST), found=False)
+
+    size, last_modified = storage.stat(DIGEST)
+    assert size == len(DATA)
+    assert last_modified == datetime.datetime(2026, 10, 18, tzinfo=datetime.timezone.utc).timestamp()
+    with pytest.raises(FileNotFoundError):
+        storage.stat(DIGEST)
+
+
+def test_s3_other_errors_are_raised(s3):
+    storage, stubber = s3
+    stubber.add_client_error("head_object", service_error_code="403", http_status_code=403)
+    with pytest.raises(ClientError):
+        storage.exists(DIGEST)
+
+
+def test_s3_reader_reads_ranges(s3, monkeypatch):
+    monkeypatch.setattr(settings, "VIDEO_CHUNK_SIZE", 7)
+    storage, stubber = s3
+    stubber.add_response(
+        "get_object",
+        dict(Body=StreamingBody(io.BytesIO(DATA[5:25]), 20)),
+        dict(Bucket="videos", Key=storage.key(DIGEST), Range="bytes=5-24")
+    )
+    assert read(storage.reader(DIGEST), 5, 24) == DATA[5:25]
@@ -0,0 +1,96 @@
+"""
+Revocations of bearer access tokens read from the database, as a worker
+does when it starts, resyncs or runs without the event bus.
+"""
+import time
+import uuid
+import asyncio
+
+import pytest
+
+from pony.orm import db_session
+
+from models import User
+from util import Role
+from util import Status
+
+import seed
+import settings
+import tokens
+
+
+API = "/api/v1"
+PASSWORD = "test-password"
+
+
+@pytest.fixture
+def user():
+    suffix = uuid.uuid4().hex[:8]
+    with db_session:
+        return seed.create_user(
+            "token-" + suffix, PASSWORD, "+2556{:07d}0".format(int(suffix, 16) % 10 ** 7),
+            "token-{}@example.com".format(suffix), Role.learner
+        ).username
+
+
+def access_token(client, username: str):
+    response = client.post(API + "/auth/token", json=dict(username=username, password=PASSWORD))
+    assert response.status_code == 200, response.text
+    return response.json()["access_token"]
+
+
+@db_session
+def set_status(username: str, status: Status):
+    User.get(username=username).status = status
+
+
+def restart(monkeypatch):
+    """Forgets the revocations and reads them again, as a new worker."""
+    loop = asyncio.get_event_loop()
+    # Lets the event bus handle the user_status_changed event first, so
+    # only the database can tell the new revocations about the change
+    loop.run_until_complete(asyncio.sleep(0.5))
+    monkeypatch.setattr(tokens, "revocations", tokens.Revocations())
+    loop.run_until_complete(tokens.load_revocations())
+
+
+def test_deactivated_users_token_is_refused_after_a_restart(client, user, monkeypatch):
+    # Every endpoint checks bearer tokens with tokens.verify, in memory
+    token = access_token(client, user)
+    assert tokens.verify(token) is not None
+
+    set_status(user, Status.inactive)
+    restart(monkeypatch)
+    assert tokens.verify(token) is None
+
+    # Tokens issued once the user is active again are accepted
+    set_status(user, Status.active)
+    restart(monkeypatch)
+    assert tokens.verify(token) is None
+    assert tokens.verify(access_token(client, user)) is not None
+
+
+def test_revocations_are_reloaded_without_the_event_bus(client, user, monkeypatch):
+    token = access_token(client, user)
+    monkeypatch.setattr(settings, "BUS_ENABLED", False)
+    monkeypatch.setattr(settings, "TOKEN_RELOAD_INTERVAL", 0.1)
+
+    set_status(user, Status.inactive)
+    loop = asyncio.get_event_loop()
+    # As in restart, the event bus of the tests handles the event first
+    loop.run_until_complete(asyncio.sleep(0.5))
+    monkeypatch.setattr(tokens, "revocations", tokens.Revocations())
+    tokens.start()
+    try:
+        loop.run_until_complete(asyncio.sleep(0.5))
+    finally:
+        tokens.stop()
+    assert tokens.verify(token) is None
+
+
+def test_older_change_read_again_doesnt_undo_a_newer_one():
+    now = time.time()
+    revocations = tokens.Revocations()
+    revocations.revoke_user("learner", now)
+    revocations.revoke_user("learner", now - 60)
+    assert revocations.revoked(dict(sid="session", name="learner", iat=now - 30))
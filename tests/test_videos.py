@@ -0,0 +1,57 @@
+"""
+Video names resolve through the video index: exams can only point at
+videos that have been uploaded, and an indexed video whose blob has
+gone from storage is a 404.
+"""
+import hashlib
+import uuid
+
+import pytest
+
+from pony.orm import db_session
+
+from models import User
+from models import Video
+
+
+API = "/api/v1"
+
+
+@pytest.fixture
+def indexed_video(exam):
+    """The name of a video in the index whose blob was never stored."""
+    name = "video-{}.mp4".format(uuid.uuid4().hex)
+    with db_session:
+        Video(
+            name=name,
+            sha256=hashlib.sha256(name.encode()).hexdigest(),
+            size=1024,
+            content_type="video/mp4",
+            user=User[exam["learners"][0]["id"]]
+        )
+    return name
+
+
+def test_exam_with_an_unknown_video_is_refused(client, exam):
+    response = client.post(
+        API + "/exam",
+        json=dict(name="exam-" + uuid.uuid4().hex, video_tutorial_name="missing.mp4"),
+        headers=exam["tutor"]
+    )
+    assert response.status_code == 404, response.text
+
+
+def test_exam_with_an_indexed_video(client, exam, indexed_video):
+    response = client.post(
+        API + "/exam",
+        json=dict(name="exam-" + uuid.uuid4().hex, video_tutorial_name=indexed_video),
+        headers=exam["tutor"]
+    )
+    assert response.status_code == 201, response.text
+    assert response.json()["video_tutorial_name"] == indexed_video
+
+
+def test_indexed_video_whose_blob_is_gone_is_not_found(client, exam, indexed_video):
+    response = client.get(API + "/video/" + indexed_video, headers=exam["tutor"])
+    assert response.status_code == 404, response.text
+    assert indexed_video in response.json()["detail"]
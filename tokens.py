@@ -0,0 +1,241 @@
+"""
+Signed bearer tokens, so passwords are checked by bcrypt once per sign
+in rather than on every request.
+
+POST /auth/token trades a username and password for an access token,
+valid TOKEN_TTL seconds, and a refresh token valid REFRESH_TOKEN_TTL
+seconds. Requests then send "Authorization: Bearer <access token>",
+checked in memory: its HMAC-SHA256 under SECRET_KEY, its expiry and the
+revocations below. It carries the user's id, username, role and status.
+
+    <base64url claims>.<base64url signature>
+
+A refresh token stands for a session, a row of "session", so POST
+/auth/refresh finds out about sessions signed out on any worker. Access
+tokens of a signed out session are refused until they expire: every
+worker keeps the sessions revoked in the last TOKEN_TTL seconds, told
+through the event bus and read from the database when it starts or
+resyncs.
+
+Access tokens carry the user's status, ones issued before their status
+or password changed are refused too. Those changes are made outside the
+API, a trigger keeps their time in "user"."token_valid_after" and sends
+the user_status_changed event, and workers read the users changed in the
+last TOKEN_TTL seconds along with the sessions. Without the event bus
+both are read every TOKEN_RELOAD_INTERVAL seconds instead. A deleted
+user's tokens are only refused from the event, deactivate users instead.
+"""
+import hmac
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import threading
+
+from datetime import datetime as dt
+from datetime import timedelta
+from datetime import timezone
+from types import SimpleNamespace
+from uuid import UUID
+
+from loguru import logger
+
+from util import Role
+from util import Status
+
+import aiodb
+import bus
+import settings
+
+
+ACCESS = "access"
+REFRESH = "refresh"
+
+
+def b64encode(data: bytes):
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def b64decode(data: bytes):
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+def sign(payload: bytes):
+    return b64encode(hmac.new(
+        str(settings.SECRET_KEY).encode(), payload, hashlib.sha256
+    ).digest())
+
+
+def encode(claims: dict):
+    payload = b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return (payload + b"." + sign(payload)).decode()
+
+
+def decode(token: str, kind: str):
+    """The claims of a token of this kind signed by us and not expired, else None."""
+    try:
+        payload, _, signature = token.encode("ascii").partition(b".")
+        if not hmac.compare_digest(signature, sign(payload)):
+            return None
+        claims = json.loads(b64decode(payload))
+    except ValueError:
+        return None
+    if claims.get("typ") != kind or claims["exp"] <= time.time():
+        return None
+    return claims
+
+
+def issue(user, session: UUID):
+    """An access token of the user in session, and its claims."""
+    now = time.time()
+    claims = dict(
+        typ=ACCESS,
+        sub=str(user.id),
+        name=user.username,
+        role=user.role.name,
+        status=user.status.name,
+        sid=str(session),
+        # Milliseconds, revocations compare it to the time they were made
+        iat=round(now, 3),
+        exp=int(now + settings.TOKEN_TTL)
+    )
+    return encode(claims), claims
+
+
+def issue_refresh(user_id: UUID, session: UUID, expires_at: float):
+    return encode(dict(
+        typ=REFRESH,
+        sub=str(user_id),
+        sid=str(session),
+        iat=round(time.time(), 3),
+        exp=int(expires_at)
+    ))
+
+
+class Revocations:
+    """
+    Sessions and users whose access tokens are refused, each kept until
+    the last access token it applies to has expired.
+    """
+
+    def __init__(self):
+        # session id: time its access tokens have all expired
+        self._sessions = {}
+        # username: (tokens issued before, time those have all expired)
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def revoke_session(self, session: str, until: float):
+        with self._lock:
+            self._sessions[session] = max(until, self._sessions.get(session, 0))
+            self._purge()
+
+    def revoke_user(self, username: str, before: float):
+        with self._lock:
+            # A reload may read a change older than one already told of
+            before = max(before, self._users.get(username, (0, 0))[0])
+            self._users[username] = (before, before + settings.TOKEN_TTL)
+            self._purge()
+
+    def revoked(self, claims: dict):
+        # Read without the lock, a dict lookup is atomic
+        if claims["sid"] in self._sessions:
+            return True
+        user = self._users.get(claims["name"])
+        return user is not None and claims["iat"] < user[0]
+
+    def _purge(self):
+        # Called with the lock held
+        now = time.time()
+        for session, until in list(self._sessions.items()):
+            if until < now:
+                del self._sessions[session]
+        for username, (_, until) in list(self._users.items()):
+            if until < now:
+                del self._users[username]
+
+    def stats(self):
+        with self._lock:
+            return dict(sessions=len(self._sessions), users=len(self._users))
+
+
+revocations = Revocations()
+
+
+def verify(token: str):
+    """The user an access token was issued to, None if it's not valid."""
+    claims = decode(token, ACCESS)
+    if claims is None or revocations.revoked(claims):
+        return None
+    return SimpleNamespace(
+        id=UUID(claims["sub"]),
+        username=claims["name"],
+        role=Role[claims["role"]],
+        status=Status[claims["status"]],
+        session=UUID(claims["sid"])
+    )
+
+
+def revoke_session(session: UUID):
+    """Refuses the session's access tokens on every worker."""
+    until = time.time() + settings.TOKEN_TTL
+    revocations.revoke_session(str(session), until)
+    bus.publish("session_revoked", dict(session=str(session), until=until))
+
+
+def session_revoked(data: dict):
+    revocations.revoke_session(data["session"], data["until"])
+
+
+def timestamp(value: dt):
+    # The database keeps UTC times without their zone
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+async def load_revocations():
+    """
+    Reads the sessions signed out and the users changed recently, e.g
+    ones the event bus missed.
+    """
+    since = dt.utcnow() - timedelta(seconds=settings.TOKEN_TTL)
+    async with aiodb.acquire() as connection:
+        sessions = await connection.fetch(aiodb.SELECT_REVOKED_SESSIONS, since)
+        users = await connection.fetch(aiodb.SELECT_REVOKED_USERS, since)
+    for row in sessions:
+        revocations.revoke_session(
+            str(row["id"]), timestamp(row["revoked_at"]) + settings.TOKEN_TTL
+        )
+    for row in users:
+        revocations.revoke_user(row["username"], timestamp(row["token_valid_after"]))
+
+
+async def reload_revocations():
+    while True:
+        await asyncio.sleep(settings.TOKEN_RELOAD_INTERVAL)
+        try:
+            await load_revocations()
+        except Exception:
+            logger.exception("Token revocations not reloaded")
+
+
+reloader = None
+
+
+def start():
+    """Without the event bus nothing tells the worker of revocations."""
+    global reloader
+    if not settings.BUS_ENABLED:
+        reloader = asyncio.ensure_future(reload_revocations())
+
+
+def stop():
+    if reloader is not None:
+        reloader.cancel()
+
+
+def stats():
+    return revocations.stats()
+
+
+bus.subscribe("session_revoked", session_revoked)
@@ -1,7 +1,11 @@
 import os
+import json
+import base64
 import errno
+import asyncio
 import traceback
 from enum import Enum
+from typing import List
 
 from fastapi import status
 from fastapi import HTTPException
@@ -11,12 +15,26 @@ from functools import wraps
 
 from passlib.context import CryptContext
 
+from asyncpg import UniqueViolationError
+from psycopg2 import IntegrityError
+from psycopg2.extras import execute_values
+
+from pony.orm import flush
 from pony.orm.core import TransactionIntegrityError
 from pony.orm.dbapiprovider import StrConverter
 
+from dbpool import PoolTimeout
+
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+NDJSON_MEDIA_TYPES = (
+    "application/x-ndjson",
+    "application/ndjson",
+    "application/jsonlines",
+    "application/x-jsonlines"
+)
+
 class Status(Enum):
     active = 0
     inactive = 1
@@ -35,6 +53,12 @@ class Mark(Enum):
     auto_cross = 3
     unmarked = 4
 
+class NotificationStatus(Enum):
+    queued = 0
+    sending = 1
+    sent = 2
+    failed = 3
+
 
 class EnumConverter(StrConverter):
     def validate(self, val, obj=None):
@@ -75,23 +99,6 @@ def mkdir_p(path):
             else:
                 raise
 
-def logger_setup():
-    mkdir_p('{}/logs'.format(os.getcwd()))
-
-    logs_name = "logs/educator_api.log"
-
-    logger.add(
-        logs_name,
-        format="{time:YYYY-MM-DD at HH:mm:ss} | {level} | {message}",
-        rotation="12:00",
-        retention="30 days",
-        compression="zip",
-        enqueue=True,
-        backtrace=True,
-        diagnose=True
-    )
-
-
 def decorator(func):
     @wraps(func)
     def function_wrapper(*args, **kwargs):
@@ -103,30 +110,127 @@ def decorator(func):
     return function_wrapper
 
 
+def raise_http_exception(err: Exception):
+    """Logs err and raises it as the HTTPException the API responds with."""
+    if isinstance(err, HTTPException):
+        # Refused requests are the client's doing, they show in the access log
+        logger.debug("{} : {}", err.status_code, err.detail)
+        raise err
+    logger.error("{} : {}", type(err).__name__, err)
+    logger.opt(lazy=True).debug("{}", traceback.format_exc)
+    if isinstance(err, PoolTimeout):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The service is busy, please retry",
+            headers={"Retry-After": "1"}
+        )
+    if isinstance(err, (TransactionIntegrityError, IntegrityError, UniqueViolationError)):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=("This record cannot be submitted more than once")
+        )
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=str(err)
+    )
+
+
 def global_exception_handler(func):
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)
+        async def coroutine_wrapper(*args, **kwargs):
+            try:
+                response = await func(*args, **kwargs)
+            except Exception as err:
+                raise_http_exception(err)
+            logger.debug("{} returned {}", func.__name__, response)
+
+            return response
+        return coroutine_wrapper
+
     @wraps(func)
     def function_wrapper(*args, **kwargs):
         try:
             response = func(*args, **kwargs)
-        except HTTPException as err:
-            logger.error(err)
-            logger.debug(traceback.format_exc())
-            raise
-        except TransactionIntegrityError as err:
-            logger.error(err)
-            logger.debug(traceback.format_exc())
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=("This record cannot be submitted more than once")
-            )
         except Exception as err:
-            logger.error(err)
-            logger.debug(traceback.format_exc())
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=str(err)
-            )
-        logger.info(response)
+            raise_http_exception(err)
+        logger.debug("{} returned {}", func.__name__, response)
         
         return response
-    return function_wrapper
\ No newline at end of file
+    return function_wrapper
+
+
+def parse_json_rows(body: bytes, content_type: str = None):
+    """
+    Parses a request body holding either a JSON array or NDJSON (one JSON
+    document per line) into a list of rows. NDJSON lines that aren't valid
+    JSON are kept as strings so they can be reported per row.
+    """
+    media_type = (content_type or "").split(";")[0].strip().lower()
+
+    if media_type in NDJSON_MEDIA_TYPES:
+        rows = []
+        for line in body.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                rows.append(line.decode(errors="replace"))
+        return rows
+
+    try:
+        rows = json.loads(body)
+    except ValueError as err:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid JSON : {}".format(err)
+        )
+    if not isinstance(rows, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Expected a JSON array or NDJSON"
+        )
+    return rows
+
+
+async def read_body(request, limit: int):
+    """Reads a request body, refusing it with 413 once it exceeds limit bytes."""
+    body = bytearray()
+    async for piece in request.stream():
+        body.extend(piece)
+        if len(body) > limit:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Request body larger than {} bytes".format(limit)
+            )
+    return bytes(body)
+
+
+def encode_cursor(values: list):
+    """Opaque page cursor holding the keyset values of the last row of a page."""
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as err:
+        raise ValueError("Invalid cursor : {}".format(cursor)) from err
+
+
+def bulk_insert(db, table: str, columns: List[str], rows: List[tuple], page_size: int = 1000):
+    """
+    Inserts rows into table using multi-row INSERT statements on the
+    current db_session's connection, so they commit with the session.
+    """
+    flush()
+
+    sql = 'INSERT INTO "{}" ({}) VALUES %s'.format(
+        table, ", ".join('"{}"'.format(column) for column in columns)
+    )
+    cursor = db.get_connection().cursor()
+    execute_values(cursor, sql, rows, page_size=page_size)
+
+    return len(rows)